@@ -0,0 +1,24 @@
+"""add task sequence number
+
+Revision ID: 1d8f3b6a5c47
+Revises: 4a1c7e9b2d30
+Create Date: 2026-10-18 10:02:17.004391
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1d8f3b6a5c47'
+down_revision = '4a1c7e9b2d30'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('task', sa.Column('seq', sa.Integer, nullable=True))
+    op.create_index('task_playbook_seq_idx', 'task',
+                    ['playbook_id', 'seq'], unique=True)
+
+def downgrade():
+    op.drop_index('task_playbook_seq_idx', 'task')
+    op.drop_column('task', 'seq')
@@ -0,0 +1,41 @@
+"""add payload table
+
+Revision ID: 2c6a9e4f7b13
+Revises: 5b7e2c9d1f84
+Create Date: 2026-10-18 12:03:52.170446
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2c6a9e4f7b13'
+down_revision = '5b7e2c9d1f84'
+
+from alembic import op
+import sqlalchemy as sa
+import logging
+
+
+def upgrade():
+    op.create_table(
+        'payload',
+        sa.Column('hash', sa.String(40), primary_key=True),
+        sa.Column('data', sa.LargeBinary),
+        sa.Column('refcount', sa.Integer),
+    )
+    op.add_column('task',
+            sa.Column('payload_hash', sa.String(40), nullable=True))
+    try:
+        op.create_foreign_key('fk_task_payload', 'task', 'payload',
+                ['payload_hash'], ['hash'])
+    except NotImplementedError, e:
+        logging.info("Failed to create foreign key constraint: %s", str(e))
+    op.create_index('task_payload_hash_idx', 'task', ['payload_hash'])
+
+def downgrade():
+    # put deduplicated results back into their tasks
+    op.execute("UPDATE task SET data = (SELECT payload.data FROM payload "
+               "WHERE payload.hash = task.payload_hash) "
+               "WHERE payload_hash IS NOT NULL")
+    op.drop_index('task_payload_hash_idx', 'task')
+    op.drop_column('task', 'payload_hash')
+    op.drop_table('payload')
@@ -0,0 +1,42 @@
+"""add rollup tables
+
+Revision ID: 3f9d2b7e6a18
+Revises: 6e1f8a3c5d92
+Create Date: 2026-10-18 13:37:14.229580
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3f9d2b7e6a18'
+down_revision = '6e1f8a3c5d92'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'watermark',
+        sa.Column('name', sa.String(32), primary_key=True),
+        sa.Column('value', sa.Integer),
+    )
+    # filled in from existing tasks by 'ansible-report --rollup'
+    op.create_table(
+        'rollup',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('period', sa.String(8)),
+        sa.Column('bucket', sa.DateTime),
+        sa.Column('hostname', sa.String),
+        sa.Column('module', sa.String),
+        sa.Column('result', sa.String),
+        sa.Column('changed', sa.Boolean),
+        sa.Column('count', sa.Integer),
+    )
+    op.create_index('rollup_bucket_idx', 'rollup',
+                    ['period', 'bucket', 'hostname', 'module', 'result',
+                     'changed'], unique=True)
+
+def downgrade():
+    op.drop_index('rollup_bucket_idx', 'rollup')
+    op.drop_table('rollup')
+    op.drop_table('watermark')
@@ -0,0 +1,62 @@
+"""unique user index
+
+Revision ID: 4a1c7e9b2d30
+Revises: 16e310bda4a9
+Create Date: 2026-10-18 09:12:41.518204
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4a1c7e9b2d30'
+down_revision = '16e310bda4a9'
+
+from alembic import op
+import sqlalchemy as sa
+
+userhelper = sa.Table(
+    'user',
+    sa.MetaData(),
+    sa.Column('id', sa.Integer()),
+    sa.Column('username', sa.String()),
+    sa.Column('euid', sa.Integer())
+)
+
+taskhelper = sa.Table(
+    'task',
+    sa.MetaData(),
+    sa.Column('id', sa.Integer()),
+    sa.Column('user_id', sa.Integer())
+)
+
+playbookhelper = sa.Table(
+    'playbook',
+    sa.MetaData(),
+    sa.Column('id', sa.Integer()),
+    sa.Column('user_id', sa.Integer())
+)
+
+def upgrade():
+    # fold duplicate users into the oldest row before creating the index
+    connection = op.get_bind()
+    users = userhelper.columns
+    dupes = sa.select(
+        [users.username, users.euid, sa.func.min(users.id).label('keep')]
+    ).group_by(users.username, users.euid).having(sa.func.count() > 1)
+    for dupe in connection.execute(dupes).fetchall():
+        ids = [row.id for row in connection.execute(
+            sa.select([users.id]).where(sa.and_(
+                users.username == dupe.username,
+                users.euid == dupe.euid,
+                users.id != dupe.keep)))]
+        for helper in (taskhelper, playbookhelper):
+            connection.execute(
+                helper.update().where(
+                    helper.columns.user_id.in_(ids)
+                ).values(user_id=dupe.keep)
+            )
+        connection.execute(userhelper.delete().where(users.id.in_(ids)))
+    op.create_index('user_username_euid_idx', 'user',
+                    ['username', 'euid'], unique=True)
+
+def downgrade():
+    op.drop_index('user_username_euid_idx', 'user')
@@ -0,0 +1,71 @@
+"""binary task data
+
+Revision ID: 5b7e2c9d1f84
+Revises: 1d8f3b6a5c47
+Create Date: 2026-10-18 11:24:09.631877
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5b7e2c9d1f84'
+down_revision = '1d8f3b6a5c47'
+
+from alembic import op
+import json
+import sqlalchemy as sa
+
+from ansiblereport import codec
+
+taskhelper = sa.Table(
+    'task',
+    sa.MetaData(),
+    sa.Column('id', sa.Integer()),
+    sa.Column('data', sa.LargeBinary())
+)
+
+def upgrade():
+    # SQLite happily keeps blobs in the old TEXT column; rebuilding what
+    # is usually the largest table for a type name is not worth it.
+    # Existing rows are plain JSON and are left as they are; see
+    # 'ansible-report --recompress'.
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        return
+    kwargs = {}
+    if dialect == 'postgresql':
+        kwargs['postgresql_using'] = "convert_to(data, 'UTF8')"
+    op.alter_column('task', 'data', type_=sa.LargeBinary,
+                    existing_type=sa.Text, **kwargs)
+
+def downgrade():
+    # turn every row back into plain JSON text first
+    connection = op.get_bind()
+    dialect = connection.dialect.name
+    tasks = taskhelper.columns
+    # on SQLite the column stays TEXT, elsewhere it is converted below
+    if dialect == 'sqlite':
+        datatype = sa.Text
+    else:
+        datatype = sa.LargeBinary
+    update = taskhelper.update().where(
+        tasks.id == sa.bindparam('_id')).values(
+        data=sa.bindparam('_data', type_=datatype))
+    last = 0
+    while True:
+        rows = connection.execute(
+            sa.select([tasks.id, tasks.data]).where(
+                tasks.id > last).order_by(tasks.id).limit(1000)).fetchall()
+        if not rows:
+            break
+        changes = [{'_id': id, '_data': json.dumps(codec.decode(data))}
+                   for (id, data) in rows if data is not None]
+        if changes:
+            connection.execute(update, changes)
+        last = rows[-1][0]
+    if dialect == 'sqlite':
+        return
+    kwargs = {}
+    if dialect == 'postgresql':
+        kwargs['postgresql_using'] = "convert_from(data, 'UTF8')"
+    op.alter_column('task', 'data', type_=sa.Text,
+                    existing_type=sa.LargeBinary, **kwargs)
@@ -0,0 +1,35 @@
+"""add summary table
+
+Revision ID: 6e1f8a3c5d92
+Revises: 2c6a9e4f7b13
+Create Date: 2026-10-18 12:48:30.905211
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6e1f8a3c5d92'
+down_revision = '2c6a9e4f7b13'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # filled in by 'ansible-report --summarize'
+    op.create_table(
+        'summary',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('playbook_id', sa.Integer, sa.ForeignKey('playbook.id')),
+        sa.Column('hostname', sa.String),
+        sa.Column('ok', sa.Integer),
+        sa.Column('changed', sa.Integer),
+        sa.Column('failed', sa.Integer),
+        sa.Column('skipped', sa.Integer),
+        sa.Column('unreachable', sa.Integer),
+        sa.Column('error', sa.Integer),
+    )
+    op.create_index('summary_playbook_idx', 'summary', ['playbook_id'])
+
+def downgrade():
+    op.drop_index('summary_playbook_idx', 'summary')
+    op.drop_table('summary')
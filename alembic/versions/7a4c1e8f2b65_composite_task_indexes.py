@@ -0,0 +1,35 @@
+"""composite task indexes
+
+Revision ID: 7a4c1e8f2b65
+Revises: 3f9d2b7e6a18
+Create Date: 2026-10-18 14:21:06.478113
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7a4c1e8f2b65'
+down_revision = '3f9d2b7e6a18'
+
+from alembic import op
+import sqlalchemy as sa
+
+# the composite indexes replace the single column ones they start with
+REPLACED = (
+    ('task_hostname_idx', 'task_hostname_timestamp_idx', 'hostname'),
+    ('task_module_idx', 'task_module_timestamp_idx', 'module'),
+    ('task_result_idx', 'task_result_timestamp_idx', 'result'),
+)
+
+def upgrade():
+    for (old, new, column) in REPLACED:
+        op.create_index(new, 'task', [column, 'timestamp'])
+        op.drop_index(old, 'task')
+    op.create_index('task_user_idx', 'task', ['user_id'])
+    op.create_index('playbook_user_idx', 'playbook', ['user_id'])
+
+def downgrade():
+    op.drop_index('playbook_user_idx', 'playbook')
+    op.drop_index('task_user_idx', 'task')
+    for (old, new, column) in REPLACED:
+        op.create_index(old, 'task', [column])
+        op.drop_index(new, 'task')
@@ -0,0 +1,30 @@
+"""keyset indexes
+
+Revision ID: 8b2d5f1e9c36
+Revises: 7a4c1e8f2b65
+Create Date: 2026-10-18 13:24:51.203417
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8b2d5f1e9c36'
+down_revision = '7a4c1e8f2b65'
+
+from alembic import op
+import sqlalchemy as sa
+
+# pages are ranges on (time, id), so the time indexes carry the id too
+INDEXES = (
+    ('task_timestamp_idx', 'task', 'timestamp'),
+    ('playbook_starttime_idx', 'playbook', 'starttime'),
+)
+
+def upgrade():
+    for (name, table, column) in INDEXES:
+        op.drop_index(name, table)
+        op.create_index(name, table, [column, 'id'])
+
+def downgrade():
+    for (name, table, column) in INDEXES:
+        op.drop_index(name, table)
+        op.create_index(name, table, [column])
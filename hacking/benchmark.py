@@ -0,0 +1,330 @@
+#!/usr/bin/python
+
+# Benchmarks for ansible-report.  Run from a checkout with:
+#
+#   source hacking/env-setup
+#   python hacking/benchmark.py [options] [BENCHMARK ...]
+#
+# Without arguments, every benchmark is run.  Most of them work against a
+# scratch SQLite database unless --uri points them somewhere else.
+
+__requires__ = ['SQLAlchemy >= 0.7']
+import pkg_resources
+
+import datetime
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+import sqlalchemy
+
+import ansiblereport.constants as C
+from ansiblereport import codec
+from ansiblereport.manager import *
+from ansiblereport.model import *
+from ansiblereport.output_plugins import *
+from ansiblereport.utils import format_task, format_task_brief
+
+class StatementCounter(object):
+    ''' count statements sent to any database while active '''
+
+    def __init__(self):
+        self.count = 0
+
+    def _count(self, conn, cursor, statement, *args):
+        self.count += 1
+
+    def __enter__(self):
+        sqlalchemy.event.listen(sqlalchemy.engine.Engine,
+                                'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, *args):
+        sqlalchemy.event.remove(sqlalchemy.engine.Engine,
+                                'before_cursor_execute', self._count)
+
+def timed(callable, *args, **kwargs):
+    ''' return (seconds, result) of calling callable '''
+    start = time.time()
+    rv = callable(*args, **kwargs)
+    return (time.time() - start, rv)
+
+def report(name, value, unit=''):
+    print "  {0:<40} {1:>12} {2}".format(name, value, unit)
+
+def bench_startup(options):
+    ''' Manager startup, with and without the schema cache '''
+    cache = C.DEFAULT_SCHEMA_CACHE
+    for label, cold in (('cold (no schema cache)', True),
+                        ('warm (schema cache)', False)):
+        elapsed = 0
+        with StatementCounter() as counter:
+            for n in range(options.iterations):
+                if cold and os.path.exists(cache):
+                    os.unlink(cache)
+                (t, mgr) = timed(Manager, options.uri)
+                mgr.engine.dispose()
+                elapsed += t
+        report('%s' % label, '%.2f' % (elapsed / options.iterations * 1000), 'ms')
+        report('%s statements' % label,
+               '%.1f' % (float(counter.count) / options.iterations))
+
+def _concurrent_writer(uri, profile, rows, results):
+    mgr = Manager(uri, profile=profile)
+    failed = 0
+    for n in range(rows):
+        task = AnsibleTask('host%d' % os.getpid(), 'ping', 'OK', {'ping': 'pong'})
+        try:
+            mgr.run(lambda session: mgr.save(task))
+        except Exception:
+            failed += 1
+    results.put((mgr.retries, failed))
+
+def bench_concurrency(options):
+    ''' parallel writers: lock retries and throughput per engine profile '''
+    for profile in ('default', 'sqlite'):
+        uri = options.uri
+        if options.scratch_uri:
+            uri = 'sqlite:///%s' % os.path.join(options.scratch,
+                                                 'concurrency-%s.sqlite' % profile)
+        Manager(uri, profile=profile).engine.dispose()
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=_concurrent_writer,
+                                           args=(uri, profile, options.rows, results))
+                   for n in range(options.writers)]
+        start = time.time()
+        for worker in workers:
+            worker.start()
+        retries = failed = 0
+        for worker in workers:
+            (r, f) = results.get()
+            retries += r
+            failed += f
+        for worker in workers:
+            worker.join()
+        elapsed = time.time() - start
+        written = options.writers * options.rows - failed
+        report('%s: lock retries' % profile, retries)
+        report('%s: failed writes' % profile, failed)
+        report('%s: throughput' % profile, '%.0f' % (written / elapsed), 'rows/s')
+
+def _task_data(n):
+    ''' return a task result roughly the shape of what setup and shell return '''
+    facts = dict(('ansible_fact_%d' % i, {'device': 'eth%d' % i,
+                                          'mtu': 1500, 'active': True,
+                                          'ipv4': '10.0.%d.%d' % (i, n % 256)})
+                 for i in range(20))
+    stdout = '\n'.join('line %d of output from command %d' % (i, n)
+                        for i in range(50))
+    return {'changed': bool(n % 2), 'ansible_facts': facts,
+            'stdout': stdout, 'rc': 0,
+            'invocation': {'module_name': 'shell', 'module_args': 'uptime'}}
+
+def bench_codec(options):
+    ''' task data size and encode/decode speed per codec '''
+    rows = [_task_data(n) for n in range(options.rows)]
+    plain = sum(len(json.dumps(data)) for data in rows)
+    report('plain json: size', plain, 'bytes')
+    for name in sorted(codec.CODECS):
+        (t, encoded) = timed(lambda: [codec.encode(data, name) for data in rows])
+        size = sum(len(data) for data in encoded)
+        report('%s: size' % name, '%d (%.0f%%)' % (size, 100.0 * size / plain), 'bytes')
+        report('%s: encode' % name, '%.1f' % (t / len(rows) * 1000000), 'us/row')
+        (t, decoded) = timed(lambda: [codec.decode(data) for data in encoded])
+        report('%s: decode' % name, '%.1f' % (t / len(rows) * 1000000), 'us/row')
+
+def bench_rollup(options):
+    ''' --stats over 90 days from raw tasks and from the rollups '''
+    mgr = Manager(options.uri)
+    now = datetime.datetime.now()
+    count = options.rows * 250
+    step = datetime.timedelta(days=90) / count
+    for n in range(0, count, 5000):
+        tasks = []
+        for i in range(n, min(n + 5000, count)):
+            task = AnsibleTask('host%d' % (i % 10), 'ping', 'OK', {'changed': False})
+            task.timestamp = now - step * i
+            tasks.append(task)
+        mgr.save_all(tasks)
+    age = now - datetime.timedelta(days=90)
+    (t, rows) = timed(AnsibleRollup.find_stats, mgr.session, age=age, verbose=True)
+    report('raw tasks (%d)' % count, '%.1f' % (t * 1000), 'ms')
+    (t, count) = timed(mgr.update_rollups)
+    report('catching up', '%.1f' % (t * 1000), 'ms')
+    (t, rows) = timed(AnsibleRollup.find_stats, mgr.session, age=age, verbose=True)
+    report('rollups', '%.1f' % (t * 1000), 'ms')
+    mgr.engine.dispose()
+
+def bench_stats(options):
+    ''' --stats from loaded tasks and from a GROUP BY, -r 200 is 1M rows '''
+    mgr = Manager(options.uri)
+    now = datetime.datetime.now()
+    count = options.rows * 5000
+    task = AnsibleTask.__table__
+    results = ['OK', 'OK', 'OK', 'SKIPPED', 'FAILED']
+    for n in range(0, count, 10000):
+        rows = []
+        for i in range(n, min(n + 10000, count)):
+            rows.append({'hostname': 'host%d' % (i % 100), 'module': 'shell',
+                         'result': results[i % len(results)],
+                         'changed': i % 3 == 0, 'timestamp': now,
+                         'data': {'changed': i % 3 == 0, 'rc': 0,
+                                  'stdout': 'output of task %d' % i}})
+        mgr.engine.execute(task.insert(), rows)
+    path = os.path.join(os.path.dirname(__file__), '..', 'plugins', 'output_plugins')
+    screen = OutputPlugins([path]).plugins['screen']
+    args = {'module': ['shell']}
+    def stats(events):
+        # host order follows dict order, so compare sorted lines
+        report = ''.join(screen.render(events, verbose=True, stats=True))
+        return sorted(report.splitlines())
+    (t, old) = timed(lambda: stats(AnsibleTask.find_tasks(
+        mgr.session, args=args, limit=0, batch=C.DEFAULT_REPORT_BATCH)))
+    report('loaded tasks (%d)' % count, '%.1f' % (t * 1000), 'ms')
+    mgr.session.expunge_all()
+    (t, new) = timed(lambda: stats(AnsibleRollup.find_stats(
+        mgr.session, args=args, verbose=True)))
+    report('GROUP BY', '%.1f' % (t * 1000), 'ms')
+    report('same report', str(old == new))
+    mgr.engine.dispose()
+
+def bench_report(options):
+    ''' row throughput of brief and full task listings '''
+    mgr = Manager(options.uri)
+    count = options.rows * 50
+    for n in range(0, count, 1000):
+        mgr.save_all([AnsibleTask('host%d' % (i % 10), 'shell', 'OK', _task_data(i))
+                      for i in range(n, min(n + 1000, count))])
+    def listing(relations, format):
+        mgr.session.expunge_all()
+        tasks = AnsibleTask.find_tasks(mgr.session, args={'module': 'shell'},
+                                       limit=0, relations=relations,
+                                       batch=C.DEFAULT_REPORT_BATCH)
+        return len([format(task) for task in tasks])
+    runs = (('brief', [], format_task_brief),
+            ('brief, data loaded', ['data'],
+             lambda task: (task.data, format_task_brief(task))),
+            ('full', ['data'], lambda task: format_task(task, embedded=False)))
+    for (label, relations, format) in runs:
+        (t, rows) = timed(listing, relations, format)
+        report('%s (%d)' % (label, rows), '%.0f' % (rows / t), 'rows/s')
+    mgr.engine.dispose()
+
+def _json_samples():
+    ''' return (name, result) of representative task results '''
+    facts = dict(('ansible_%s' % name, {
+        'device': name, 'active': True, 'mtu': 1500, 'macaddress': '52:54:00:12:34:56',
+        'ipv4': {'address': '10.0.0.%d' % n, 'netmask': '255.255.255.0'},
+        'ipv6': [{'address': 'fe80::5054:ff:fe12:%04x' % n, 'prefix': '64',
+                  'scope': 'link'}],
+        'features': dict(('feature_%d' % i, 'off [fixed]') for i in range(30))})
+        for (n, name) in enumerate(['eth%d' % i for i in range(8)]))
+    facts.update({'ansible_env': dict(('VAR_%d' % i, '/usr/local/bin:/usr/bin')
+                                      for i in range(40)),
+                  'ansible_processor': ['GenuineIntel', 'Intel(R) Xeon(R) CPU'] * 16,
+                  'ansible_memtotal_mb': 7872, 'ansible_uptime_seconds': 1234567.5})
+    setup = {'changed': False, 'ansible_facts': facts,
+             'invocation': {'module_name': 'setup', 'module_args': ''}}
+    stdout = '\n'.join('%s  %d  root  root  4096 Jun 15 12:%02d /var/log/app/%d.log' % (
+        'drwxr-xr-x', i, i % 60, i) for i in range(300))
+    command = {'changed': True, 'rc': 0, 'stdout': stdout, 'stderr': '',
+               'cmd': 'ls -l /var/log/app', 'delta': '0:00:00.012345',
+               'start': '2013-06-15 12:30:00.000000', 'end': '2013-06-15 12:30:00.012345',
+               'invocation': {'module_name': 'command', 'module_args': 'ls -l /var/log/app'}}
+    before = '\n'.join('option_%d = value_%d' % (i, i) for i in range(200))
+    after = before.replace('value_1', u'valu\xe9_1')
+    diff = {'changed': True, 'path': '/etc/app.conf', 'mode': '0644', 'owner': 'root',
+            'diff': {'before': before, 'after': after,
+                     'before_header': '/etc/app.conf', 'after_header': 'dynamically generated'},
+            'invocation': {'module_name': 'template',
+                           'module_args': 'src=app.conf.j2 dest=/etc/app.conf'}}
+    return [('setup facts', setup), ('command stdout', command), ('file diff', diff)]
+
+def bench_json(options):
+    ''' JSON encode/decode speed per library over typical results '''
+    samples = _json_samples()
+    libraries = []
+    for cls in codec.JSON_LIBRARIES:
+        try:
+            libraries.append(cls())
+        except ImportError:
+            report('%s' % cls.name, 'not installed')
+    (encoder, decoder) = codec.get_json()
+    report('configured (%s)' % C.DEFAULT_DATA_JSON,
+           'encode %s, decode %s' % (encoder.name, decoder.name))
+    for library in libraries:
+        (encodes, decodes) = codec._probe(library)
+        report('%s: compatible' % library.name,
+               'encode %s, decode %s' % (encodes, decodes))
+    count = options.iterations * 10
+    for (name, value) in samples:
+        data = codec.JSONLibrary().dumps(value)
+        report('%s: size' % name, len(data), 'bytes')
+        for library in libraries:
+            (t, rv) = timed(lambda: [library.dumps(value) for n in range(count)])
+            report('%s: %s dumps' % (name, library.name), '%.1f' % (t / count * 1000000), 'us')
+            (t, rv) = timed(lambda: [library.loads(data) for n in range(count)])
+            report('%s: %s loads' % (name, library.name), '%.1f' % (t / count * 1000000), 'us')
+        serialized = codec.serialize(value)
+        (t, rv) = timed(lambda: [codec.encode(value) for n in range(count)])
+        report('%s: encode' % name, '%.1f' % (t / count * 1000000), 'us')
+        (t, rv) = timed(lambda: [codec.encode(serialized) for n in range(count)])
+        report('%s: encode, serialized' % name, '%.1f' % (t / count * 1000000), 'us')
+
+BENCHMARKS = [
+    ('startup', bench_startup),
+    ('concurrency', bench_concurrency),
+    ('codec', bench_codec),
+    ('json', bench_json),
+    ('rollup', bench_rollup),
+    ('stats', bench_stats),
+    ('report', bench_report),
+]
+
+def main(args):
+    usage = "usage: %prog [options] [BENCHMARK ...]"
+    parser = OptionParser(usage=usage)
+    parser.add_option('-u', '--uri', default=None,
+                      help='database to benchmark against; default is '
+                           'a scratch SQLite file')
+    parser.add_option('-n', '--iterations', type='int', default=20,
+                      help='how often to repeat each measurement')
+    parser.add_option('-w', '--writers', type='int', default=8,
+                      help='number of parallel writer processes')
+    parser.add_option('-r', '--rows', type='int', default=200,
+                      help='number of rows per writer or dataset size')
+    parser.add_option('-l', '--list', action='store_true', default=False,
+                      help='list benchmarks')
+    options, args = parser.parse_args(args)
+    if options.list:
+        for name, bench in BENCHMARKS:
+            print "%-12s %s" % (name, bench.__doc__.strip())
+        return 0
+    scratch = tempfile.mkdtemp()
+    options.scratch = scratch
+    # keep the benchmarks away from the user's own schema cache
+    C.DEFAULT_SCHEMA_CACHE = os.path.join(scratch, 'schema.cache')
+    options.scratch_uri = options.uri is None
+    if options.uri is None:
+        options.uri = 'sqlite:///%s' % os.path.join(scratch, 'bench.sqlite')
+    try:
+        for name, bench in BENCHMARKS:
+            if args and name not in args:
+                continue
+            print "%s: %s" % (name, bench.__doc__.strip())
+            bench(options)
+    finally:
+        shutil.rmtree(scratch)
+    return 0
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main(sys.argv[1:]))
+    except KeyboardInterrupt, e:
+        print >> sys.stderr, "error: %s" % str(e)
+        sys.exit(1)
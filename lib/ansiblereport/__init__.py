@@ -19,4 +19,6 @@
 __name__ = 'ansible-report'
 __author__ = 'Stephen Fromm'
 __dbversion__ = 1
+# alembic revision that the model in ansiblereport.model corresponds to
+__dbrevision__ = '8b2d5f1e9c36'
 __version__ = '0.1'
@@ -0,0 +1,195 @@
+# Written by Stephen Fromm <sfromm@gmail.com>
+# (C) 2013 University of Oregon
+
+# This file is part of ansible-report
+#
+# ansible-report is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ansible-report is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ansible-report.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+import zlib
+
+import ansiblereport.constants as C
+from ansiblereport.model import *
+
+# Reports rendered by output plugins are kept in a local SQLite file,
+# one row per report and plugin, keyed on everything that decides what
+# the report shows.  Each row records the database watermark it was
+# rendered at (see Manager.watermark()) and the time its --age resolved
+# to.  It is shown again only while the watermark is unchanged and no
+# event it showed has since aged out of the report.  When the file
+# grows past max_size, the least recently used reports are dropped.
+
+CACHE_STRFTIME = '%Y-%m-%d %H:%M:%S.%f'
+
+CACHE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS report (
+    key TEXT PRIMARY KEY,
+    watermark TEXT,
+    cutoff TEXT,
+    cursor TEXT,
+    body BLOB,
+    size INTEGER,
+    used REAL
+)'''
+
+def _format_time(value):
+    if value is None:
+        return None
+    return value.strftime(CACHE_STRFTIME)
+
+def _parse_time(value):
+    if value is None:
+        return None
+    return datetime.datetime.strptime(value, CACHE_STRFTIME)
+
+def cache_key(*parts):
+    ''' return the cache key of the report described by parts '''
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str)).hexdigest()
+
+def is_cacheable(plugin):
+    ''' return True if an output plugin renders and delivers separately '''
+    return hasattr(plugin, 'render') and hasattr(plugin, 'deliver')
+
+class CachedReport(object):
+    ''' a rendered report read from the cache '''
+    __slots__ = ('watermark', 'cutoff', 'cursor', 'body')
+
+    def __init__(self, watermark, cutoff, cursor, body):
+        self.watermark = watermark
+        self.cutoff = cutoff
+        self.cursor = cursor
+        self.body = body
+
+    def is_fresh(self, session, watermark, cls, column, args, cutoff,
+                 intersection=C.DEFAULT_INTERSECTION):
+        '''
+        return True if the report still shows what rendering it again
+        would: the database is at the same watermark and no row of cls
+        matching args has moved out of the report as its cutoff on time
+        column advanced to cutoff
+        '''
+        if self.watermark != watermark:
+            return False
+        if self.cutoff == cutoff:
+            return True
+        if self.cutoff is None or cutoff is None or cutoff < self.cutoff:
+            return False
+        return not has_rows_between(session, cls, column, args,
+                                    self.cutoff, cutoff, intersection)
+
+class ReportCache(object):
+    ''' local cache of rendered reports '''
+
+    def __init__(self, path=C.DEFAULT_CACHE_PATH,
+                 max_size=C.DEFAULT_CACHE_SIZE * 1024 * 1024):
+        self.path = path
+        self.max_size = max_size
+        self.conn = None
+
+    def _connect(self):
+        if self.conn is None:
+            cache_dir = os.path.dirname(self.path)
+            if cache_dir and not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            self.conn = sqlite3.connect(self.path, timeout=10)
+            self.conn.text_factory = str
+            self.conn.execute(CACHE_SCHEMA)
+        return self.conn
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def get(self, key):
+        ''' return the CachedReport stored under key, or None '''
+        try:
+            conn = self._connect()
+            row = conn.execute('SELECT watermark, cutoff, cursor, body '
+                               'FROM report WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            with conn:
+                conn.execute('UPDATE report SET used = ? WHERE key = ?',
+                             (time.time(), key))
+        except (sqlite3.Error, OSError), e:
+            logging.debug("failed to read report cache: %s" % str(e))
+            return None
+        (watermark, cutoff, cursor, body) = row
+        return CachedReport(json.loads(watermark), _parse_time(cutoff),
+                            cursor, zlib.decompress(body))
+
+    def put(self, key, watermark, cutoff, cursor, body):
+        '''
+        store body, a rendered report, under key; returns False if it is
+        too large for the cache or could not be written
+        '''
+        body = zlib.compress(body)
+        if len(body) > self.max_size:
+            return False
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO report '
+                             'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             (key, json.dumps(watermark), _format_time(cutoff),
+                              cursor, sqlite3.Binary(body), len(body), time.time()))
+                self._evict(conn)
+        except (sqlite3.Error, OSError), e:
+            logging.debug("failed to write report cache: %s" % str(e))
+            return False
+        return True
+
+    def _evict(self, conn):
+        ''' drop least recently used reports until the cache fits max_size '''
+        total = conn.execute('SELECT coalesce(sum(size), 0) FROM report').fetchone()[0]
+        if total <= self.max_size:
+            return 0
+        evicted = []
+        for (key, size) in conn.execute('SELECT key, size FROM report '
+                                        'ORDER BY used').fetchall():
+            if total <= self.max_size:
+                break
+            evicted.append((key,))
+            total -= size
+        conn.executemany('DELETE FROM report WHERE key = ?', evicted)
+        return len(evicted)
+
+    def record(self, key, watermark, cutoff, chunks, cursor=None):
+        '''
+        yield chunks, a report as it is rendered, and store it under key
+        once the last one has been yielded.  Reports larger than the
+        cache are passed through without being kept in memory.
+        '''
+        body = []
+        size = 0
+        for chunk in chunks:
+            if body is not None:
+                data = chunk
+                if isinstance(data, unicode):
+                    data = data.encode('utf-8')
+                size += len(data)
+                if size > self.max_size:
+                    body = None
+                else:
+                    body.append(data)
+            yield chunk
+        if body is not None:
+            self.put(key, watermark, cutoff, cursor, ''.join(body))
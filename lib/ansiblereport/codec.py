@@ -0,0 +1,265 @@
+# Written by Stephen Fromm <sfromm@gmail.com>
+# (C) 2013 University of Oregon
+
+# This file is part of ansible-report
+#
+# ansible-report is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ansible-report is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ansible-report.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import logging
+import zlib
+
+import ansiblereport.constants as C
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+# Task data is stored as HEADER, one byte naming the codec and then the
+# encoded JSON document.  Rows written before codecs existed hold plain
+# JSON text, which never starts with HEADER, so they still decode.
+
+HEADER = '\x00'
+
+CODECS = {}
+TAGS = {}
+
+class JSONCodec(object):
+    ''' compact JSON, no compression '''
+    name = 'json'
+    tag = 'j'
+
+    def compress(self, data):
+        return data
+
+    def decompress(self, data):
+        return data
+
+class ZlibCodec(JSONCodec):
+    ''' zlib compressed JSON '''
+    name = 'zlib'
+    tag = 'z'
+
+    def compress(self, data):
+        return zlib.compress(data, C.DEFAULT_DATA_LEVEL)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+class LzmaCodec(JSONCodec):
+    ''' lzma compressed JSON '''
+    name = 'lzma'
+    tag = 'x'
+
+    def compress(self, data):
+        return lzma.compress(data, preset=C.DEFAULT_DATA_LEVEL)
+
+    def decompress(self, data):
+        return lzma.decompress(data)
+
+def register_codec(codec):
+    ''' make codec available by name and for decoding '''
+    CODECS[codec.name] = codec
+    TAGS[codec.tag] = codec
+
+register_codec(JSONCodec())
+register_codec(ZlibCodec())
+if lzma is not None:
+    register_codec(LzmaCodec())
+
+def get_codec(name=None):
+    ''' return codec called name; default is the configured codec '''
+    if name is None:
+        name = C.DEFAULT_DATA_CODEC
+    if name not in CODECS:
+        logging.warn("unknown or unavailable data codec '%s'; using json" % name)
+        # only warn once
+        CODECS[name] = CODECS['json']
+    return CODECS[name]
+
+class JSONLibrary(object):
+    ''' the json module from the standard library '''
+    name = 'json'
+    module = json
+
+    def dumps(self, value):
+        return self.module.dumps(value, separators=(',', ':'), sort_keys=True)
+
+    def loads(self, data):
+        return self.module.loads(data)
+
+class SimpleJSONLibrary(JSONLibrary):
+    ''' simplejson, with its C speedups '''
+    name = 'simplejson'
+
+    def __init__(self):
+        import simplejson
+        self.module = simplejson
+
+class UltraJSONLibrary(JSONLibrary):
+    ''' ujson '''
+    name = 'ujson'
+
+    def __init__(self):
+        import ujson
+        self.module = ujson
+
+    def dumps(self, value):
+        return self.module.dumps(value, sort_keys=True,
+                                 escape_forward_slashes=False)
+
+# fastest first
+JSON_LIBRARIES = [UltraJSONLibrary, SimpleJSONLibrary, JSONLibrary]
+
+# Stored documents and payload hashes must not depend on which library
+# wrote them, so a library only encodes if it gives exactly the bytes
+# the json module gives for this document, and only decodes if it reads
+# back equal values.
+PROBE = {
+    'ascii': 'plain text / with "quotes", \\ and \t\n',
+    'unicode': u'caf\xe9 \u2603 \U0001f600',
+    'bytes': 'caf\xc3\xa9',
+    'numbers': [0, -1, 2 ** 40, 0.1, 1.0 / 3, 1e-07, 123456789.123456, -2.5e+300],
+    'constants': [True, False, None],
+    'nested': {'b': [{}, []], 'a': {'z': 1, 'y': ''}},
+}
+
+_json = {}
+
+def _probe(library):
+    ''' return (encodes, decodes): what library can be trusted to do '''
+    reference = JSONLibrary().dumps(PROBE)
+    try:
+        encodes = library.dumps(PROBE) == reference
+    except Exception:
+        encodes = False
+    try:
+        decodes = library.loads(reference) == json.loads(reference)
+    except Exception:
+        decodes = False
+    return (encodes, decodes)
+
+def get_json(name=None):
+    '''
+    return (encoder, decoder), the JSON libraries used for task data;
+    name is a library name or 'auto', by default the configured one
+    '''
+    if name is None:
+        name = C.DEFAULT_DATA_JSON
+    if name in _json:
+        return _json[name]
+    candidates = [cls for cls in JSON_LIBRARIES
+                  if name == 'auto' or cls.name == name]
+    if not candidates:
+        logging.warn("unknown JSON library '%s'; using json" % name)
+    encoder = decoder = None
+    for cls in candidates:
+        try:
+            library = cls()
+        except ImportError:
+            continue
+        (encodes, decodes) = _probe(library)
+        if encodes and encoder is None:
+            encoder = library
+        if decodes and decoder is None:
+            decoder = library
+    if name != 'auto' and candidates and encoder is None and decoder is None:
+        logging.warn("JSON library '%s' is unavailable or unsuitable; using json" % name)
+    _json[name] = (encoder or JSONLibrary(), decoder or JSONLibrary())
+    return _json[name]
+
+def dumps(value):
+    ''' return value as compact JSON, the same for equal values '''
+    if isinstance(value, Serialized):
+        return value.json
+    return get_json()[0].dumps(resolve(value))
+
+def loads(data):
+    ''' return the value of JSON document data '''
+    return get_json()[1].loads(data)
+
+class Serialized(object):
+    '''
+    A value together with its JSON document from dumps(), so that it is
+    only serialized once however often it is hashed and stored.
+    '''
+    __slots__ = ('value', 'json')
+
+    def __init__(self, value, data=None):
+        self.value = value
+        if data is None:
+            data = dumps(value)
+        self.json = data
+
+def serialize(value):
+    ''' return value as a Serialized document; None stays None '''
+    if value is None or isinstance(value, (Serialized, Lazy)):
+        return value
+    return Serialized(value)
+
+class Lazy(object):
+    '''
+    A stored document that is only decoded the first time its value is
+    needed.  Handing it back to encode() reuses the stored data.
+    '''
+    __slots__ = ('data', '_value', '_decoded')
+
+    def __init__(self, data):
+        self.data = data
+        self._value = None
+        self._decoded = False
+
+    @property
+    def value(self):
+        if not self._decoded:
+            self._value = decode(self.data)
+            self._decoded = True
+        return self._value
+
+def resolve(value):
+    ''' return value, decoding it first if it is a Lazy document '''
+    if isinstance(value, (Lazy, Serialized)):
+        return value.value
+    return value
+
+def encode(value, codec=None):
+    ''' return value encoded for storage with codec '''
+    if isinstance(value, Lazy):
+        if codec is None:
+            return value.data
+        value = value.value
+    if value is None:
+        return None
+    # a Serialized value is not encoded again
+    data = dumps(value)
+    codec = get_codec(codec)
+    if len(data) < C.DEFAULT_DATA_COMPRESS_MIN:
+        codec = CODECS['json']
+    return HEADER + codec.tag + codec.compress(data)
+
+def decode(data):
+    ''' return the value stored in data '''
+    if data is None:
+        return None
+    data = str(data)
+    if not data.startswith(HEADER):
+        return loads(data)
+    codec = TAGS.get(data[1:2])
+    if codec is None:
+        raise ValueError("task data uses unknown codec '%s'" % data[1:2])
+    return loads(codec.decompress(data[2:]))
@@ -27,11 +27,32 @@ def get_config_value(key, env_var, default):
     config = AC.load_config_file()
     return AC.get_config(config, DEFAULT_SECTION, key, env_var, default)
 
+def get_config_int(key, env_var, default):
+    ''' Look up key in ansible.cfg and return it as an integer '''
+    return int(get_config_value(key, env_var, default))
+
+def get_config_float(key, env_var, default):
+    ''' Look up key in ansible.cfg and return it as a float '''
+    return float(get_config_value(key, env_var, default))
+
+def get_config_bool(key, env_var, default):
+    ''' Look up key in ansible.cfg and return it as a boolean '''
+    return AC.mk_boolean(get_config_value(key, env_var, default))
+
+def get_config_list(key, env_var, default):
+    ''' Look up key in ansible.cfg and return it as a list of words '''
+    value = get_config_value(key, env_var, default)
+    if value is None:
+        return None
+    if isinstance(value, basestring):
+        value = [word.strip() for word in value.split(',') if word.strip()]
+    return value
+
 DEFAULT_SECTION = 'ansiblereport'
 
 DEFAULT_VERBOSE = False
 DEFAULT_STATS = False
-DEFAULT_INTERSECTION = get_config_value('intersection', 'ANSIBLEREPORT_INTERSECTION', False)
+DEFAULT_INTERSECTION = get_config_bool('intersection', 'ANSIBLEREPORT_INTERSECTION', False)
 DEFAULT_LIMIT = get_config_value('limit', 'ANSIBLEREPORT_LIMIT', 0)
 
 DEFAULT_BACKOFF_START = get_config_value('backoff.start', None, 0.5)
@@ -40,6 +61,116 @@ DEFAULT_BACKOFF_MAX = get_config_value('backoff.max', None, 60)
 
 DEFAULT_DB_URI = get_config_value('sqlalchemy.url', 'ANSIBLEREPORT_DB_URI', 'sqlite://')
 
+# Engine tuning; see ENGINE_PROFILES in ansiblereport.manager.  Any of the
+# individual settings below overrides the value from the profile.
+DEFAULT_DB_PROFILE = get_config_value('db.profile', 'ANSIBLEREPORT_DB_PROFILE', 'default')
+DEFAULT_ENGINE_SETTINGS = [
+    'sqlite.journal_mode', 'sqlite.synchronous', 'sqlite.busy_timeout',
+    'sqlite.mmap_size', 'sqlite.cache_size',
+    'pool.size', 'pool.max_overflow', 'pool.timeout', 'pool.recycle',
+    'pool.pre_ping',
+]
+
+def get_config_options(keys):
+    ''' return dict of the given keys that are set in ansible.cfg '''
+    options = {}
+    for key in keys:
+        value = get_config_value(key, None, None)
+        if value is not None:
+            options[key] = value
+    return options
+
+DEFAULT_ENGINE_OPTIONS = get_config_options(DEFAULT_ENGINE_SETTINGS)
+
+DEFAULT_SCHEMA_CACHE = AC.shell_expand_path(
+        get_config_value('schema.cache', 'ANSIBLEREPORT_SCHEMA_CACHE', '~/.ansible-report/schema.cache'))
+
+# How the callback plugin writes events to the database:
+#   direct      save each event as it arrives
+#   buffered    collect events and insert them in batches
+#   async       hand events to a background writer thread
+#   spool       append events to a local spool file; see --ingest
+DEFAULT_CALLBACK_MODE = get_config_value('callback.mode', 'ANSIBLEREPORT_CALLBACK_MODE', 'direct')
+DEFAULT_BUFFER_SIZE = get_config_int('buffer.size', 'ANSIBLEREPORT_BUFFER_SIZE', 500)
+DEFAULT_BUFFER_INTERVAL = get_config_float('buffer.interval', 'ANSIBLEREPORT_BUFFER_INTERVAL', 5)
+
+# When the callback commits what it has written to the database:
+#   event       every event (or buffered batch) is its own transaction
+#   count       every commit.interval events
+#   play        at the start and end of every play
+#   run         once, at the end of the playbook or when ansible exits
+DEFAULT_COMMIT_POLICY = get_config_value('commit.policy', 'ANSIBLEREPORT_COMMIT_POLICY', 'event')
+DEFAULT_COMMIT_INTERVAL = get_config_int('commit.interval', 'ANSIBLEREPORT_COMMIT_INTERVAL', 100)
+
+# What the async writer does when its queue is full:
+#   block       wait for the writer thread to catch up
+#   drop        discard unchanged OK results, wait for anything else
+#   spill       write events to a temporary file until the thread catches up
+DEFAULT_QUEUE_SIZE = get_config_int('queue.size', 'ANSIBLEREPORT_QUEUE_SIZE', 10000)
+DEFAULT_QUEUE_OVERFLOW = get_config_value('queue.overflow', 'ANSIBLEREPORT_QUEUE_OVERFLOW', 'block')
+DEFAULT_QUEUE_SPILL_DIR = get_config_value('queue.spill_dir', 'ANSIBLEREPORT_QUEUE_SPILL_DIR', None)
+
+DEFAULT_SPOOL_DIR = AC.shell_expand_path(
+        get_config_value('spool.dir', 'ANSIBLEREPORT_SPOOL_DIR', '~/.ansible-report/spool'))
+DEFAULT_SPOOL_FSYNC = get_config_int('spool.fsync', 'ANSIBLEREPORT_SPOOL_FSYNC', 100)
+DEFAULT_INGEST_BATCH = get_config_int('ingest.batch', 'ANSIBLEREPORT_INGEST_BATCH', 5000)
+
+# How task data is stored; see ansiblereport.codec:
+#   json        compact JSON
+#   zlib        zlib compressed JSON
+#   lzma        lzma compressed JSON (needs backports.lzma on python 2)
+# Documents smaller than data.compress_min bytes are never compressed.
+DEFAULT_DATA_CODEC = get_config_value('data.codec', 'ANSIBLEREPORT_DATA_CODEC', 'json')
+DEFAULT_DATA_LEVEL = get_config_int('data.level', 'ANSIBLEREPORT_DATA_LEVEL', 6)
+DEFAULT_DATA_COMPRESS_MIN = get_config_int('data.compress_min', 'ANSIBLEREPORT_DATA_COMPRESS_MIN', 256)
+
+# JSON library used to encode and decode task data: auto picks the
+# fastest of ujson, simplejson and json that is installed; see
+# ansiblereport.codec for when a faster one is used.
+DEFAULT_DATA_JSON = get_config_value('data.json', 'ANSIBLEREPORT_DATA_JSON', 'auto')
+
+# Store each distinct task result once in the payload table and have
+# tasks refer to it by hash.
+DEFAULT_PAYLOAD_DEDUP = get_config_bool('payload.dedup', 'ANSIBLEREPORT_PAYLOAD_DEDUP', False)
+
+DEFAULT_RECOMPRESS_BATCH = get_config_int('recompress.batch', 'ANSIBLEREPORT_RECOMPRESS_BATCH', 1000)
+DEFAULT_ROLLUP_BATCH = get_config_int('rollup.batch', 'ANSIBLEREPORT_ROLLUP_BATCH', 10000)
+
+# --prune deletes this many rows per transaction and sleeps prune.sleep
+# seconds between transactions, so that callbacks are not locked out of
+# the database for long.  On SQLite, free pages are then returned
+# vacuum.pages at a time; see Manager.incremental_vacuum().
+DEFAULT_PRUNE_BATCH = get_config_int('prune.batch', 'ANSIBLEREPORT_PRUNE_BATCH', 1000)
+DEFAULT_PRUNE_SLEEP = get_config_float('prune.sleep', 'ANSIBLEREPORT_PRUNE_SLEEP', 0)
+DEFAULT_VACUUM_PAGES = get_config_int('vacuum.pages', 'ANSIBLEREPORT_VACUUM_PAGES', 1000)
+
+# Trim task results in the callback before they are stored; see
+# ansiblereport.trim.  Each can be set per module as well, for example
+# payload.setup.keep = report.
+DEFAULT_PAYLOAD_DROP = get_config_list('payload.drop', 'ANSIBLEREPORT_PAYLOAD_DROP', [])
+DEFAULT_PAYLOAD_KEEP = get_config_list('payload.keep', 'ANSIBLEREPORT_PAYLOAD_KEEP', [])
+DEFAULT_PAYLOAD_MAX_STRING = get_config_int('payload.max_string', 'ANSIBLEREPORT_PAYLOAD_MAX_STRING', 0)
+
+# How reports load the users, playbooks and tasks they show along with
+# the events selected:
+#   auto        joined loads for single objects, select-in for lists
+#   joined      always join
+#   selectin    always a second SELECT ... WHERE id IN (...)
+#   lazy        one SELECT whenever a report touches one (the old way)
+DEFAULT_REPORT_LOADING = get_config_value('report.loading', 'ANSIBLEREPORT_REPORT_LOADING', 'auto')
+
+# Reports fetch events from the database this many rows at a time
+# rather than all at once; 0 fetches the whole result up front.
+DEFAULT_REPORT_BATCH = get_config_int('report.batch', 'ANSIBLEREPORT_REPORT_BATCH', 1000)
+
+# Keep rendered reports in a local cache and show them again while the
+# database has not changed; see ansiblereport.cache.  cache.size is the
+# most the cache file holds, in megabytes.
+DEFAULT_CACHE = get_config_bool('cache.enabled', 'ANSIBLEREPORT_CACHE', False)
+DEFAULT_CACHE_PATH = AC.shell_expand_path(
+        get_config_value('cache.path', 'ANSIBLEREPORT_CACHE_PATH', '~/.ansible-report/report.cache'))
+DEFAULT_CACHE_SIZE = get_config_int('cache.size', 'ANSIBLEREPORT_CACHE_SIZE', 64)
+
 DEFAULT_STRFTIME = '%Y-%m-%d %H:%M:%S'
 DEFAULT_SHORT_STRFTIME = '%H:%M:%S'
 DEFAULT_FRIENDLY_STRFTIME = '%Y-%m-%d %H:%M'
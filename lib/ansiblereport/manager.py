@@ -16,40 +16,453 @@
 # You should have received a copy of the GNU General Public License
 # along with ansible-report.  If not, see <http://www.gnu.org/licenses/>.
 
+import ansiblereport
 import ansiblereport.constants as C
 from ansiblereport.model import *
 
 
 import functools
+import hashlib
+import json
+import logging
 import random
+import tempfile
 import time
 import sqlalchemy
+from distutils.version import LooseVersion
 import os
 import sys
 
+# alembic's own bookkeeping table, for reading and stamping the revision
+alembic_version = Table('alembic_version', MetaData(),
+                        Column('version_num', String(32),
+                               primary_key=True, nullable=False))
+
+# values per IN list; stays under SQLite's bound parameter limit
+PAYLOAD_CHUNK = 500
+# playbooks summarized per statement by update_summary()
+SUMMARY_BATCH = 500
+
+# Named sets of engine settings, picked with db.profile in ansible.cfg.
+# 'sqlite.*' settings become PRAGMAs run on every new SQLite connection
+# and 'pool.*' settings configure the connection pool of server
+# databases; neither applies to the other kind of database.
+ENGINE_PROFILES = {
+    # no tuning at all
+    'default': {},
+    # concurrent writers: readers never block the writer, and writers
+    # wait for each other instead of failing with 'database is locked'
+    'sqlite': {
+        'sqlite.journal_mode': 'WAL',
+        'sqlite.synchronous': 'NORMAL',
+        'sqlite.busy_timeout': 30000,
+        'sqlite.mmap_size': 268435456,
+        'sqlite.cache_size': -16000,
+    },
+    'server': {
+        'pool.size': 5,
+        'pool.max_overflow': 10,
+        'pool.timeout': 30,
+        'pool.recycle': 3600,
+        'pool.pre_ping': True,
+    },
+}
+
+ENGINE_POOL_ARGS = {
+    'pool.size': ('pool_size', int),
+    'pool.max_overflow': ('max_overflow', int),
+    'pool.timeout': ('pool_timeout', int),
+    'pool.recycle': ('pool_recycle', int),
+    'pool.pre_ping': ('pool_pre_ping',
+                      lambda v: str(v).lower() in ('1', 'yes', 'true', 'on')),
+}
+
+# pool_pre_ping is only available with SQLAlchemy >= 1.2
+HAS_PRE_PING = LooseVersion(sqlalchemy.__version__) >= LooseVersion('1.2')
+
+def engine_options(uri, profile=C.DEFAULT_DB_PROFILE,
+                   overrides=C.DEFAULT_ENGINE_OPTIONS):
+    ''' return (create_engine() keyword args, sqlite pragmas) for uri '''
+    if profile not in ENGINE_PROFILES:
+        logging.warn("unknown engine profile '%s'; using 'default'" % profile)
+        profile = 'default'
+    options = dict(ENGINE_PROFILES[profile])
+    options.update(overrides)
+    is_sqlite = uri.startswith('sqlite')
+    kwargs = {}
+    pragmas = []
+    for key in sorted(options.keys()):
+        value = options[key]
+        if key.startswith('sqlite.'):
+            if is_sqlite:
+                pragmas.append((key[len('sqlite.'):], value))
+        elif key in ENGINE_POOL_ARGS and not is_sqlite:
+            (arg, convert) = ENGINE_POOL_ARGS[key]
+            if arg == 'pool_pre_ping' and not HAS_PRE_PING:
+                continue
+            kwargs[arg] = convert(value)
+    return (kwargs, pragmas)
+
 def _db_error_decorator(callable):
     @functools.wraps(callable)
     def _wrap(self, *args, **kwargs):
         try:
             return callable(self, *args, **kwargs)
         except Exception as e:
+            # a failed flush leaves any enclosing transaction unusable
+            if self.session.transaction is not None:
+                self.session.rollback()
             raise
     return _wrap
 
 class Manager(object):
     ''' db manager object '''
 
-    def __init__(self, uri, alembic_ini=None, debug=False):
-        self.engine = create_engine(uri, echo=debug)
-        Base.metadata.create_all(self.engine)
+    def __init__(self, uri, alembic_ini=None, debug=False,
+                 profile=C.DEFAULT_DB_PROFILE):
+        (kwargs, pragmas) = engine_options(uri, profile)
+        self.engine = create_engine(uri, echo=debug, **kwargs)
+        if pragmas:
+            def set_pragmas(dbapi_connection, connection_record):
+                cursor = dbapi_connection.cursor()
+                for (name, value) in pragmas:
+                    cursor.execute('PRAGMA %s=%s' % (name, value))
+                cursor.close()
+            sqlalchemy.event.listen(self.engine, 'connect', set_pragmas)
+        # number of times run() had to retry because the db was busy
+        self.retries = 0
+        self._check_schema(alembic_ini)
+        Session = sessionmaker(bind=self.engine, autocommit=True)
+        self.session = Session()
+        # tasks can be flushed before save(), such as by autoflush
+        sqlalchemy.event.listen(self.session, 'before_flush', self._before_flush)
+
+    def db_key(self):
+        ''' return key for this database in the schema and report caches
+
+        In-memory databases are new every time and are never cached.
+        The url is hashed to keep passwords out of the cache files.
+        '''
+        url = self.engine.url
+        if url.drivername.startswith('sqlite'):
+            if url.database in (None, '', ':memory:'):
+                return None
+            url = 'sqlite:///%s' % os.path.abspath(url.database)
+        return hashlib.sha1(str(url)).hexdigest()
+
+    def _read_schema_cache(self):
+        try:
+            f = open(C.DEFAULT_SCHEMA_CACHE)
+            try:
+                return json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            return {}
+
+    def _write_schema_cache(self, key, revision):
+        ''' remember that the database at key is at revision '''
+        cache = self._read_schema_cache()
+        if cache.get(key) == revision:
+            return
+        cache[key] = revision
+        cache_dir = os.path.dirname(C.DEFAULT_SCHEMA_CACHE)
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            (fd, path) = tempfile.mkstemp(dir=cache_dir)
+            f = os.fdopen(fd, 'w')
+            try:
+                json.dump(cache, f)
+            finally:
+                f.close()
+            os.rename(path, C.DEFAULT_SCHEMA_CACHE)
+        except (IOError, OSError), e:
+            logging.debug("failed to write schema cache: %s" % str(e))
+
+    def _get_revision(self):
+        ''' return alembic revision of the database, if it has one '''
+        try:
+            return self.engine.execute(
+                select([alembic_version.c.version_num])).scalar()
+        except sqlalchemy.exc.DBAPIError:
+            return None
+
+    def _stamp(self, revision):
+        ''' record revision in alembic's version table '''
+        alembic_version.create(self.engine, checkfirst=True)
+        try:
+            self.engine.execute(alembic_version.insert(),
+                                version_num=revision)
+        except sqlalchemy.exc.IntegrityError:
+            # another process stamped it first
+            pass
+
+    def _check_schema(self, alembic_ini=None):
+        '''
+        Make sure the tables exist.  Creating them means inspecting every
+        table and index, which costs several round trips, so it is only
+        done when the database's alembic revision is missing, is not the
+        one the model expects, or has not been seen from this host
+        before.  Otherwise the check is one SELECT on alembic_version.
+        '''
+        head = ansiblereport.__dbrevision__
+        key = self.db_key()
+        revision = self._get_revision()
+        if key is not None and revision == head and \
+                self._read_schema_cache().get(key) == head:
+            return
+        new_db = not self.engine.has_table(AnsibleTask.__tablename__)
+        if new_db and self.engine.url.drivername.startswith('sqlite'):
+            # only takes effect before the first table is created; lets
+            # prune hand free pages back with incremental_vacuum()
+            conn = self.engine.connect()
+            try:
+                conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                Base.metadata.create_all(conn)
+            finally:
+                conn.close()
+        else:
+            Base.metadata.create_all(self.engine)
         if alembic_ini is not None:
             # if we have an alembic.ini, stamp the db with the head revision
             from alembic.config import Config
             from alembic import command
             alembic_cfg = Config(alembic_ini)
             command.stamp(alembic_cfg, 'head')
-        Session = sessionmaker(bind=self.engine, autocommit=True)
-        self.session = Session()
+            revision = self._get_revision()
+        elif revision is None and new_db:
+            # we just created the schema, so it is at head
+            self._stamp(head)
+            revision = head
+        if key is not None and revision == head:
+            self._write_schema_cache(key, revision)
+
+    def reset_pool(self):
+        ''' forget connections inherited from a parent process
+
+        The connections still belong to the parent, so they are dropped
+        rather than closed.
+        '''
+        self.engine.pool = self.engine.pool.recreate()
+
+    def begin(self):
+        ''' start a transaction spanning several save() calls, if needed '''
+        if self.session.transaction is None:
+            self.session.begin()
+
+    def commit(self):
+        ''' commit the transaction started by begin(), if any '''
+        if self.session.transaction is not None:
+            self.session.commit()
+
+    def _add_task_payloads(self, models):
+        ''' store the payloads of new deduplicated tasks in models '''
+        models = [model for model in models
+                  if isinstance(model, AnsibleTask) and
+                     model.new_payload is not None and
+                     not model.payload_stored]
+        self.add_payloads([(model.payload_hash, model.new_payload)
+                           for model in models])
+        for model in models:
+            model.payload_stored = True
+
+    def _before_flush(self, session, context, instances):
+        ''' store the payloads of the tasks a flush is about to insert '''
+        self._add_task_payloads(session.new)
+
+    def add_payloads(self, payloads):
+        ''' store a list of (hash, data) payloads, counting each reference
+
+        Payloads already in the database are not sent again; their
+        reference count is bumped instead.
+        '''
+        if not payloads:
+            return
+        counts = {}
+        values = {}
+        for (hash, data) in payloads:
+            counts[hash] = counts.get(hash, 0) + 1
+            values[hash] = data
+        table = AnsiblePayload.__table__
+        hashes = sorted(counts)
+        update = table.update().where(
+            table.c.hash == sqlalchemy.bindparam('_hash')).values(
+            refcount=table.c.refcount + sqlalchemy.bindparam('_count'))
+        with self.session.begin(subtransactions=True):
+            for n in range(0, len(hashes), PAYLOAD_CHUNK):
+                chunk = hashes[n:n + PAYLOAD_CHUNK]
+                stored = set([row[0] for row in self.session.execute(
+                    sqlalchemy.select([table.c.hash]).where(
+                        table.c.hash.in_(chunk)))])
+                # start new payloads at zero so that a concurrent insert of
+                # the same payload is skipped and both counts still add up
+                self.insert_many(table, [
+                    {'hash': hash, 'data': values[hash], 'refcount': 0}
+                    for hash in chunk if hash not in stored],
+                    skip_existing=True)
+                self.session.execute(update, [
+                    {'_hash': hash, '_count': counts[hash]} for hash in chunk])
+
+    def release_payloads(self, query):
+        ''' drop the payload references of the tasks query selects
+
+        Call this before deleting the tasks.  Payloads no longer referred
+        to are deleted; returns how many.
+        '''
+        table = AnsiblePayload.__table__
+        rows = query.with_entities(
+            AnsibleTask.payload_hash, sqlalchemy.func.count()).filter(
+            AnsibleTask.payload_hash != None).group_by(
+            AnsibleTask.payload_hash).all()
+        update = table.update().where(
+            table.c.hash == sqlalchemy.bindparam('_hash')).values(
+            refcount=table.c.refcount - sqlalchemy.bindparam('_count'))
+        with self.session.begin(subtransactions=True):
+            if rows:
+                self.session.execute(update, [
+                    {'_hash': hash, '_count': count} for (hash, count) in rows])
+            result = self.session.execute(
+                table.delete().where(table.c.refcount <= 0))
+        return result.rowcount
+
+    def update_summary(self, playbook_ids):
+        ''' rebuild the summary rows of playbook_ids from their tasks '''
+        if not playbook_ids:
+            return
+        table = AnsibleSummary.__table__
+        with self.session.begin(subtransactions=True):
+            for n in range(0, len(playbook_ids), SUMMARY_BATCH):
+                ids = playbook_ids[n:n + SUMMARY_BATCH]
+                self.session.execute(table.delete().where(
+                    table.c.playbook_id.in_(ids)))
+                self.session.execute(table.insert().from_select(
+                    ['playbook_id', 'hostname'] + AnsibleSummary.COUNTERS,
+                    AnsibleSummary.tally(ids)))
+
+    def rebuild_summary(self, batch=SUMMARY_BATCH):
+        ''' rebuild the summary of every playbook, batch playbooks at a time
+
+        Returns the number of playbooks summarized.
+        '''
+        table = AnsiblePlaybook.__table__
+        last = 0
+        count = 0
+        while True:
+            ids = [row[0] for row in self.session.execute(
+                sqlalchemy.select([table.c.id]).where(
+                    table.c.id > last).order_by(table.c.id).limit(batch))]
+            if not ids:
+                break
+            self.update_summary(ids)
+            count += len(ids)
+            last = ids[-1]
+        return count
+
+    def prune_summary(self):
+        ''' delete summary rows of playbooks that no longer exist '''
+        table = AnsibleSummary.__table__
+        playbooks = sqlalchemy.select([AnsiblePlaybook.__table__.c.id])
+        result = self.session.execute(table.delete().where(
+            ~table.c.playbook_id.in_(playbooks)))
+        return result.rowcount
+
+    def _advance_watermark(self, name, old, new):
+        ''' move watermark name from old to new; False if it was not at old '''
+        table = AnsibleWatermark.__table__
+        if old == 0:
+            self.insert_many(table, [{'name': name, 'value': 0}],
+                             skip_existing=True)
+        result = self.session.execute(table.update().where(and_(
+            table.c.name == name, table.c.value == old)).values(value=new))
+        return result.rowcount == 1
+
+    def bump_watermark(self, name):
+        ''' add one to the counter kept in watermark name '''
+        table = AnsibleWatermark.__table__
+        with self.session.begin(subtransactions=True):
+            self.insert_many(table, [{'name': name, 'value': 0}],
+                             skip_existing=True)
+            self.session.execute(table.update().where(
+                table.c.name == name).values(value=table.c.value + 1))
+
+    def watermark(self):
+        '''
+        return a list that changes whenever what reports show may have:
+        the largest task and playbook ids, the latest playbook end time
+        and the number of prunes.  It costs one SELECT.
+        '''
+        task = AnsibleTask.__table__
+        playbook = AnsiblePlaybook.__table__
+        mark = AnsibleWatermark.__table__
+        row = self.session.execute(sqlalchemy.select([
+            sqlalchemy.select([func.max(task.c.id)]).as_scalar(),
+            sqlalchemy.select([func.max(playbook.c.id)]).as_scalar(),
+            sqlalchemy.select([func.max(playbook.c.endtime)]).as_scalar(),
+            sqlalchemy.select([mark.c.value]).where(
+                mark.c.name == 'prune').as_scalar()])).first()
+        return [value is not None and str(value) or None for value in row]
+
+    def _add_rollups(self, counts):
+        ''' add counts, keyed like the rollup index, to the rollup table '''
+        table = AnsibleRollup.__table__
+        keys = ('period', 'bucket', 'hostname', 'module', 'result', 'changed')
+        buckets = sorted(set([key[1] for key in counts]))
+        stored = {}
+        for n in range(0, len(buckets), PAYLOAD_CHUNK):
+            for row in self.session.execute(sqlalchemy.select(
+                    [table.c.id] + [table.c[col] for col in keys]).where(
+                    table.c.bucket.in_(buckets[n:n + PAYLOAD_CHUNK]))):
+                stored[tuple(row[1:])] = row[0]
+        updates = []
+        inserts = []
+        for (key, count) in counts.items():
+            if key in stored:
+                updates.append({'_id': stored[key], '_count': count})
+            else:
+                row = dict(zip(keys, key))
+                row['count'] = count
+                inserts.append(row)
+        if updates:
+            self.session.execute(table.update().where(
+                table.c.id == sqlalchemy.bindparam('_id')).values(
+                count=table.c.count + sqlalchemy.bindparam('_count')), updates)
+        self.insert_many(table, inserts)
+
+    def update_rollups(self, batch=C.DEFAULT_ROLLUP_BATCH):
+        ''' fold tasks added since the last run into the rollup table
+
+        Each batch is counted and the watermark advanced in one
+        transaction.  If another process advanced the watermark in the
+        meantime, this one stops.  Returns the number of tasks folded in.
+        '''
+        task = AnsibleTask.__table__
+        total = 0
+        while True:
+            mark = AnsibleWatermark.get(self.session, 'rollup')
+            rows = self.session.execute(sqlalchemy.select(
+                [task.c.id, task.c.timestamp, task.c.hostname, task.c.module,
+                 task.c.result, task.c.changed]).where(
+                task.c.id > mark).order_by(task.c.id).limit(batch)).fetchall()
+            if not rows:
+                break
+            counts = {}
+            for row in rows:
+                if row.timestamp is None:
+                    continue
+                for period in AnsibleRollup.PERIODS:
+                    key = (period, AnsibleRollup.floor(period, row.timestamp),
+                           row.hostname or '', row.module or '',
+                           row.result or '', bool(row.changed))
+                    counts[key] = counts.get(key, 0) + 1
+            with self.session.begin():
+                advanced = self._advance_watermark('rollup', mark, rows[-1].id)
+                if advanced:
+                    self._add_rollups(counts)
+            if not advanced:
+                break
+            total += len(rows)
+        return total
 
     @_db_error_decorator
     def save(self, model, nocommit=False):
@@ -58,12 +471,157 @@ class Manager(object):
             self.session.add(model)
             self.session.flush()
 
+    @_db_error_decorator
+    def save_all(self, models):
+        ''' save a list of objects in a single transaction '''
+        if not models:
+            return
+        with self.session.begin(subtransactions=True):
+            self._add_task_payloads(models)
+            if hasattr(self.session, 'bulk_save_objects'):
+                # SQLAlchemy >= 1.0 can batch these into executemany()
+                self.session.bulk_save_objects(models)
+            else:
+                self.session.add_all(models)
+            self.session.flush()
+
+    def _insert_ignore(self, table):
+        ''' return INSERT for table that skips rows already present '''
+        name = self.engine.dialect.name
+        if name == 'sqlite':
+            return table.insert().prefix_with('OR IGNORE')
+        elif name == 'mysql':
+            return table.insert().prefix_with('IGNORE')
+        elif name == 'postgresql':
+            try:
+                from sqlalchemy.dialects.postgresql import insert
+                return insert(table).on_conflict_do_nothing()
+            except (ImportError, AttributeError):
+                pass
+        logging.warn("%s cannot skip existing rows; using a plain INSERT" % name)
+        return table.insert()
+
+    @_db_error_decorator
+    def insert_many(self, table, rows, skip_existing=False):
+        ''' insert a list of dicts into table with a single executemany()
+
+        With skip_existing, rows that collide with a unique index on the
+        table are silently skipped.
+        '''
+        if not rows:
+            return
+        if skip_existing:
+            sql = self._insert_ignore(table)
+        else:
+            sql = table.insert()
+        with self.session.begin(subtransactions=True):
+            self.session.execute(sql, rows)
+
+    def _recompress_table(self, table, key, name, batch):
+        raw = sqlalchemy.type_coerce(table.c.data, LargeBinary)
+        update = table.update().where(
+            key == sqlalchemy.bindparam('_key')).values(
+            data=sqlalchemy.bindparam('_data', type_=LargeBinary))
+        last = None
+        rewritten = before = after = 0
+        while True:
+            sql = sqlalchemy.select([key, raw]).order_by(key).limit(batch)
+            if last is not None:
+                sql = sql.where(key > last)
+            rows = self.session.execute(sql).fetchall()
+            if not rows:
+                break
+            changes = []
+            for (id, data) in rows:
+                if data is None:
+                    continue
+                data = str(data)
+                new = codec.encode(codec.decode(data), name)
+                if new != data:
+                    changes.append({'_key': id, '_data': new})
+                    before += len(data)
+                    after += len(new)
+            if changes:
+                with self.session.begin():
+                    self.session.execute(update, changes)
+                rewritten += len(changes)
+            last = rows[-1][0]
+        return (rewritten, before, after)
+
+    def recompress(self, name=None, batch=C.DEFAULT_RECOMPRESS_BATCH):
+        ''' rewrite stored task data with codec name, batch rows at a time
+
+        Rows that would not change are left alone, so this can be stopped
+        and run again.  Returns (rows rewritten, bytes before, bytes after).
+        '''
+        totals = [0, 0, 0]
+        for table in (AnsibleTask.__table__, AnsiblePayload.__table__):
+            key = table.primary_key.columns.values()[0]
+            counts = self._recompress_table(table, key, name, batch)
+            totals = [a + b for (a, b) in zip(totals, counts)]
+        return tuple(totals)
+
+    def incremental_vacuum(self, pages=C.DEFAULT_VACUUM_PAGES, sleep=0):
+        ''' return free pages of a SQLite database to the filesystem
+
+        Pages are freed pages at a time, each step a short transaction of
+        its own, sleeping sleep seconds between steps, until none are left
+        or a step frees nothing.  Returns the number
+        of pages freed, or None if the database does not use incremental
+        auto_vacuum; see vacuum() to convert it.
+        '''
+        if not self.engine.url.drivername.startswith('sqlite'):
+            return None
+        conn = self.engine.connect()
+        try:
+            if conn.execute('PRAGMA auto_vacuum').scalar() != 2:
+                return None
+            freed = 0
+            free = conn.execute('PRAGMA freelist_count').scalar()
+            while free:
+                # the pragma frees one page per row it is stepped through
+                conn.execute('PRAGMA incremental_vacuum(%d)' % pages).fetchall()
+                left = conn.execute('PRAGMA freelist_count').scalar()
+                if left >= free:
+                    # nothing could be freed, say while another
+                    # connection is reading
+                    break
+                freed += free - left
+                free = left
+                if sleep:
+                    time.sleep(sleep)
+            return freed
+        finally:
+            conn.close()
+
+    def vacuum(self):
+        ''' rebuild a SQLite database, switching it to incremental auto_vacuum
+
+        This locks the database for as long as it takes to copy it, but is
+        only needed once for databases created before prune used
+        incremental_vacuum().
+        '''
+        conn = self.engine.connect()
+        try:
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('VACUUM')
+        finally:
+            conn.close()
+
     def get_or_create(self, model, **kwargs):
-        ''' get or create an object '''
+        ''' get or create an object
+
+        If another process inserts the same object between the lookup
+        and the insert, the model's unique index rejects our insert and
+        the row the other process created is returned instead.
+        '''
         instance = self.session.query(model).filter_by(**kwargs).first()
         if not instance:
             instance = model(**kwargs)
-            self.save(instance)
+            try:
+                self.save(instance)
+            except sqlalchemy.exc.IntegrityError:
+                instance = self.session.query(model).filter_by(**kwargs).one()
         return instance
 
     # The following is based on buildbot/master/buildbot/db/pool.py
@@ -88,6 +646,7 @@ class Manager(object):
                             raise
 
                         # sleep and retry
+                        self.retries += 1
                         time.sleep(backoff)
                         backoff *= C.DEFAULT_BACKOFF_MULT
                         # try again
@@ -100,3 +659,100 @@ class Manager(object):
                 pass
         return rv
 
+class Pruner(object):
+    '''
+    Delete playbooks, along with their tasks and summaries, and tasks
+    with plain SQL in ranges of batch ids.  Each range is a transaction
+    of its own and sleep seconds pass between them, so that callbacks
+    writing to the same database are never locked out for long.  A
+    prune that is stopped leaves no orphans and can simply be run again.
+    The summaries of playbooks that lose some of their tasks are rebuilt
+    along with each range.
+
+    progress, if given, is called after every range with the counts of
+    rows deleted so far and the rate they were deleted at.
+    '''
+
+    def __init__(self, mgr, batch=C.DEFAULT_PRUNE_BATCH,
+                 sleep=C.DEFAULT_PRUNE_SLEEP, progress=None):
+        self.mgr = mgr
+        self.session = mgr.session
+        self.batch = batch
+        self.sleep = sleep
+        self.progress = progress
+        self.counts = {'playbook': 0, 'task': 0, 'summary': 0, 'payload': 0}
+        self.start = None
+
+    def rate(self):
+        ''' return playbooks and tasks deleted per second so far '''
+        elapsed = time.time() - (self.start or time.time())
+        if not elapsed:
+            return 0.0
+        return (self.counts['playbook'] + self.counts['task']) / elapsed
+
+    def _chunks(self, table, where, delete):
+        '''
+        call delete() with a clause for each successive range of batch
+        ids of the rows of table matching where, until there are none
+        '''
+        key = table.c.id
+        last = 0
+        while True:
+            ids = sqlalchemy.select([key]).where(and_(where, key > last)).order_by(
+                key).limit(self.batch).alias('chunk')
+            high = self.session.execute(
+                sqlalchemy.select([func.max(ids.c.id)])).scalar()
+            if high is None:
+                break
+            delete(and_(where, key > last, key <= high))
+            last = high
+            if self.progress is not None:
+                self.progress(self.counts, self.rate())
+            if self.sleep:
+                time.sleep(self.sleep)
+
+    def _delete_tasks(self, chunk, summarize=False):
+        task = AnsibleTask.__table__
+        with self.session.begin():
+            if summarize:
+                playbook_ids = [row[0] for row in self.session.execute(
+                    sqlalchemy.select([task.c.playbook_id]).where(and_(
+                        chunk, task.c.playbook_id != None)).distinct())]
+            self.counts['payload'] += self.mgr.release_payloads(
+                self.session.query(AnsibleTask).filter(chunk))
+            self.counts['task'] += self.session.execute(
+                task.delete().where(chunk)).rowcount
+            if summarize:
+                # the playbooks stay, so count what is left of them
+                self.mgr.update_summary(sorted(playbook_ids))
+
+    def _delete_playbooks(self, chunk):
+        task = AnsibleTask.__table__
+        playbook = AnsiblePlaybook.__table__
+        summary = AnsibleSummary.__table__
+        ids = sqlalchemy.select([playbook.c.id]).where(chunk)
+        # tasks first, so that a stopped prune never orphans any
+        self._chunks(task, task.c.playbook_id.in_(ids), self._delete_tasks)
+        with self.session.begin():
+            self.counts['summary'] += self.session.execute(
+                summary.delete().where(summary.c.playbook_id.in_(ids))).rowcount
+            self.counts['playbook'] += self.session.execute(
+                playbook.delete().where(chunk)).rowcount
+
+    def prune(self, playbooks=None, tasks=None):
+        '''
+        delete the playbooks matching the WHERE clause playbooks and the
+        tasks matching tasks; see filter_clause().  Returns the counts of
+        playbooks, tasks, summaries and payloads deleted.
+        '''
+        self.start = time.time()
+        if playbooks is not None:
+            self._chunks(AnsiblePlaybook.__table__, playbooks,
+                         self._delete_playbooks)
+        if tasks is not None:
+            self._chunks(AnsibleTask.__table__, tasks,
+                         lambda chunk: self._delete_tasks(chunk, summarize=True))
+        if self.counts['playbook'] or self.counts['task']:
+            # the largest ids need not change, so tell cached reports
+            self.mgr.bump_watermark('prune')
+        return self.counts
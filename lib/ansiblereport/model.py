@@ -16,58 +16,263 @@
 # You should have received a copy of the GNU General Public License
 # along with ansible-report.  If not, see <http://www.gnu.org/licenses/>.
 
+import base64
 import json
 import datetime
+import hashlib
 import logging
 import operator
 
 import ansiblereport.constants as C
+import ansiblereport.codec as codec
 
+import sqlalchemy.orm
 from sqlalchemy import *
 from sqlalchemy.orm import *
-from sqlalchemy.types import TypeDecorator, Text
+from sqlalchemy.types import TypeDecorator, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
 
 import ansible.constants
 
 class JSONEncodedDict(TypeDecorator):
-    impl = Text
+    ''' JSON document stored through ansiblereport.codec '''
+    impl = LargeBinary
 
     def process_bind_param(self, value, dialect):
-        if value is not None:
-            value = json.dumps(value)
-        return value
+        return codec.encode(value)
 
     def process_result_value(self, value, dialect):
-        if value is not None:
-            value = json.loads(value)
-        return value
+        return codec.decode(value)
 
     def __repr__(self):
-        return "JSONEncodedDict(%s)" % self.value
+        return "JSONEncodedDict()"
+
+class LazyJSONEncodedDict(JSONEncodedDict):
+    ''' JSONEncodedDict whose values are decoded on first use; see codec.Lazy '''
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return codec.Lazy(value)
+
+    def __repr__(self):
+        return "LazyJSONEncodedDict()"
 
 Base = declarative_base()
 
-def filter_query(session, sql, cls, col, arg, timeop):
+def payload_hash(data):
+    ''' return the key data is stored under in the payload table '''
+    return hashlib.sha1(codec.dumps(data)).hexdigest()
+
+def is_time_column(attr):
+    ''' return True if the mapped attribute attr is a DateTime column '''
+    columns = getattr(attr.property, 'columns', [])
+    return bool(columns) and isinstance(columns[0].type, DateTime)
+
+def normalize_args(cls, args):
+    '''
+    return search criteria args as a list of (column, value) sorted by
+    column, skipping columns cls does not have.  Lists of values become
+    sorted tuples without duplicates, so that equal criteria always give
+    identical SQL.
+    '''
+    criteria = []
+    for col in sorted(args or {}):
+        if not hasattr(cls, col):
+            logging.warn('%s does not have the attribute %s' % (cls, col))
+            continue
+        arg = args[col]
+        if isinstance(arg, (list, tuple, set)):
+            if is_time_column(getattr(cls, col)):
+                arg = tuple(arg)
+            else:
+                arg = tuple(sorted(set(arg)))
+        criteria.append((col, arg))
+    return criteria
+
+def _time_clauses(attr, arg, timeop):
+    ''' return clauses restricting time column attr to arg '''
+    if not isinstance(arg, tuple):
+        return [timeop(attr, arg)]
+    (start, end) = arg
     clauses = []
-    if not hasattr(cls, col):
-        logging.warn('%s does not have the attribute %s' % (cls, col))
-        return sql
-    if isinstance(arg, list):
-        for n in arg:
-            clauses.append(getattr(cls, col) == n)
-    else:
-        # the time comparison is hard-coded for now.
-        # FIXME: make this user controllable.
-        if 'time' in col:
-            clauses.append(timeop(getattr(cls, col), arg))
+    if start is not None:
+        clauses.append(attr >= start)
+    if end is not None:
+        clauses.append(attr < end)
+    return clauses
+
+def _value_clause(attr, values):
+    ''' return clause matching attr against a tuple of values '''
+    clauses = []
+    present = [value for value in values if value is not None]
+    if len(present) == 1:
+        clauses.append(attr == present[0])
+    elif present:
+        clauses.append(attr.in_(present))
+    if len(present) < len(values):
+        clauses.append(attr == None)
+    return or_(*clauses)
+
+def filter_clause(cls, args, timeop=operator.gt,
+                  intersection=C.DEFAULT_INTERSECTION):
+    '''
+    return the WHERE clause for search criteria args on cls, or None if
+    there are none.  args maps column names to a value or a list of
+    values, which becomes IN (...).  Time columns take a datetime that
+    is compared with timeop, or a (start, end) range, and always narrow
+    the result.  The other criteria are ANDed with intersection and
+    ORed without it.
+    '''
+    ranges = []
+    clauses = []
+    for (col, arg) in normalize_args(cls, args):
+        attr = getattr(cls, col)
+        if is_time_column(attr):
+            ranges.extend(_time_clauses(attr, arg, timeop))
+        elif isinstance(arg, tuple):
+            if arg:
+                clauses.append(_value_clause(attr, arg))
         else:
-            clauses.append(getattr(cls, col) == arg)
+            clauses.append(attr == arg)
+    if len(clauses) > 1 and not intersection:
+        clauses = [or_(*clauses)]
+    clauses = ranges + clauses
+    if not clauses:
+        return None
+    return and_(*clauses)
+
+def filter_query(session, sql, cls, args, timeop=operator.gt,
+                 intersection=C.DEFAULT_INTERSECTION):
+    '''
+    restrict sql, or a new query for cls if it is None, to search
+    criteria args; see filter_clause().  Returns sql unchanged when
+    there are no criteria.
+    '''
+    clause = filter_clause(cls, args, timeop, intersection)
+    if clause is None:
+        return sql
     if sql is None:
-        sql = session.query(cls).filter(or_(*clauses))
-    else:
-        sql = sql.filter(or_(*clauses))
-    return sql
+        sql = session.query(cls)
+    return sql.filter(clause)
+
+def has_rows_between(session, cls, column, args, start, end,
+                     intersection=C.DEFAULT_INTERSECTION):
+    '''
+    return True if any row of cls matching search criteria args has
+    time column in the range (start, end]; this is what moving a cutoff
+    from start to end drops from a report
+    '''
+    attr = getattr(cls, column)
+    sql = session.query(cls.id).filter(and_(attr > start, attr <= end))
+    sql = filter_query(session, sql, cls, args, intersection=intersection)
+    return sql.limit(1).first() is not None
+
+def _loader(prop, strategy, batch=None):
+    ''' return name of the loader option for relationship prop '''
+    if strategy == 'auto':
+        if prop.uselist:
+            strategy = 'selectin'
+        else:
+            strategy = 'joined'
+    if batch and prop.uselist and strategy in ('joined', 'subquery'):
+        # yield_per cannot load collections in the same statement
+        strategy = 'selectin'
+    if strategy == 'selectin' and not hasattr(sqlalchemy.orm, 'selectinload'):
+        # SQLAlchemy < 1.2
+        strategy = 'subquery'
+    return strategy + 'load'
+
+def loading_options(cls, relations, strategy=C.DEFAULT_REPORT_LOADING, batch=None):
+    '''
+    return query options that load the relations of cls along with it;
+    relations are attribute names, dotted to reach further, such as
+    'tasks.payload'.  A deferred column, such as 'data' or 'tasks.data',
+    is loaded with the rows it belongs to.  Pass batch when the query
+    will use yield_per.
+    '''
+    options = []
+    for path in relations:
+        names = path.split('.')
+        if strategy == 'lazy' and len(names) > 1:
+            continue
+        loader = None
+        current = cls
+        for name in names:
+            attr = getattr(current, name)
+            prop = attr.property
+            if isinstance(prop, ColumnProperty):
+                if loader is None:
+                    loader = sqlalchemy.orm.undefer(prop.key)
+                else:
+                    loader = loader.undefer(prop.key)
+                break
+            if strategy == 'lazy':
+                break
+            method = _loader(prop, strategy, batch)
+            if loader is None:
+                loader = getattr(sqlalchemy.orm, method)(attr)
+            else:
+                loader = getattr(loader, method)(attr)
+            current = prop.mapper.class_
+        if loader is not None:
+            options.append(loader)
+    return options
+
+def reportable_clause(columns):
+    '''
+    return the SQL form of utils.is_reportable_task() for columns, a
+    mapped class or the .c of a table with result and changed columns
+    '''
+    return or_(columns.result.in_(C.DEFAULT_TASK_WARN_RESULTS),
+               and_(columns.result.in_(C.DEFAULT_TASK_OKAY_RESULTS),
+                    columns.changed == True))
+
+CURSOR_STRFTIME = '%Y-%m-%dT%H:%M:%S.%f'
+
+def encode_cursor(value, ident):
+    ''' return an opaque token for the position (value, ident) '''
+    token = '{0},{1}'.format(value.strftime(CURSOR_STRFTIME), ident)
+    return base64.urlsafe_b64encode(token).rstrip('=')
+
+def decode_cursor(token):
+    '''
+    return the (datetime, id) position that a token from encode_cursor
+    stands for; a (datetime, id) tuple is passed through
+    '''
+    if isinstance(token, tuple):
+        return token
+    try:
+        token = str(token)
+        data = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        (value, ident) = data.split(',')
+        return (datetime.datetime.strptime(value, CURSOR_STRFTIME), int(ident))
+    except (TypeError, ValueError):
+        raise ValueError('invalid cursor: %s' % token)
+
+def keyset_query(sql, cls, column, after=None):
+    '''
+    order sql newest first by (column, id) and, given the cursor after,
+    restrict it to the rows that follow that position
+    '''
+    attr = getattr(cls, column)
+    if after is not None:
+        (value, ident) = decode_cursor(after)
+        # the range on column alone lets the index bound the scan
+        sql = sql.filter(attr <= value, or_(attr < value, cls.id < ident))
+    return sql.order_by(attr.desc(), cls.id.desc())
+
+def keyset_page(sql, cls, column, page_size, after=None):
+    '''
+    return up to page_size rows of sql that come after the cursor after,
+    and the cursor of the next page (None on the last page).  Each page
+    is a range on the index of (column, id) no matter how deep it is.
+    '''
+    rows = keyset_query(sql, cls, column, after).limit(page_size + 1).all()
+    if len(rows) <= page_size:
+        return (rows, None)
+    rows = rows[:page_size]
+    return (rows, encode_cursor(getattr(rows[-1], column), rows[-1].id))
 
 class AnsibleTask(Base):
     __tablename__ = 'task'
@@ -78,24 +283,66 @@ class AnsibleTask(Base):
     module = Column(String)
     result = Column(String)
     changed = Column(Boolean)
-    data = Column(JSONEncodedDict)
+    # only loaded when asked for, such as with the 'data' relation of
+    # loading_options(), and only decoded when read
+    _data = deferred(Column('data', LazyJSONEncodedDict))
     user_id = Column(Integer, ForeignKey('user.id'))
     playbook_id = Column(Integer, ForeignKey('playbook.id'))
+    # order of the event within its playbook; see Writer._prepare_task
+    seq = Column(Integer)
+    # with payload.dedup, data lives in the payload table instead
+    payload_hash = Column(String(40), ForeignKey('payload.hash'))
     __table_args__ = (
-            Index('task_timestamp_idx', 'timestamp'),
-            Index('task_hostname_idx', 'hostname'),
-            Index('task_module_idx', 'module'),
+            Index('task_timestamp_idx', 'timestamp', 'id'),
+            # searches filter on one of these and sort by timestamp
+            Index('task_hostname_timestamp_idx', 'hostname', 'timestamp'),
+            Index('task_module_timestamp_idx', 'module', 'timestamp'),
+            Index('task_result_timestamp_idx', 'result', 'timestamp'),
             Index('task_changed_idx', 'changed'),
-            Index('task_result_idx', 'result')
+            # also serves playbook.tasks, which filters on playbook_id
+            Index('task_playbook_seq_idx', 'playbook_id', 'seq', unique=True),
+            Index('task_user_idx', 'user_id'),
+            Index('task_payload_hash_idx', 'payload_hash'),
             )
 
+    payload = relation("AnsiblePayload")
+    # data of a new task, and whether its payload row has been stored
+    new_payload = None
+    payload_stored = False
+
     def __init__(self, hostname, module, result, data):
+        # record when the event happened, not when it was written out
+        self.timestamp = datetime.datetime.now()
         self.hostname = hostname
         self.module = module
         self.result = result
         self.data = data
-        if isinstance(data, dict) and 'changed' in data:
-            self.changed = self.data['changed']
+        value = codec.resolve(data)
+        if isinstance(value, dict) and 'changed' in value:
+            self.changed = value['changed']
+
+    def _get_data(self):
+        if self.payload_hash is None:
+            return codec.resolve(self._data)
+        if self.new_payload is not None:
+            return codec.resolve(self.new_payload)
+        if self.payload is None:
+            return None
+        return self.payload.data
+
+    def _set_data(self, data):
+        self.new_payload = None
+        self.payload_stored = False
+        self.payload_hash = None
+        if data is not None and C.DEFAULT_PAYLOAD_DEDUP:
+            # hashed and stored from the same JSON document
+            data = codec.serialize(data)
+            self.payload_hash = payload_hash(data)
+            self.new_payload = data
+            data = None
+        self._data = data
+
+    data = synonym('_data', descriptor=property(_get_data, _set_data))
 
     def __repr__(self):
         return "<AnsibleTask<'%s', '%s', '%s'>" % (self.hostname, self.module, self.result)
@@ -105,12 +352,16 @@ class AnsibleTask(Base):
         session.delete(self)
 
     @classmethod
-    def find_tasks(cls, session, args=None, limit=1, timeop=operator.gt, orderby=True):
-        sql = None
-        if args is not None:
-            for col in args:
-                if hasattr(cls, col):
-                    sql = filter_query(session, sql, cls, col, args[col], timeop)
+    def find_tasks(cls, session, args=None, limit=1, timeop=operator.gt, orderby=True,
+                   relations=None, batch=None, intersection=C.DEFAULT_INTERSECTION,
+                   reportable=False):
+        sql = filter_query(session, None, cls, args, timeop, intersection)
+        if reportable and sql is not None:
+            sql = sql.filter(reportable_clause(cls))
+        if relations and sql is not None:
+            sql = sql.options(*loading_options(cls, relations, batch=batch))
+        if batch and sql is not None:
+            sql = sql.yield_per(batch)
         if orderby:
             if limit == 0:
                 return sql.order_by(cls.timestamp.desc())
@@ -119,6 +370,24 @@ class AnsibleTask(Base):
         else:
             return sql
 
+    @classmethod
+    def page_tasks(cls, session, args=None, page_size=100, after=None,
+                   timeop=operator.gt, relations=None,
+                   intersection=C.DEFAULT_INTERSECTION, reportable=False):
+        '''
+        return a page of the tasks matching args and the cursor of the
+        next page; pass that cursor back as after to get it
+        '''
+        sql = cls.find_tasks(session, args, timeop=timeop, orderby=False,
+                             relations=relations, intersection=intersection,
+                             reportable=reportable)
+        if sql is None:
+            sql = session.query(cls).options(
+                *loading_options(cls, relations or []))
+            if reportable:
+                sql = sql.filter(reportable_clause(cls))
+        return keyset_page(sql, cls, 'timestamp', page_size, after)
+
     @classmethod
     def get_task_stats(cls, task):
         results = { task.hostname : {} }
@@ -130,6 +399,26 @@ class AnsibleTask(Base):
         results[task.hostname][task.result.lower()] += 1
         return results
 
+class AnsiblePayload(Base):
+    '''
+    A task result stored once for every task that returned it.  refcount
+    is the number of tasks referring to it; see Manager.add_payloads()
+    and Manager.release_payloads().
+    '''
+    __tablename__ = 'payload'
+
+    hash = Column(String(40), primary_key=True)
+    data = Column(JSONEncodedDict)
+    refcount = Column(Integer, default=0)
+
+    def __init__(self, data):
+        self.hash = payload_hash(data)
+        self.data = data
+        self.refcount = 0
+
+    def __repr__(self):
+        return "<AnsiblePayload<'%s', %s>" % (self.hash, self.refcount)
+
 class AnsibleUser(Base):
     __tablename__ = 'user'
 
@@ -138,6 +427,7 @@ class AnsibleUser(Base):
     euid = Column(Integer)
     __table_args__ = (
             Index('user_username_idx', 'username'),
+            Index('user_username_euid_idx', 'username', 'euid', unique=True),
             )
 
     tasks = relation("AnsibleTask", backref='user',
@@ -145,8 +435,8 @@ class AnsibleUser(Base):
     playbooks = relation("AnsiblePlaybook", backref='user',
                          cascade='all, delete, delete-orphan')
 
-    def __init__(self, user, euid):
-        self.username = user
+    def __init__(self, username, euid):
+        self.username = username
         self.euid = euid
 
     def __repr__(self):
@@ -178,11 +468,19 @@ class AnsiblePlaybook(Base):
             Index('playbook_path_idx', 'path'),
             Index('playbook_uuid_idx', 'uuid'),
             Index('playbook_connection_idx', 'connection'),
-            Index('playbook_starttime_idx', 'starttime')
+            Index('playbook_starttime_idx', 'starttime', 'id'),
+            Index('playbook_user_idx', 'user_id'),
             )
 
     tasks = relation("AnsibleTask", backref='playbook',
                      cascade='all, delete, delete-orphan')
+    summaries = relation("AnsibleSummary", backref='playbook',
+                         cascade='all, delete, delete-orphan')
+    # the tasks a report shows unless verbose; see reportable_clause()
+    reportable_tasks = relation("AnsibleTask", viewonly=True,
+                                primaryjoin=lambda: and_(
+                                    AnsiblePlaybook.id == AnsibleTask.playbook_id,
+                                    reportable_clause(AnsibleTask)))
 
     def __init__(self, uuid):
         self.uuid = uuid
@@ -199,12 +497,16 @@ class AnsiblePlaybook(Base):
         return session.query(cls).get(identifier)
 
     @classmethod
-    def find_playbooks(cls, session, args=None, limit=1, timeop=operator.gt, orderby=True):
-        sql = None
-        if args is not None:
-            for col in args:
-                if hasattr(cls, col):
-                    sql = filter_query(session, sql, cls, col, args[col], timeop)
+    def find_playbooks(cls, session, args=None, limit=1, timeop=operator.gt, orderby=True,
+                       relations=None, batch=None, intersection=C.DEFAULT_INTERSECTION,
+                       reportable=False):
+        sql = filter_query(session, None, cls, args, timeop, intersection)
+        if reportable and sql is not None:
+            sql = sql.filter(cls.reportable_tasks.any())
+        if relations and sql is not None:
+            sql = sql.options(*loading_options(cls, relations, batch=batch))
+        if batch and sql is not None:
+            sql = sql.yield_per(batch)
         if orderby:
             if limit == 0:
                 return sql.order_by(cls.starttime.desc())
@@ -214,14 +516,18 @@ class AnsiblePlaybook(Base):
             return sql
 
     @classmethod
-    def get_last_n_playbooks(cls, session, args=None, limit=1, timeop=operator.gt, orderby=True):
-        sql = None
-        if args is not None:
-            for col in args:
-                if hasattr(cls, col):
-                    sql = filter_query(session, sql, cls, col, args[col], timeop)
+    def get_last_n_playbooks(cls, session, args=None, limit=1, timeop=operator.gt, orderby=True,
+                             relations=None, batch=None,
+                             intersection=C.DEFAULT_INTERSECTION, reportable=False):
+        sql = filter_query(session, None, cls, args, timeop, intersection)
         if sql is None:
             return []
+        if reportable:
+            sql = sql.filter(cls.reportable_tasks.any())
+        if relations:
+            sql = sql.options(*loading_options(cls, relations, batch=batch))
+        if batch:
+            sql = sql.yield_per(batch)
         if orderby:
             if limit == 0:
                 return sql.order_by(cls.starttime.desc())
@@ -230,8 +536,53 @@ class AnsiblePlaybook(Base):
         else:
             return sql
 
+    @classmethod
+    def page_playbooks(cls, session, args=None, page_size=100, after=None,
+                       timeop=operator.gt, relations=None,
+                       intersection=C.DEFAULT_INTERSECTION, reportable=False):
+        '''
+        return a page of the playbooks matching args and the cursor of
+        the next page; pass that cursor back as after to get it
+        '''
+        sql = cls.find_playbooks(session, args, timeop=timeop, orderby=False,
+                                 relations=relations, intersection=intersection,
+                                 reportable=reportable)
+        if sql is None:
+            sql = session.query(cls).options(
+                *loading_options(cls, relations or []))
+            if reportable:
+                sql = sql.filter(cls.reportable_tasks.any())
+        return keyset_page(sql, cls, 'starttime', page_size, after)
+
+    @classmethod
+    def task_relation(cls, verbose=False):
+        ''' return name of the relation with the tasks a report shows '''
+        if verbose:
+            return 'tasks'
+        return 'reportable_tasks'
+
+    @classmethod
+    def report_relations(cls, relations, verbose=False):
+        '''
+        return relations, such as an output plugin's playbook_relations,
+        with 'tasks' replaced by the relation task_relation() picks
+        '''
+        name = cls.task_relation(verbose)
+        result = []
+        for path in relations:
+            parts = path.split('.')
+            if parts[0] == 'tasks':
+                parts[0] = name
+            result.append('.'.join(parts))
+        return result
+
     @classmethod
     def get_playbook_stats(cls, playbook):
+        ''' return per host counts of results; see AnsibleSummary '''
+        if playbook.summaries:
+            return dict((summary.hostname, summary.stats())
+                        for summary in playbook.summaries)
+        # not summarized yet, such as a playbook that is still running
         results = {}
         for task in playbook.tasks:
             if task.hostname not in results:
@@ -243,3 +594,203 @@ class AnsiblePlaybook(Base):
                 results[task.hostname]['changed'] += 1
             results[task.hostname][task.result.lower()] += 1
         return results
+
+class AnsibleSummary(Base):
+    '''
+    Per host counts of task results for a playbook, so that reports do
+    not have to load every task to show them.  Rows are rebuilt from the
+    task table by Manager.update_summary() when a playbook finishes.
+    '''
+    __tablename__ = 'summary'
+
+    id = Column(Integer, primary_key=True)
+    playbook_id = Column(Integer, ForeignKey('playbook.id'))
+    hostname = Column(String)
+    ok = Column(Integer, default=0)
+    changed = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    skipped = Column(Integer, default=0)
+    unreachable = Column(Integer, default=0)
+    error = Column(Integer, default=0)
+    __table_args__ = (
+            Index('summary_playbook_idx', 'playbook_id'),
+            )
+
+    # counter column -> task results counted in it
+    RESULTS = (
+        ('ok', ['OK']),
+        ('failed', ['FAILED', 'ASYNC_FAILED']),
+        ('skipped', ['SKIPPED']),
+        ('unreachable', ['UNREACHABLE']),
+        ('error', ['ERROR']),
+    )
+    COUNTERS = ['ok', 'changed', 'failed', 'skipped', 'unreachable', 'error']
+
+    def __repr__(self):
+        return "<AnsibleSummary<%s, '%s'>" % (self.playbook_id, self.hostname)
+
+    def stats(self):
+        ''' return counts as a dict, like AnsibleTask.get_task_stats() '''
+        return dict((key, getattr(self, key)) for key in self.COUNTERS)
+
+    @classmethod
+    def tally(cls, playbook_ids=None):
+        ''' return SELECT counting task results per playbook and host '''
+        task = AnsibleTask.__table__
+        def count(condition):
+            return func.coalesce(func.sum(case([(condition, 1)], else_=0)), 0)
+        columns = dict((key, count(task.c.result.in_(results)))
+                       for (key, results) in cls.RESULTS)
+        columns['changed'] = count(task.c.changed == True)
+        sql = select([task.c.playbook_id, task.c.hostname] +
+                     [columns[key].label(key) for key in cls.COUNTERS])
+        if playbook_ids is None:
+            sql = sql.where(task.c.playbook_id != None)
+        else:
+            sql = sql.where(task.c.playbook_id.in_(playbook_ids))
+        return sql.group_by(task.c.playbook_id, task.c.hostname)
+
+class AnsibleWatermark(Base):
+    '''
+    the last task id a background job such as the rollups has seen, or
+    a count of changes such as prunes that the largest ids do not show
+    '''
+    __tablename__ = 'watermark'
+
+    name = Column(String(32), primary_key=True)
+    value = Column(Integer, default=0)
+
+    def __repr__(self):
+        return "<AnsibleWatermark<'%s', %s>" % (self.name, self.value)
+
+    @classmethod
+    def get(cls, session, name):
+        ''' return the value of watermark name, 0 if it was never set '''
+        value = session.query(cls.value).filter(cls.name == name).scalar()
+        return value or 0
+
+class AnsibleRollup(Base):
+    '''
+    Task counts per time bucket, host, module, result and changed, kept
+    per hour and per day so that stats over long periods do not have to
+    read every task.  Tasks are folded in by Manager.update_rollups() in
+    task id order; the 'rollup' watermark records how far it got.
+    Missing hostnames and modules are stored as ''.
+    '''
+    __tablename__ = 'rollup'
+
+    id = Column(Integer, primary_key=True)
+    period = Column(String(8))
+    bucket = Column(DateTime)
+    hostname = Column(String)
+    module = Column(String)
+    result = Column(String)
+    changed = Column(Boolean)
+    count = Column(Integer, default=0)
+    __table_args__ = (
+            Index('rollup_bucket_idx', 'period', 'bucket', 'hostname',
+                  'module', 'result', 'changed', unique=True),
+            )
+
+    # coarsest first
+    PERIODS = ('day', 'hour')
+
+    def __init__(self, hostname, result, changed, count):
+        self.hostname = hostname
+        self.result = result
+        self.changed = changed
+        self.count = count
+
+    def __repr__(self):
+        return "<AnsibleRollup<'%s', '%s', %s>" % (self.hostname, self.result, self.count)
+
+    @classmethod
+    def floor(cls, period, timestamp):
+        ''' return the start of the period bucket timestamp falls in '''
+        timestamp = timestamp.replace(minute=0, second=0, microsecond=0)
+        if period == 'day':
+            timestamp = timestamp.replace(hour=0)
+        return timestamp
+
+    @classmethod
+    def ceil(cls, period, timestamp):
+        ''' return the start of the first period bucket after timestamp '''
+        start = cls.floor(period, timestamp)
+        if start == timestamp:
+            return start
+        if period == 'day':
+            return start + datetime.timedelta(days=1)
+        return start + datetime.timedelta(hours=1)
+
+    @classmethod
+    def _filter(cls, sql, mapped, args, verbose, intersection):
+        '''
+        restrict sql on the table of class mapped to args and, unless
+        verbose, reportable tasks
+        '''
+        clause = filter_clause(mapped, args, intersection=intersection)
+        if clause is not None:
+            sql = sql.where(clause)
+        if not verbose:
+            sql = sql.where(reportable_clause(mapped))
+        return sql
+
+    @classmethod
+    def find_stats(cls, session, args=None, age=None, verbose=False,
+                   intersection=C.DEFAULT_INTERSECTION):
+        '''
+        return list of AnsibleRollup with task counts per host, result and
+        changed, for tasks matching args newer than age
+
+        Whole days after age come from the daily rollup and whole hours
+        from the hourly one; the rest of the first hour and tasks not yet
+        rolled up are counted from the task table.
+        '''
+        rollup = cls.__table__
+        task = AnsibleTask.__table__
+        mark = AnsibleWatermark.get(session, 'rollup')
+        columns = [rollup.c.hostname, rollup.c.result, rollup.c.changed]
+        queries = []
+        if age is None:
+            windows = [('day', None, None)]
+            raw = [task.c.id > mark]
+        else:
+            hour = cls.ceil('hour', age)
+            day = cls.ceil('day', age)
+            windows = [('day', day, None), ('hour', hour, day)]
+            # two queries rather than an OR so each can use an index
+            raw = [and_(task.c.timestamp > age, task.c.timestamp < hour),
+                   and_(task.c.id > mark, task.c.timestamp >= hour)]
+        for (period, start, end) in windows:
+            sql = select(columns + [func.sum(rollup.c.count)]).where(
+                rollup.c.period == period)
+            if start is not None:
+                sql = sql.where(rollup.c.bucket >= start)
+            if end is not None:
+                sql = sql.where(rollup.c.bucket < end)
+            queries.append(cls._filter(sql, cls, args, verbose, intersection).group_by(*columns))
+        columns = [task.c.hostname, task.c.result, task.c.changed]
+        for where in raw:
+            sql = select(columns + [func.count()]).where(where)
+            queries.append(cls._filter(sql, AnsibleTask, args, verbose,
+                                       intersection).group_by(*columns))
+        counts = {}
+        for sql in queries:
+            for (hostname, result, changed, count) in session.execute(sql):
+                key = (hostname or None, result, bool(changed))
+                counts[key] = counts.get(key, 0) + count
+        return [cls(hostname, result, changed, count)
+                for ((hostname, result, changed), count) in sorted(counts.items())]
+
+    @classmethod
+    def get_rollup_stats(cls, rollup):
+        ''' return stats like AnsibleTask.get_task_stats() for a find_stats() row '''
+        results = { rollup.hostname : {} }
+        for key in C.DEFAULT_TASK_RESULTS:
+            results[rollup.hostname][key.lower()] = 0
+        results[rollup.hostname]['changed'] = 0
+        if rollup.changed:
+            results[rollup.hostname]['changed'] += rollup.count
+        key = rollup.result.lower()
+        results[rollup.hostname][key] = results[rollup.hostname].get(key, 0) + rollup.count
+        return results
@@ -0,0 +1,285 @@
+# Written by Stephen Fromm <sfromm@gmail.com>
+# (C) 2013 University of Oregon
+
+# This file is part of ansible-report
+#
+# ansible-report is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ansible-report is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ansible-report.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import glob
+import logging
+import mmap
+import os
+
+import ansiblereport.constants as C
+from ansiblereport import codec
+from ansiblereport.model import *
+
+# Spool files hold callback events as one JSON record per line.  A spool
+# starts with a 'user' record naming who ran ansible, followed by 'play'
+# and 'task' records in the order they happened.  Play records are full
+# snapshots of the playbook and are logged more than once per run; task
+# records refer to their playbook by uuid and carry their sequence number
+# within it, which is what makes loading a spool more than once safe.
+
+SPOOL_STRFTIME = '%Y-%m-%d %H:%M:%S.%f'
+SPOOL_PLAY_ATTRS = ('path', 'connection', 'checksum', 'starttime', 'endtime')
+
+def _format_time(value):
+    if value is None:
+        return None
+    return value.strftime(SPOOL_STRFTIME)
+
+def _parse_time(value):
+    if value is None:
+        return None
+    return datetime.datetime.strptime(value, SPOOL_STRFTIME)
+
+def user_record(username, euid):
+    ''' return spool record for the user running ansible '''
+    return {'type': 'user', 'username': username, 'euid': euid}
+
+def play_record(play):
+    ''' return spool record for an AnsiblePlaybook '''
+    return {
+        'type': 'play',
+        'uuid': play.uuid,
+        'path': play.path,
+        'connection': play.connection,
+        'checksum': play.checksum,
+        'starttime': _format_time(play.starttime),
+        'endtime': _format_time(play.endtime),
+    }
+
+def task_record(task, uuid=None):
+    ''' return spool record for an AnsibleTask in playbook uuid '''
+    return {
+        'type': 'task',
+        'uuid': uuid,
+        'seq': task.seq,
+        'timestamp': _format_time(task.timestamp),
+        'hostname': task.hostname,
+        'module': task.module,
+        'result': task.result,
+        'changed': task.changed,
+        'data': task.data,
+    }
+
+def dump_record(record):
+    ''' return record as a line for a spool file '''
+    return codec.dumps(record) + '\n'
+
+def read_spool(path, kinds=None):
+    '''
+    Generator returning the records in a spool file.  The file is
+    memory-mapped and walked a line at a time, so large spools are never
+    read into memory at once.  A truncated last record, as left behind by
+    a crash, is skipped.  With kinds, only records of those types are
+    returned, and other lines are not even decoded.
+    '''
+    markers = None
+    if kinds is not None:
+        markers = ['"type":"%s"' % kind for kind in kinds]
+    f = open(path, 'rb')
+    try:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return
+        spool = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            pos = 0
+            while pos < size:
+                end = spool.find('\n', pos)
+                if end == -1:
+                    end = size
+                line = spool[pos:end]
+                pos = end + 1
+                if not line.strip():
+                    continue
+                if markers is not None and \
+                        not [m for m in markers if m in line]:
+                    continue
+                try:
+                    record = codec.loads(line)
+                    if kinds is None or record.get('type') in kinds:
+                        yield record
+                except ValueError:
+                    logging.warn("skipping malformed record at byte %d of %s" % (
+                        pos - len(line) - 1, path))
+        finally:
+            spool.close()
+    finally:
+        f.close()
+
+def find_spools(paths):
+    ''' expand list of files and directories into spool files '''
+    spools = []
+    for path in paths:
+        if os.path.isdir(path):
+            spools.extend(sorted(glob.glob(os.path.join(path, '*.spool'))))
+        else:
+            spools.append(path)
+    return spools
+
+class SpoolLoader(object):
+    '''
+    Bulk load spool files into the database.  Tasks are inserted 'batch'
+    rows at a time with a single executemany(); users and playbooks are
+    looked up once per load and cached.
+
+    Loading is idempotent.  The sequence numbers already stored for a
+    playbook are read once, the first time the loader sees it, and tasks
+    carrying one of them are skipped without touching the database; a
+    load interrupted part way resumes where it left off.  The insert
+    itself also skips any task whose (playbook, seq) is already present.
+
+    A playbook's tasks may be spread over several spools, one per
+    ansible worker process, while its play records are only in the
+    spool of the playbook process.  Call load_plays() on every spool
+    before load() so that spool order does not matter.  Tasks of a
+    playbook that is still unknown are held back (counted in 'held')
+    rather than stored without one; loading again once the spool with
+    the play is there picks them up.
+    '''
+
+    def __init__(self, mgr, batch=C.DEFAULT_INGEST_BATCH):
+        self.mgr = mgr
+        self.batch = batch
+        self.users = {}
+        self.plays = {}
+        self.stored = {}
+        self.pending = []
+        self.tasks = 0
+        self.skipped = 0
+        self.held = 0
+
+    def _get_user_id(self, username, euid):
+        key = (username, euid)
+        if key not in self.users:
+            user = self.mgr.get_or_create(AnsibleUser,
+                                          username=username, euid=euid)
+            self.users[key] = user.id
+        return self.users[key]
+
+    def _get_play(self, uuid):
+        if uuid not in self.plays:
+            play = self.mgr.session.query(
+                AnsiblePlaybook).filter_by(uuid=uuid).first()
+            if play is None:
+                # another spool may still bring it
+                return None
+            self.plays[uuid] = play
+        return self.plays[uuid]
+
+    def _get_stored(self, play):
+        ''' return set of sequence numbers stored for play '''
+        if play.id not in self.stored:
+            rows = self.mgr.session.query(AnsibleTask.seq).filter(
+                and_(AnsibleTask.playbook_id == play.id,
+                     AnsibleTask.seq != None))
+            self.stored[play.id] = set([row.seq for row in rows])
+        return self.stored[play.id]
+
+    def _load_play(self, record, user_id):
+        play = self._get_play(record['uuid'])
+        if play is None:
+            play = AnsiblePlaybook(record['uuid'])
+            play.user_id = user_id
+        for attr in SPOOL_PLAY_ATTRS:
+            value = record.get(attr)
+            if value is None:
+                continue
+            if attr.endswith('time'):
+                value = _parse_time(value)
+            setattr(play, attr, value)
+        self.mgr.save(play)
+        self.plays[play.uuid] = play
+
+    def _load_task(self, record, user_id):
+        playbook_id = None
+        seq = record.get('seq')
+        if record.get('uuid') is not None:
+            play = self._get_play(record['uuid'])
+            if play is None:
+                self.held += 1
+                return
+            playbook_id = play.id
+            if seq is not None:
+                stored = self._get_stored(play)
+                if seq in stored:
+                    self.skipped += 1
+                    return
+                stored.add(seq)
+        self.pending.append({
+            'timestamp': _parse_time(record['timestamp']),
+            'hostname': record['hostname'],
+            'module': record['module'],
+            'result': record['result'],
+            'changed': record['changed'],
+            'data': record['data'],
+            'user_id': user_id,
+            'playbook_id': playbook_id,
+            'seq': seq,
+            'payload_hash': None,
+        })
+        if len(self.pending) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        ''' insert pending tasks '''
+        pending = self.pending
+        self.pending = []
+        payloads = []
+        if C.DEFAULT_PAYLOAD_DEDUP:
+            for row in pending:
+                if row['data'] is not None:
+                    row['data'] = codec.serialize(row['data'])
+                    row['payload_hash'] = payload_hash(row['data'])
+                    payloads.append((row['payload_hash'], row['data']))
+                    row['data'] = None
+        with self.mgr.session.begin(subtransactions=True):
+            self.mgr.add_payloads(payloads)
+            self.mgr.insert_many(AnsibleTask.__table__, pending,
+                                 skip_existing=True)
+        self.tasks += len(pending)
+
+    def load_plays(self, path):
+        ''' load only the play records of one spool file '''
+        user_id = None
+        for record in read_spool(path, kinds=('user', 'play')):
+            if record['type'] == 'user':
+                user_id = self._get_user_id(record['username'], record['euid'])
+            else:
+                self._load_play(record, user_id)
+
+    def load(self, path):
+        ''' load one spool file; returns number of tasks loaded '''
+        start = self.tasks
+        user_id = None
+        for record in read_spool(path):
+            kind = record.get('type')
+            if kind == 'user':
+                user_id = self._get_user_id(record['username'], record['euid'])
+            elif kind == 'play':
+                self._load_play(record, user_id)
+            elif kind == 'task':
+                self._load_task(record, user_id)
+            else:
+                logging.warn("unknown record type '%s' in %s" % (kind, path))
+        self.flush()
+        return self.tasks - start
+
+    def summarize(self):
+        ''' rebuild the summaries of all playbooks loaded so far '''
+        self.mgr.update_summary([play.id for play in self.plays.values()])
@@ -0,0 +1,120 @@
+# Written by Stephen Fromm <sfromm@gmail.com>
+# (C) 2013 University of Oregon
+
+# This file is part of ansible-report
+#
+# ansible-report is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ansible-report is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ansible-report.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import multiprocessing
+
+import ansiblereport.constants as C
+from ansiblereport import codec
+
+# The keys of a result that format_task_report() shows.  'changed' is
+# always kept since AnsibleTask reads it.
+REPORT_KEYS = ['msg', 'result', 'invocation', 'after', 'path', 'dest']
+ALWAYS_KEEP = ['changed']
+
+TRUNCATED = '... [%d characters truncated]'
+
+def get_rule(module=None):
+    '''
+    return (drop, keep, max_string) for module; settings for the module,
+    such as payload.setup.keep, take precedence over the global ones
+    '''
+    drop = C.DEFAULT_PAYLOAD_DROP
+    keep = C.DEFAULT_PAYLOAD_KEEP
+    max_string = C.DEFAULT_PAYLOAD_MAX_STRING
+    if module:
+        prefix = 'payload.%s.' % module
+        drop = C.get_config_list(prefix + 'drop', None, drop)
+        keep = C.get_config_list(prefix + 'keep', None, keep)
+        max_string = C.get_config_int(prefix + 'max_string', None, max_string)
+    if 'report' in keep:
+        keep = [key for key in keep if key != 'report'] + REPORT_KEYS
+    if keep:
+        keep = keep + ALWAYS_KEEP
+    return (set(drop), set(keep), max_string)
+
+class PayloadFilter(object):
+    '''
+    Trim task results before they are stored: drop keys, keep only some
+    keys or cap the length of strings, as configured per module.  The
+    bytes saved are counted in shared memory so that results trimmed in
+    forked ansible workers are counted too.
+    '''
+
+    def __init__(self):
+        self.rules = {}
+        self.trimmed = multiprocessing.Value('l', 0)
+        self.saved = multiprocessing.Value('l', 0)
+
+    def _get_rule(self, module):
+        if module not in self.rules:
+            self.rules[module] = get_rule(module)
+        return self.rules[module]
+
+    def _truncate(self, value, max_string):
+        ''' return (value with long strings capped, characters saved) '''
+        if isinstance(value, basestring):
+            cut = len(value) - max_string
+            marker = TRUNCATED % cut
+            if cut <= len(marker):
+                return (value, 0)
+            return (value[:max_string] + marker, cut - len(marker))
+        if isinstance(value, dict):
+            saved = 0
+            result = {}
+            for (key, item) in value.items():
+                (result[key], n) = self._truncate(item, max_string)
+                saved += n
+            return (result, saved)
+        if isinstance(value, list):
+            saved = 0
+            result = []
+            for item in value:
+                (item, n) = self._truncate(item, max_string)
+                result.append(item)
+                saved += n
+            return (result, saved)
+        return (value, 0)
+
+    def apply(self, module, res):
+        ''' return res trimmed by the rule for module; res is not changed '''
+        (drop, keep, max_string) = self._get_rule(module)
+        if not isinstance(res, dict) or not (drop or keep or max_string):
+            return res
+        saved = 0
+        result = {}
+        for (key, value) in res.items():
+            if key in drop or (keep and key not in keep):
+                # the key, its value and the separators around them
+                saved += len(codec.dumps(key)) + len(codec.dumps(value)) + 2
+            else:
+                result[key] = value
+        if max_string:
+            (result, n) = self._truncate(result, max_string)
+            saved += n
+        if saved:
+            with self.saved.get_lock():
+                self.saved.value += saved
+                self.trimmed.value += 1
+        return result
+
+    def report(self):
+        ''' log how much trimming saved so far '''
+        if self.trimmed.value:
+            logging.warn("ansible-report trimmed %d results, saving %d bytes" % (
+                self.trimmed.value, self.saved.value))
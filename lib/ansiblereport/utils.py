@@ -31,14 +31,30 @@ import ansiblereport.constants as C
 import ansible.constants as AC
 
 try:
-    from email.mime.text import MIMEText
+    from email.utils import formatdate
 except ImportError:
-    from email.MIMEText import MIMEText
+    from email.Utils import formatdate
+
+USER = None
 
 def get_user():
-    ''' return user information '''
+    ''' return user information
+
+    The answer cannot change for the life of the process, so it is
+    only looked up once.
+    '''
+    global USER
+    if USER is None:
+        USER = _get_user()
+    return USER
+
+def _get_user():
     try:
-        username = os.getlogin()
+        try:
+            username = os.getlogin()
+        except OSError:
+            # no controlling terminal, eg. when run from cron
+            username = pwd.getpwuid(os.getuid())[0]
         euid = pwd.getpwuid(os.geteuid())[0]
         return (username, euid)
     except Exception, e:
@@ -72,22 +88,121 @@ def run_command(args, cwd=None, data=None):
         rc = 257
     return (rc, out, err)
 
+GIT_DIRS = {}
+GIT_VERSIONS = {}
+
+def _read_first_line(path):
+    f = open(path)
+    try:
+        return f.readline().strip()
+    finally:
+        f.close()
+
+def _file_stamp(path):
+    # git replaces refs by renaming a lock file over them, so the inode
+    # changes even when the mtime does not
+    try:
+        st = os.stat(path)
+        return (st.st_mtime, st.st_ino)
+    except OSError:
+        return None
+
+def find_git_dir(path):
+    ''' return (git_dir, common_dir) of the repo containing path
+
+    A .git file (as used by worktrees and submodules) is followed to
+    the real git dir, and a 'commondir' file there to the directory
+    holding the repo's refs.  Results are cached per directory.
+    '''
+    path_dir = os.path.abspath(os.path.dirname(path))
+    if path_dir in GIT_DIRS:
+        return GIT_DIRS[path_dir]
+    found = (None, None)
+    cur = path_dir
+    while True:
+        dot_git = os.path.join(cur, '.git')
+        git_dir = None
+        if os.path.isdir(dot_git):
+            git_dir = dot_git
+        elif os.path.isfile(dot_git):
+            line = _read_first_line(dot_git)
+            if line.startswith('gitdir:'):
+                git_dir = os.path.join(cur, line[len('gitdir:'):].strip())
+        if git_dir is not None:
+            common_dir = git_dir
+            commondir_file = os.path.join(git_dir, 'commondir')
+            if os.path.isfile(commondir_file):
+                common_dir = os.path.join(git_dir,
+                                          _read_first_line(commondir_file))
+            found = (os.path.normpath(git_dir), os.path.normpath(common_dir))
+            break
+        parent = os.path.dirname(cur)
+        if parent == cur:
+            break
+        cur = parent
+    GIT_DIRS[path_dir] = found
+    return found
+
+def _git_ref_files(git_dir, common_dir):
+    ''' return files whose mtimes decide if a cached version is stale '''
+    files = [os.path.join(git_dir, 'HEAD'),
+             os.path.join(common_dir, 'packed-refs')]
+    head = _read_first_line(files[0])
+    if head.startswith('ref:'):
+        ref = head[len('ref:'):].strip()
+        files.append(os.path.join(git_dir, ref))
+        files.append(os.path.join(common_dir, ref))
+    return (head, files)
+
+def _resolve_ref(ref, git_dir, common_dir):
+    ''' return sha1 for ref, looking at loose then packed refs '''
+    for base in (git_dir, common_dir):
+        ref_path = os.path.join(base, ref)
+        if os.path.isfile(ref_path):
+            return _read_first_line(ref_path)
+    packed_refs = os.path.join(common_dir, 'packed-refs')
+    if os.path.isfile(packed_refs):
+        f = open(packed_refs)
+        try:
+            for line in f:
+                if line.startswith('#') or line.startswith('^'):
+                    continue
+                parts = line.split()
+                if len(parts) == 2 and parts[1] == ref:
+                    return parts[0]
+        finally:
+            f.close()
+    return None
+
 def git_version(path):
-    ''' get git HEAD version for a repo '''
+    ''' get git HEAD version for a repo
+
+    This reads the repo directly rather than running git.  It handles
+    loose and packed refs, a detached HEAD and worktrees.  Versions are
+    cached per repo until HEAD or the refs it points at are modified.
+    '''
     version = 'NA'
-    path_dir = os.path.dirname(path)
-    (rc, out, err) = run_command(['git', 'rev-parse', '--git-dir'], cwd=path_dir)
-    if rc != 0 or len(out) < 1:
-        return version
-    git_dir = out.rstrip('\n')
-    f = open(os.path.join(git_dir, 'HEAD'))
-    branch = f.readline().split('/')[-1].rstrip('\n')
-    f.close()
-    branch_path = os.path.join(git_dir, 'refs', 'heads', branch)
-    if os.path.exists(branch_path):
-        f = open(branch_path)
-        version = f.readline()[:10]
-        f.close()
+    try:
+        (git_dir, common_dir) = find_git_dir(path)
+        if git_dir is None:
+            return version
+        cached = GIT_VERSIONS.get(git_dir)
+        if cached is not None:
+            (files, mtimes, version) = cached
+            if [_file_stamp(f) for f in files] == mtimes:
+                return version
+            version = 'NA'
+        (head, files) = _git_ref_files(git_dir, common_dir)
+        mtimes = [_file_stamp(f) for f in files]
+        if head.startswith('ref:'):
+            sha = _resolve_ref(head[len('ref:'):].strip(), git_dir, common_dir)
+        else:
+            sha = head
+        if sha:
+            version = sha[:10]
+        GIT_VERSIONS[git_dir] = (files, mtimes, version)
+    except (OSError, IOError), e:
+        logging.error("failed to read git version: %s" % str(e))
     return version
 
 def pretty_json(arg, indent=4):
@@ -156,44 +271,50 @@ def format_task_report(tasks, embedded=True):
     report = ''
     report += format_heading('Tasks', subheading=embedded)
     for task in tasks:
-        args = []
-        report += "  {0}\n".format(format_task_brief(task, embedded))
-        if 'invocation' not in task.data:
-            report += '\n'
-            continue
-        invocation = task.data['invocation']
-        module_name = task.data['invocation']['module_name']
+        report += format_task(task, embedded)
+    return report
 
-        if task.changed:
-            report += "    {0:>10}: {1}\n".format('Changed', 'yes')
-
-        if not embedded:
-            if task.user:
-                args.append(('User', task.user.username))
-            if task.playbook:
-                args.append(('Playbook', task.playbook.path))
-
-        if module_name == 'git':
-            if 'after' in task.data:
-                args.append(('SHA1', task.data['after']))
-        elif module_name == 'copy' or module_name == 'file':
-            if 'path' in task.data:
-                args.append(('Path', task.data['path']))
-            elif 'dest' in task.data:
-                args.append(('Path', task.data['dest']))
-        if invocation['module_args']:
-            args.append(('Arguments', invocation['module_args']))
-        if 'msg' in task.data and task.data['msg']:
-            args.append(('Message', task.data['msg']))
-        elif 'result' in task.data and task.data['result']:
-            results = '\n'.join(task.data['result'])
-            args.append(('Result', results))
-        elif 'ansible_facts' in task.data:
-            args.append(('Facts',
-                         pretty_json(task.data['ansible_facts'], indent=8)))
-        for arg in args:
-            report += "    {0:>10}: {1}\n".format(arg[0], arg[1])
+def format_task(task, embedded=True):
+    ''' takes an AnsibleTask and returns string '''
+    report = ''
+    args = []
+    report += "  {0}\n".format(format_task_brief(task, embedded))
+    if 'invocation' not in task.data:
         report += '\n'
+        return report
+    invocation = task.data['invocation']
+    module_name = task.data['invocation']['module_name']
+
+    if task.changed:
+        report += "    {0:>10}: {1}\n".format('Changed', 'yes')
+
+    if not embedded:
+        if task.user:
+            args.append(('User', task.user.username))
+        if task.playbook:
+            args.append(('Playbook', task.playbook.path))
+
+    if module_name == 'git':
+        if 'after' in task.data:
+            args.append(('SHA1', task.data['after']))
+    elif module_name == 'copy' or module_name == 'file':
+        if 'path' in task.data:
+            args.append(('Path', task.data['path']))
+        elif 'dest' in task.data:
+            args.append(('Path', task.data['dest']))
+    if invocation['module_args']:
+        args.append(('Arguments', invocation['module_args']))
+    if 'msg' in task.data and task.data['msg']:
+        args.append(('Message', task.data['msg']))
+    elif 'result' in task.data and task.data['result']:
+        results = '\n'.join(task.data['result'])
+        args.append(('Result', results))
+    elif 'ansible_facts' in task.data:
+        args.append(('Facts',
+                     pretty_json(task.data['ansible_facts'], indent=8)))
+    for arg in args:
+        report += "    {0:>10}: {1}\n".format(arg[0], arg[1])
+    report += '\n'
     return report
 
 def is_reportable_task(task, verbose=False, embedded=True):
@@ -212,19 +333,103 @@ def is_reportable_task(task, verbose=False, embedded=True):
             return True
     return False
 
+def is_reportable_stats(stats, verbose=False):
+    ''' determine if per host counts of results include a reportable task
+
+    the counterpart of is_reportable_task() for get_playbook_stats(),
+    so that a playbook can be judged without loading its tasks
+    '''
+    for counts in stats.values():
+        for key in ('failed', 'error', 'unreachable', 'changed'):
+            if counts.get(key):
+                return True
+        if verbose and any(counts.values()):
+            return True
+    return False
+
 def email_report(report_data,
         smtp_subject=C.DEFAULT_SMTP_SUBJECT,
         smtp_recipient=C.DEFAULT_SMTP_RECIPIENT):
     ''' pull together all the necessary details and send email report '''
+    return email_report_stream([report_data],
+                               smtp_subject=smtp_subject,
+                               smtp_recipient=smtp_recipient)
+
+def smtp_quote(chunk, bol=True):
+    '''
+    Prepare a chunk of the message body for the SMTP DATA command.
+    Line endings become CRLF and lines starting with a period are
+    dot-stuffed.  bol says whether the chunk starts at the beginning
+    of a line; returns the quoted chunk and the state for the next one.
+    '''
+    if isinstance(chunk, unicode):
+        chunk = chunk.encode('utf-8')
+    lines = chunk.replace('\r\n', '\n').split('\n')
+    quoted = []
+    for i, line in enumerate(lines):
+        if line.startswith('.') and (i > 0 or bol):
+            line = '.' + line
+        quoted.append(line)
+    if lines[-1]:
+        bol = False
+    elif len(lines) > 1:
+        bol = True
+    return '\r\n'.join(quoted), bol
+
+def email_report_stream(chunks,
+        smtp_subject=C.DEFAULT_SMTP_SUBJECT,
+        smtp_recipient=C.DEFAULT_SMTP_RECIPIENT):
+    '''
+    Send an email report whose body is produced by an iterable of
+    strings.  Each chunk is written to the SMTP connection as it is
+    produced, so the whole body never has to be held in memory.
+    Nothing is sent if the iterable yields no data.
+    '''
     smtp_server = C.DEFAULT_SMTP_SERVER
     smtp_sender = C.DEFAULT_SMTP_SENDER
-    msg = MIMEText(report_data)
-    msg['Subject'] = smtp_subject
-    msg['From'] = smtp_sender
-    msg['To'] = smtp_recipient
+    chunks = iter(chunks)
+    first = ''
+    for first in chunks:
+        if first:
+            break
+    if not first:
+        return False
+    headers = [('Subject', smtp_subject),
+               ('From', smtp_sender),
+               ('To', smtp_recipient),
+               ('Date', formatdate(localtime=True)),
+               ('MIME-Version', '1.0'),
+               ('Content-Type', 'text/plain; charset="utf-8"'),
+               ('Content-Transfer-Encoding', '8bit')]
     try:
         s = smtplib.SMTP(smtp_server)
-        s.sendmail(smtp_sender, [smtp_recipient], msg.as_string())
+        s.ehlo_or_helo_if_needed()
+        (code, resp) = s.mail(smtp_sender)
+        if code != 250:
+            raise smtplib.SMTPSenderRefused(code, resp, smtp_sender)
+        (code, resp) = s.rcpt(smtp_recipient)
+        if code not in (250, 251):
+            raise smtplib.SMTPRecipientsRefused({smtp_recipient: (code, resp)})
+        s.putcmd('data')
+        (code, resp) = s.getreply()
+        if code != 354:
+            raise smtplib.SMTPDataError(code, resp)
+        for header in headers:
+            s.send('{0}: {1}\r\n'.format(*header))
+        s.send('\r\n')
+        bol = True
+        data, bol = smtp_quote(first, bol)
+        s.send(data)
+        for chunk in chunks:
+            if chunk:
+                data, bol = smtp_quote(chunk, bol)
+                s.send(data)
+        if not bol:
+            s.send('\r\n')
+        s.send('.\r\n')
+        (code, resp) = s.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, resp)
         s.quit()
     except Exception, e:
         print 'failed to send email report: {0}'.format(str(e))
@@ -0,0 +1,544 @@
+# Written by Stephen Fromm <sfromm@gmail.com>
+# (C) 2013 University of Oregon
+
+# This file is part of ansible-report
+#
+# ansible-report is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ansible-report is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ansible-report.  If not, see <http://www.gnu.org/licenses/>.
+
+import cPickle as pickle
+import datetime
+import fcntl
+import logging
+import multiprocessing
+import multiprocessing.util
+import os
+import Queue
+import tempfile
+import threading
+import time
+
+import ansiblereport.constants as C
+from ansiblereport.manager import *
+from ansiblereport.model import *
+from ansiblereport.spool import *
+from ansiblereport.utils import *
+
+def _writer_after_fork(writer):
+    writer._after_fork()
+
+class Writer(object):
+    '''
+    Write callback events to the database as they arrive.
+
+    With more than one fork, ansible calls the runner callbacks from
+    worker processes forked off the playbook process.  Writers notice
+    this through multiprocessing's after-fork hooks, drop anything they
+    inherited from the parent and close themselves when the worker
+    exits.  The task sequence counter lives in shared memory so numbers
+    stay unique across all workers.
+
+    'policy' decides how often what was written is committed; see
+    DEFAULT_COMMIT_POLICY.  Anything not yet committed is committed when
+    the writer is closed.
+    '''
+
+    COMMIT_POLICIES = ('event', 'count', 'play', 'run')
+
+    def __init__(self, mgr, policy=C.DEFAULT_COMMIT_POLICY,
+                 commit_interval=C.DEFAULT_COMMIT_INTERVAL):
+        self.mgr = mgr
+        self.playbook = None
+        self.user_id = None
+        if policy not in self.COMMIT_POLICIES:
+            logging.warn("unknown commit policy '%s'; using 'event'" % policy)
+            policy = 'event'
+        self.policy = policy
+        self.commit_interval = commit_interval
+        self.uncommitted = 0
+        self.seq = multiprocessing.Value('l', 0)
+        multiprocessing.util.register_after_fork(self, _writer_after_fork)
+
+    def _after_fork(self):
+        ''' set up a copy of the writer in a forked worker '''
+        if self.mgr is not None:
+            self.mgr.reset_pool()
+        # workers leave through os._exit(), so atexit does not run
+        multiprocessing.util.Finalize(None, self.close, exitpriority=10)
+
+    def _get_user_id(self):
+        ''' return id of the user running ansible, saving it if needed '''
+        if self.user_id is None:
+            (username, euid) = get_user()
+            if euid is None:
+                euid = username
+            user = self.mgr.get_or_create(AnsibleUser,
+                                          username=username, euid=euid)
+            self.user_id = user.id
+        return self.user_id
+
+    def _next_seq(self, task):
+        ''' number task in the order it was logged '''
+        if task.seq is None:
+            with self.seq.get_lock():
+                self.seq.value += 1
+                task.seq = self.seq.value
+
+    def _prepare_task(self, task):
+        ''' associate a task with the current user and playbook '''
+        self._next_seq(task)
+        task.user_id = self._get_user_id()
+        if self.playbook is not None:
+            task.playbook_id = self.playbook.id
+
+    def _save(self, save, obj, count=1):
+        ''' call save(obj) in the transaction the commit policy calls for '''
+        if self.policy != 'event':
+            self.mgr.begin()
+        try:
+            save(obj)
+        except:
+            if self.uncommitted:
+                logging.error("ansible-report lost %d uncommitted events" %
+                              self.uncommitted)
+                self.uncommitted = 0
+            raise
+        self.uncommitted += count
+        if self.policy == 'count' and self.uncommitted >= self.commit_interval:
+            self.commit()
+
+    def log_task(self, task):
+        ''' add task to database '''
+        self._prepare_task(task)
+        self._save(self.mgr.save, task)
+
+    def log_play(self, play):
+        ''' add play to database '''
+        if play.user_id is None:
+            play.user_id = self._get_user_id()
+        self._save(self.mgr.save, play)
+        self.playbook = play
+        if self.policy == 'play':
+            self.commit()
+
+    def summarize(self, play):
+        ''' summarize the results of play once it has finished '''
+        self.flush()
+        if play is not None and play.id is not None:
+            self._save(self.mgr.update_summary, [play.id], 0)
+
+    def flush(self):
+        ''' write out any pending events '''
+        pass
+
+    def commit(self):
+        ''' commit everything written so far '''
+        self.mgr.commit()
+        self.uncommitted = 0
+
+    def close(self):
+        ''' flush and commit pending events; called at the end of a run '''
+        self.flush()
+        if self.mgr is not None:
+            self.commit()
+
+class BufferedWriter(Writer):
+    '''
+    Collect task events in memory and insert them in batches.  The
+    buffer is written out when it holds 'size' tasks, when 'interval'
+    seconds have passed since the last write, and whenever a play is
+    logged.
+    '''
+
+    def __init__(self, mgr, size=C.DEFAULT_BUFFER_SIZE,
+                 interval=C.DEFAULT_BUFFER_INTERVAL, **kwargs):
+        Writer.__init__(self, mgr, **kwargs)
+        self.size = size
+        self.interval = interval
+        self.pending = []
+        self.last_flush = time.time()
+
+    def _after_fork(self):
+        # the parent is still responsible for what it had queued
+        self.pending = []
+        self.last_flush = time.time()
+        Writer._after_fork(self)
+
+    def log_task(self, task):
+        ''' queue task for the next batch insert '''
+        self._prepare_task(task)
+        self.pending.append(task)
+        if len(self.pending) >= self.size or \
+                time.time() - self.last_flush >= self.interval:
+            self.flush()
+
+    def log_play(self, play):
+        ''' flush queued tasks and add play to database '''
+        self.flush()
+        Writer.log_play(self, play)
+
+    def flush(self):
+        ''' insert all queued tasks in a single transaction '''
+        pending = self.pending
+        self.pending = []
+        self.last_flush = time.time()
+        if not pending:
+            return
+        try:
+            self._save(self.mgr.save_all, pending, len(pending))
+        except:
+            # keep the events around so a later flush can retry them
+            self.pending = pending + self.pending
+            raise
+
+class AsyncWriter(Writer):
+    '''
+    Hand events to a background thread that writes them to the database
+    with its own Manager, so a slow or locked database never blocks the
+    callback.  The queue between the two is bounded; 'overflow' decides
+    what happens when it fills up (see DEFAULT_QUEUE_OVERFLOW).
+
+    Plays are copied before they are queued since the callback keeps
+    updating its playbook object while the thread may be saving it.
+
+    Forked workers start a writer thread of their own, which never sees
+    the plays.  So logging a new play waits (up to PLAY_TIMEOUT seconds)
+    for the parent's thread to save it, and workers inherit the ids of
+    the plays saved so far in 'play_ids'; a play missing from it is
+    looked up by uuid.  The schema is created before any fork, so that
+    workers do not race to create it.
+    '''
+
+    PLAY_ATTRS = ('path', 'connection', 'checksum', 'starttime', 'endtime')
+    PLAY_TIMEOUT = 30
+
+    def __init__(self, uri, size=C.DEFAULT_QUEUE_SIZE,
+                 overflow=C.DEFAULT_QUEUE_OVERFLOW,
+                 spill_dir=C.DEFAULT_QUEUE_SPILL_DIR):
+        Writer.__init__(self, None)
+        self.uri = uri
+        # create the schema now, before ansible forks any workers
+        Manager(uri).engine.dispose()
+        self.overflow = overflow
+        self.spill_dir = spill_dir
+        self.queue = Queue.Queue(size)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.spill = None
+        self.spilled = 0
+        self.dropped = 0
+        self.lost = 0
+        self.play_ids = {}
+        self.play_saved = threading.Event()
+
+    def _after_fork(self):
+        # threads do not survive a fork and the queue's locks may have
+        # been held by the parent's writer thread
+        self.queue = Queue.Queue(self.queue.maxsize)
+        self.lock = threading.Lock()
+        self.play_saved = threading.Event()
+        self.thread = None
+        self.spill = None
+        self.spilled = 0
+        self.dropped = 0
+        self.lost = 0
+        Writer._after_fork(self)
+
+    def _start(self):
+        ''' start the writer thread if it is not running '''
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run,
+                                           name='ansiblereport-writer')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def _put(self, item):
+        ''' queue an event, applying the overflow policy if full '''
+        self._start()
+        try:
+            self.queue.put_nowait(item)
+            return
+        except Queue.Full:
+            pass
+        (kind, uuid, obj) = item
+        if kind == 'task' and self.overflow == 'drop':
+            if obj.result == 'OK' and not obj.changed:
+                self.dropped += 1
+                return
+        elif kind == 'task' and self.overflow == 'spill':
+            self._spill(item)
+            return
+        self.queue.put(item)
+
+    def _spill(self, item):
+        ''' append an event to the spill file '''
+        with self.lock:
+            if self.spill is None:
+                self.spill = tempfile.TemporaryFile(prefix='ansiblereport-',
+                                                    dir=self.spill_dir)
+            pickle.dump(item, self.spill, pickle.HIGHEST_PROTOCOL)
+            self.spilled += 1
+
+    def _replay_spill(self, writer, plays):
+        ''' take over the current spill file and write its events '''
+        with self.lock:
+            spill = self.spill
+            self.spill = None
+        if spill is None:
+            return
+        spill.seek(0)
+        try:
+            while True:
+                try:
+                    item = pickle.load(spill)
+                except EOFError:
+                    break
+                self._handle(writer, plays, item)
+        finally:
+            spill.close()
+
+    def _get_play_id(self, writer, uuid):
+        ''' return id of play uuid, which another process may have saved '''
+        if self.play_ids.get(uuid) is None:
+            row = writer.mgr.session.query(AnsiblePlaybook.id).filter(
+                AnsiblePlaybook.uuid == uuid).order_by(
+                AnsiblePlaybook.id.desc()).first()
+            if row is None:
+                return None
+            self.play_ids[uuid] = row.id
+        return self.play_ids[uuid]
+
+    def _handle(self, writer, plays, item):
+        ''' pass a queued event on to the thread's writer '''
+        (kind, uuid, obj) = item
+        if kind in ('summary', 'play'):
+            # tasks spilled while this was queued were logged before it
+            self._replay_spill(writer, plays)
+        if kind == 'summary':
+            writer.summarize(plays.get(uuid))
+        elif kind == 'play':
+            play = plays.get(uuid)
+            if play is None:
+                play = plays[uuid] = obj
+            else:
+                for attr in self.PLAY_ATTRS:
+                    value = getattr(obj, attr)
+                    if value is not None:
+                        setattr(play, attr, value)
+            writer.log_play(play)
+            self.play_ids[uuid] = play.id
+        else:
+            writer.playbook = plays.get(uuid)
+            if writer.playbook is None and uuid is not None:
+                obj.playbook_id = self._get_play_id(writer, uuid)
+            writer.log_task(obj)
+
+    def _drain(self, writer, plays, final=False):
+        ''' write out everything the thread is holding on to '''
+        self._replay_spill(writer, plays)
+        if final:
+            writer.mgr.run(lambda session: writer.close())
+        else:
+            writer.mgr.run(lambda session: writer.flush())
+
+    def _run(self):
+        ''' writer thread main loop '''
+        try:
+            writer = BufferedWriter(Manager(self.uri))
+        except Exception, e:
+            logging.error("ansible-report writer failed to connect: %s" % str(e))
+            writer = None
+        plays = {}
+        while True:
+            try:
+                item = self.queue.get(timeout=C.DEFAULT_BUFFER_INTERVAL)
+            except Queue.Empty:
+                item = False
+            if writer is None:
+                if item:
+                    self.lost += 1
+                    if item[0] == 'play':
+                        self.play_ids.setdefault(item[1], None)
+                        self.play_saved.set()
+                elif item is None:
+                    break
+                continue
+            try:
+                if item:
+                    self._handle(writer, plays, item)
+                if item is None:
+                    self._drain(writer, plays, final=True)
+                elif self.queue.empty():
+                    self._drain(writer, plays)
+            except Exception, e:
+                logging.error("ansible-report writer failed to save %d events: %s" % (
+                    len(writer.pending), str(e)))
+                self.lost += len(writer.pending)
+                writer.pending = []
+            if item and item[0] == 'play':
+                # saved or not, log_play() need not wait any longer
+                self.play_ids.setdefault(item[1], None)
+                self.play_saved.set()
+            if item is None:
+                break
+
+    def log_task(self, task):
+        ''' queue task for the writer thread '''
+        self._next_seq(task)
+        uuid = None
+        if self.playbook is not None:
+            uuid = self.playbook.uuid
+        self._put(('task', uuid, task))
+
+    def log_play(self, play):
+        ''' queue a copy of play for the writer thread '''
+        self.playbook = play
+        copy = AnsiblePlaybook(play.uuid)
+        for attr in self.PLAY_ATTRS:
+            setattr(copy, attr, getattr(play, attr))
+        self._put(('play', play.uuid, copy))
+        # workers forked from here on need to know its id
+        deadline = time.time() + self.PLAY_TIMEOUT
+        while play.uuid not in self.play_ids and time.time() < deadline:
+            self.play_saved.wait(deadline - time.time())
+            self.play_saved.clear()
+
+    def summarize(self, play):
+        ''' have the writer thread summarize play '''
+        self._put(('summary', play.uuid, None))
+
+    def close(self):
+        ''' wait for the writer thread to drain the queue and exit '''
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+        if self.dropped:
+            logging.warn("ansible-report dropped %d unchanged OK results "
+                         "while the writer queue was full" % self.dropped)
+        if self.lost:
+            logging.error("ansible-report failed to save %d events" % self.lost)
+
+class SpoolWriter(Writer):
+    '''
+    Append events to a local spool file instead of writing to the
+    database; 'ansible-report --ingest' loads spools later on.  The
+    spool is fsync'ed every 'fsync' records and whenever a play is
+    logged.
+
+    Ansible forks new workers for every task, so rather than each one
+    starting a spool of its own, workers append to the spool of the
+    playbook process.  Every record is written and flushed while holding
+    an exclusive lock on the file, so records from several processes
+    never interleave.
+    '''
+
+    def __init__(self, spool_dir=C.DEFAULT_SPOOL_DIR,
+                 fsync=C.DEFAULT_SPOOL_FSYNC):
+        Writer.__init__(self, None)
+        self.spool_dir = spool_dir
+        self.fsync = fsync
+        self.path = None
+        self.spool = None
+        self.unsynced = 0
+
+    def _after_fork(self):
+        # reopen the parent's spool, if it has one, rather than sharing
+        # its file object
+        self.spool = None
+        self.unsynced = 0
+        Writer._after_fork(self)
+
+    def _open(self):
+        ''' open the spool file, starting new ones with the current user '''
+        if self.path is not None:
+            self.spool = open(self.path, 'ab')
+            return
+        if not os.path.isdir(self.spool_dir):
+            os.makedirs(self.spool_dir)
+        (fd, self.path) = tempfile.mkstemp(prefix='ansible-report-',
+                                           suffix='.spool',
+                                           dir=self.spool_dir)
+        self.spool = os.fdopen(fd, 'ab')
+        (username, euid) = get_user()
+        if euid is None:
+            euid = username
+        self._append(dump_record(user_record(username, euid)))
+
+    def _append(self, data):
+        ''' append data to the spool while holding its lock '''
+        fcntl.flock(self.spool.fileno(), fcntl.LOCK_EX)
+        try:
+            self.spool.write(data)
+            self.spool.flush()
+        finally:
+            fcntl.flock(self.spool.fileno(), fcntl.LOCK_UN)
+
+    def _write(self, record):
+        if self.spool is None:
+            self._open()
+        self._append(dump_record(record))
+        self.unsynced += 1
+        if self.unsynced >= self.fsync:
+            self.flush()
+
+    def log_task(self, task):
+        ''' append task to the spool '''
+        self._next_seq(task)
+        uuid = None
+        if self.playbook is not None:
+            uuid = self.playbook.uuid
+        self._write(task_record(task, uuid))
+
+    def log_play(self, play):
+        ''' append play to the spool '''
+        self.playbook = play
+        self._write(play_record(play))
+        self.flush()
+
+    def summarize(self, play):
+        ''' plays are summarized when the spool is ingested '''
+        pass
+
+    def flush(self):
+        ''' make sure everything written so far is on disk '''
+        if self.spool is not None and self.unsynced:
+            os.fsync(self.spool.fileno())
+            self.unsynced = 0
+
+    def close(self):
+        ''' sync and close the spool '''
+        self.flush()
+        if self.spool is not None:
+            self.spool.close()
+            self.spool = None
+
+WRITERS = {
+    'direct': Writer,
+    'buffered': BufferedWriter,
+    'async': AsyncWriter,
+    'spool': SpoolWriter,
+}
+
+def get_writer(uri, mode=C.DEFAULT_CALLBACK_MODE):
+    ''' return a writer for the configured callback mode '''
+    if mode not in WRITERS:
+        logging.warn("unknown callback mode '%s'; using 'direct'" % mode)
+        mode = 'direct'
+    if mode == 'async':
+        # the writer thread creates its own Manager
+        return AsyncWriter(uri)
+    if mode == 'spool':
+        return SpoolWriter()
+    return WRITERS[mode](Manager(uri))
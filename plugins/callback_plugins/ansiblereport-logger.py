@@ -35,6 +35,7 @@ def replace_dist(requirement):
             return pkg_resources.require(requirement)
 replace_dist('SQLAlchemy >= 0.7')
 
+import atexit
 import datetime
 import os
 import uuid
@@ -43,6 +44,8 @@ import ansiblereport.constants as C
 from ansiblereport.manager import *
 from ansiblereport.model import *
 from ansiblereport.utils import *
+from ansiblereport.writer import *
+from ansiblereport.trim import *
 
 class CallbackModule(object):
     """
@@ -54,54 +57,48 @@ class CallbackModule(object):
         self.starttime = 0
         self.endtime = 0
         self.playbook = None
-        self.mgr = Manager(C.DEFAULT_DB_URI)
+        self.writer = get_writer(C.DEFAULT_DB_URI)
+        self.filter = PayloadFilter()
+        # make sure buffered events are written out on exit
+        atexit.register(self.writer.close)
 
-    def _log_user(self):
-        (username, euid) = get_user()
-        if euid is None:
-            euid = username
-        return self.mgr.get_or_create(AnsibleUser, username=username, euid=euid)
+    def _task(self, host, module, result, res):
+        ''' return AnsibleTask for a result, trimmed as configured '''
+        return AnsibleTask(host, module, result, self.filter.apply(module, res))
 
     def _log_task(self, task):
         ''' add result to database '''
-        user = self._log_user()
-        task.user = user
-        if self.playbook:
-            task.playbook = self.playbook
-        self.mgr.save(task)
+        self.writer.log_task(task)
 
     def _log_play(self, play):
         ''' add play to database '''
-        if play.user_id is None:
-            user = self._log_user()
-            play.user = user
-        self.mgr.save(play)
+        self.writer.log_play(play)
 
     def on_any(self, *args, **kwargs):
         pass
 
     def runner_on_failed(self, host, res, ignore_errors=False):
         module = res['invocation']['module_name']
-        self._log_task(AnsibleTask(host, module, 'FAILED', res))
+        self._log_task(self._task(host, module, 'FAILED', res))
 
     def runner_on_ok(self, host, res):
         module = res['invocation']['module_name']
-        self._log_task(AnsibleTask(host, module, 'OK', res))
+        self._log_task(self._task(host, module, 'OK', res))
 
     def runner_on_error(self, host, msg):
         res = {}
-        self._log_task(AnsibleTask(host, None, 'ERROR', res))
+        self._log_task(self._task(host, None, 'ERROR', res))
 
     def runner_on_skipped(self, host, item=None):
         res = {}
-        self._log_task(AnsibleTask(host, None, 'SKIPPED', res))
+        self._log_task(self._task(host, None, 'SKIPPED', res))
 
     def runner_on_unreachable(self, host, res):
         if not isinstance(res, dict):
             res2 = res
             res = {}
             res['msg'] = res2
-        self._log_task(AnsibleTask(host, None, 'UNREACHABLE', res))
+        self._log_task(self._task(host, None, 'UNREACHABLE', res))
 
     def runner_on_no_hosts(self):
         pass
@@ -113,12 +110,13 @@ class CallbackModule(object):
         pass
 
     def runner_on_async_failed(self, host, res, jid):
-        self._log_task(AnsibleTask(host, None, 'ASYNC_FAILED', res))
+        self._log_task(self._task(host, None, 'ASYNC_FAILED', res))
 
     def playbook_on_start(self):
         # start of playbook, no attrs are set yet
         self.starttime = datetime.datetime.now()
         self.playbook = AnsiblePlaybook(str(self.uuid))
+        self.playbook.starttime = self.starttime
 
     def playbook_on_notify(self, host, handler):
         ''' reports name of host and name of handler playbook will execute '''
@@ -159,3 +157,6 @@ class CallbackModule(object):
         self.endtime = datetime.datetime.now()
         self.playbook.endtime = self.endtime
         self._log_play(self.playbook)
+        self.writer.summarize(self.playbook)
+        self.writer.close()
+        self.filter.report()
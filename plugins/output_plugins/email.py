@@ -33,10 +33,19 @@ class OutputModule:
                 verbose         - Whether to be verbose in reporting
                 smtp_subject    - Subject for email report
                 smtp_recipient  - Recipient of email report
+    render      Yields the report a piece at a time.
+    deliver     Emails what render yielded; see screen for how the
+                two are used for caching.
     '''
     name = 'email'
+    # relations of each event that the report shows
+    task_relations = ['user', 'playbook', 'payload', 'data']
+    playbook_relations = ['user', 'summaries', 'tasks', 'tasks.payload',
+                          'tasks.data']
 
     def _update_stats(self, host, stats):
+        if host not in self.report_stats:
+            self.report_stats[host] = {}
         if 'total' not in self.report_stats:
             self.report_stats['total'] = {}
         for key in stats:
@@ -47,46 +56,60 @@ class OutputModule:
                 self.report_stats['total'][key] = 0
             self.report_stats['total'][key] += stats[key]
 
-    def do_report(self, events, **kwargs):
-        ''' take list of events and email them to recipient '''
+    def render(self, events, **kwargs):
+        '''
+        take an iterable of events and yield the report a piece at a
+        time, so that only one playbook's tasks are held at once
+        '''
         self.report_stats = {}
-        report = ''
-        report_tasks = []
+        task_heading = False
         if 'verbose' not in kwargs:
             kwargs['verbose'] = C.DEFAULT_VERBOSE
         if 'stats' not in kwargs:
             kwargs['stats'] = C.DEFAULT_STATS
         for event in events:
             tasks = []
-            if isinstance(event, AnsiblePlaybook):
-                for task in event.tasks:
+            if isinstance(event, AnsiblePlaybook) and kwargs['stats']:
+                # the summaries have the counts, so leave the tasks alone
+                stats = AnsiblePlaybook.get_playbook_stats(event)
+                if is_reportable_stats(stats, kwargs['verbose']):
+                    for host in stats:
+                        self._update_stats(host, stats[host])
+            elif isinstance(event, AnsiblePlaybook):
+                # unless verbose, only the reportable tasks are loaded
+                relation = AnsiblePlaybook.task_relation(kwargs['verbose'])
+                for task in getattr(event, relation):
                     if is_reportable_task(task, kwargs['verbose']):
                         tasks.append(task)
                 if tasks:
                     stats = AnsiblePlaybook.get_playbook_stats(event)
-                    if kwargs['stats']:
-                        for host in stats:
-                            if host not in self.report_stats:
-                                self.report_stats[host] = stats[host]
-                            else:
-                                self._update_stats(host, stats[host])
-                    else:
-                        report += format_playbook_report(event, tasks, stats)
+                    yield format_playbook_report(event, tasks, stats)
             elif isinstance(event, AnsibleTask):
                 if is_reportable_task(event, kwargs['verbose']):
                     if kwargs['stats']:
                         stats = AnsibleTask.get_task_stats(event)
                         self._update_stats(event.hostname, stats[event.hostname])
                     else:
-                        report_tasks.append(event)
-        if report_tasks:
-            report += format_task_report(report_tasks, embedded=False)
+                        if not task_heading:
+                            task_heading = True
+                            yield format_heading('Tasks', subheading=False)
+                        yield format_task(event, embedded=False)
+            elif isinstance(event, AnsibleRollup):
+                stats = AnsibleRollup.get_rollup_stats(event)
+                self._update_stats(event.hostname, stats[event.hostname])
         if self.report_stats:
             totals = { 'total': self.report_stats.pop('total') }
-            report += format_stats(self.report_stats, heading=False)
-            report += format_stats(totals)
+            yield format_stats(self.report_stats, heading=False)
+            yield format_stats(totals)
+
+    def deliver(self, chunks, **kwargs):
+        ''' email a rendered report to recipient '''
+        smtp_args = {}
         for arg in kwargs.keys():
-            if not arg.startswith('smtp_'):
-                del kwargs[arg]
-        if report:
-            email_report(report, **kwargs)
+            if arg.startswith('smtp_'):
+                smtp_args[arg] = kwargs[arg]
+        email_report_stream(chunks, **smtp_args)
+
+    def do_report(self, events, **kwargs):
+        ''' take list of events and email them to recipient '''
+        self.deliver(self.render(events, **kwargs), **kwargs)
@@ -22,7 +22,11 @@ import ansiblereport.constants as C
 from datetime import datetime, tzinfo
 from dateutil.tz import *
 import sys
+import os
 import os.path
+import shutil
+import subprocess
+import tempfile
 import ansible.utils
 
 class OutputModule:
@@ -46,6 +50,9 @@ class OutputModule:
     %r is the module name and module_args
     '''
     name = 'logstalgia'
+    # relations of each event that the report shows
+    task_relations = ['payload', 'data']
+    playbook_relations = ['tasks', 'tasks.payload', 'tasks.data']
     STRFTIME_FORMAT = '%s'
 
     def _get_module_category(self, module):
@@ -84,54 +91,94 @@ class OutputModule:
         match = "^/(%s)" % ("|".join(category_set[category]))
         return "-g '{0},{1},15' ".format(category, match)
 
+    def _reverse_lines(self, src, dst, blocksize=65536):
+        '''
+        copy the lines of file src to file dst in reverse order, reading
+        src backwards a block at a time
+        '''
+        src.seek(0, os.SEEK_END)
+        pos = src.tell()
+        tail = ''
+        while pos > 0:
+            size = min(blocksize, pos)
+            pos -= size
+            src.seek(pos)
+            lines = (src.read(size) + tail).split('\n')
+            tail = lines.pop(0)
+            for line in reversed(lines):
+                if line:
+                    dst.write(line + '\n')
+        if tail:
+            dst.write(tail + '\n')
+
+    def _add_log(self, task, logs, modules, hosts):
+        ''' write the log line for task and note its module and host '''
+        if task.module not in modules:
+            modules.append(task.module)
+        if task.hostname not in hosts:
+            hosts.append(task.hostname)
+        logs.write(self._mk_custom_log(task) + '\n')
+
     def do_report(self, events, **kwargs):
-        ''' take list of events and visualize via logstalgia '''
-        logs = []
+        '''
+        take events and visualize via logstalgia; the log lines are
+        spooled to a temporary file and fed to logstalgia from there
+        '''
+        verbose = kwargs.get('verbose', C.DEFAULT_VERBOSE)
+        logs = tempfile.TemporaryFile()
         modules = []
         hosts = []
         category = {}
         for event in events:
             if isinstance(event, AnsiblePlaybook):
-                for task in event.tasks:
-                    t = is_reportable_task(task, kwargs['verbose'])
-                    if t is not None:
-                        if task.module not in modules:
-                            modules.append(task.module)
-                        if task.hostname not in hosts:
-                            hosts.append(task.hostname)
-                        logs.append(self._mk_custom_log(task))
+                # unless verbose, only the reportable tasks are loaded
+                relation = AnsiblePlaybook.task_relation(verbose)
+                for task in getattr(event, relation):
+                    if is_reportable_task(task, verbose):
+                        self._add_log(task, logs, modules, hosts)
             elif isinstance(event, AnsibleTask):
-                t = reportable_task(event, kwargs['verbose'])
-                if t is not None:
-                    if task.module not in modules:
-                        modules.append(event.module)
-                    if task.hostname not in hosts:
-                        hosts.append(task.hostname)
-                    logs.append(self._mk_event_log(event))
-        if logs:
-            logs.reverse()
-            logs.append('\0')
-            opts = ''
-            if 'logstalgia_opts' in kwargs:
-                opts += '%s ' % kwargs['logstalgia_opts']
-            for m in modules:
-                c = self._get_module_category(m)
-                if m is None:
-                    m = 'NA'
-                if c in category:
-                    if m not in category[c]:
-                        category[c].append(m)
-                else:
-                    category[c] = [m]
-            for c in sorted(category.keys()):
-                # special case NA category
-                if c != 'NA':
-                    opts += self._format_group_match(category, c)
-            c = 'NA'
-            opts += self._format_group_match(category, c)
-            cmd = 'logstalgia %s -' % opts
-            rc, out, err = run_command(cmd, data='\n'.join(logs))
-            if rc != 0:
-                print >> sys.stderr, 'failed to run %s: %s %s' % (cmd, err, out)
-                print >> sys.stderr, 'outputting logs to stdout for processing elsewhere'
-                print '\n'.join(logs)
+                if is_reportable_task(event, verbose):
+                    self._add_log(event, logs, modules, hosts)
+        if logs.tell() == 0:
+            logs.close()
+            return
+        # events arrive newest first; logstalgia wants them oldest first
+        data = tempfile.TemporaryFile()
+        self._reverse_lines(logs, data)
+        logs.close()
+        data.write('\0')
+        data.seek(0)
+        opts = ''
+        if 'logstalgia_opts' in kwargs:
+            opts += '%s ' % kwargs['logstalgia_opts']
+        for m in modules:
+            c = self._get_module_category(m)
+            if m is None:
+                m = 'NA'
+            if c in category:
+                if m not in category[c]:
+                    category[c].append(m)
+            else:
+                category[c] = [m]
+        for c in sorted(category.keys()):
+            # special case NA category
+            if c != 'NA':
+                opts += self._format_group_match(category, c)
+        c = 'NA'
+        opts += self._format_group_match(category, c)
+        cmd = 'logstalgia %s -' % opts
+        out = tempfile.TemporaryFile()
+        try:
+            rc = subprocess.call(cmd, shell=True, stdin=data,
+                                 stdout=out, stderr=subprocess.STDOUT)
+        except (OSError, IOError), e:
+            rc = 257
+            out.write(str(e))
+        if rc != 0:
+            out.seek(0)
+            print >> sys.stderr, 'failed to run %s: %s' % (cmd, out.read())
+            print >> sys.stderr, 'outputting logs to stdout for processing elsewhere'
+            data.seek(0)
+            shutil.copyfileobj(data, sys.stdout)
+        out.close()
+        data.close()
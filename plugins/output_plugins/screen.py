@@ -19,6 +19,7 @@
 from ansiblereport.utils import *
 from ansiblereport.model import *
 import ansiblereport.constants as C
+import sys
 
 class OutputModule:
     '''
@@ -31,8 +32,17 @@ class OutputModule:
                 set of keyword arguments.
                 The only optional keyword argument that is supported
                 is 'verbose'.
+    render      Optional method that takes the same arguments as
+                do_report and yields the report a piece at a time.
+    deliver     Optional method that takes what render yielded and
+                the same keyword arguments, and reports it.  Plugins
+                with both can have their reports cached.
     '''
     name = 'screen'
+    # relations of each event that the report shows
+    task_relations = ['user', 'playbook', 'payload', 'data']
+    playbook_relations = ['user', 'summaries', 'tasks', 'tasks.payload',
+                          'tasks.data']
 
     def _update_stats(self, host, stats):
         if host not in self.report_stats:
@@ -47,40 +57,60 @@ class OutputModule:
                 self.report_stats['total'][key] = 0
             self.report_stats['total'][key] += stats[key]
 
-    def do_report(self, events, **kwargs):
-        ''' take list of events and report them to the screen '''
+    def render(self, events, **kwargs):
+        '''
+        take an iterable of events and yield the report a piece at a
+        time, so that only one playbook's tasks are held at once
+        '''
         self.report_stats = {}
-        report_tasks = []
+        task_heading = False
         if 'verbose' not in kwargs:
             kwargs['verbose'] = C.DEFAULT_VERBOSE
         if 'stats' not in kwargs:
             kwargs['stats'] = C.DEFAULT_STATS
         for event in events:
             tasks = []
-            if isinstance(event, AnsiblePlaybook):
-                for task in event.tasks:
+            if isinstance(event, AnsiblePlaybook) and kwargs['stats']:
+                # the summaries have the counts, so leave the tasks alone
+                stats = AnsiblePlaybook.get_playbook_stats(event)
+                if is_reportable_stats(stats, kwargs['verbose']):
+                    for host in stats:
+                        self._update_stats(host, stats[host])
+            elif isinstance(event, AnsiblePlaybook):
+                # unless verbose, only the reportable tasks are loaded
+                relation = AnsiblePlaybook.task_relation(kwargs['verbose'])
+                for task in getattr(event, relation):
                     if is_reportable_task(task, kwargs['verbose']):
                         tasks.append(task)
                 if tasks:
                     stats = AnsiblePlaybook.get_playbook_stats(event)
-                    if kwargs['stats']:
-                        for host in stats:
-                            if host not in self.report_stats:
-                                self.report_stats[host] = stats[host]
-                            else:
-                                self._update_stats(host, stats[host])
-                    else:
-                        print format_playbook_report(event, tasks, stats)
+                    yield format_playbook_report(event, tasks, stats) + '\n'
             elif isinstance(event, AnsibleTask):
                 if is_reportable_task(event, kwargs['verbose']):
                     if kwargs['stats']:
                         stats = AnsibleTask.get_task_stats(event)
                         self._update_stats(event.hostname, stats[event.hostname])
                     else:
-                        report_tasks.append(event)
-        if report_tasks:
-            print format_task_report(report_tasks, embedded=False)
+                        if not task_heading:
+                            task_heading = True
+                            yield format_heading('Tasks', subheading=False)
+                        yield format_task(event, embedded=False)
+            elif isinstance(event, AnsibleRollup):
+                stats = AnsibleRollup.get_rollup_stats(event)
+                self._update_stats(event.hostname, stats[event.hostname])
+        if task_heading:
+            yield '\n'
         if self.report_stats:
             totals = { 'total': self.report_stats.pop('total') }
-            print format_stats(self.report_stats, heading=False)
-            print format_stats(totals)
+            yield format_stats(self.report_stats, heading=False) + '\n'
+            yield format_stats(totals) + '\n'
+
+    def deliver(self, chunks, **kwargs):
+        ''' write a rendered report to the screen '''
+        for chunk in chunks:
+            sys.stdout.write(chunk)
+        sys.stdout.flush()
+
+    def do_report(self, events, **kwargs):
+        ''' take list of events and report them to the screen '''
+        self.deliver(self.render(events, **kwargs), **kwargs)
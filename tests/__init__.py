@@ -20,23 +20,38 @@ def replace_dist(requirement):
 replace_dist('SQLAlchemy >= 0.7')
 
 import unittest
+import datetime
 import getpass
 import os
+import shutil
+import tempfile
 import multiprocessing
+import json
+import operator
+import re
+import sqlalchemy
 
 MAX_WORKERS = 75
 ALEMBIC_INI = os.path.join(os.path.dirname(__file__), 'alembic.test.ini')
 ANSIBLE_CFG = os.path.join(os.path.dirname(__file__), 'ansible.cfg')
 os.environ['ANSIBLE_CONFIG'] = ANSIBLE_CFG
+os.environ['ANSIBLEREPORT_SCHEMA_CACHE'] = os.path.join(
+    tempfile.mkdtemp(), 'schema.cache')
 TEST_PLAYBOOK = 'tests/test_ansible_notify.yml'
 TEST_TRANSPORT = 'local'
 VERBOSITY = 0
 
 import ansiblereport
 import ansiblereport.constants as C
+from ansiblereport import codec
 from ansiblereport.manager import *
 from ansiblereport.model import *
 from ansiblereport.utils import *
+from ansiblereport.writer import *
+from ansiblereport.spool import *
+from ansiblereport.trim import *
+from ansiblereport.output_plugins import *
+from ansiblereport.cache import *
 
 import ansible.runner as ans_runner
 import ansible.playbook as ans_playbook
@@ -48,6 +63,1036 @@ class TestModel(unittest.TestCase):
         mgr = Manager(C.DEFAULT_DB_URI, debug=True)
         self.assertEqual(mgr.session.connection().engine.name, 'sqlite')
 
+class TestManager(unittest.TestCase):
+
+    def setUp(self):
+        (fd, self.path) = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        os.unlink(self.path)
+        self.uri = 'sqlite:///%s' % self.path
+
+    def tearDown(self):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.path + suffix):
+                os.unlink(self.path + suffix)
+
+    def test_schema_fast_path(self):
+        ''' test that a known database is checked with one statement '''
+        mgr = Manager(self.uri)
+        self.assertEqual(mgr._get_revision(), ansiblereport.__dbrevision__)
+        statements = []
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+        sqlalchemy.event.listen(sqlalchemy.engine.Engine,
+                                'before_cursor_execute', count)
+        try:
+            Manager(self.uri)
+        finally:
+            sqlalchemy.event.remove(sqlalchemy.engine.Engine,
+                                    'before_cursor_execute', count)
+        self.assertEqual(len(statements), 1)
+
+    def test_engine_profile(self):
+        ''' test that the sqlite profile tunes new connections '''
+        mgr = Manager(self.uri, profile='sqlite')
+        conn = mgr.engine.connect()
+        try:
+            self.assertEqual(conn.execute('PRAGMA journal_mode').scalar(), 'wal')
+            self.assertEqual(conn.execute('PRAGMA busy_timeout').scalar(), 30000)
+        finally:
+            conn.close()
+        (kwargs, pragmas) = engine_options('postgresql://localhost/ansible',
+                                           profile='server',
+                                           overrides={'pool.size': '20'})
+        self.assertEqual(kwargs['pool_size'], 20)
+        self.assertEqual(kwargs.get('pool_pre_ping', False), HAS_PRE_PING)
+        self.assertEqual(pragmas, [])
+
+class TestCodec(unittest.TestCase):
+
+    DATA = {'changed': True, 'stdout': 'x' * 1000, 'rc': 0}
+
+    def test_codec_roundtrip(self):
+        ''' test that every codec decodes what it encodes '''
+        for name in codec.CODECS:
+            data = codec.encode(self.DATA, name)
+            self.assertTrue(data.startswith(codec.HEADER))
+            self.assertEqual(codec.decode(data), self.DATA)
+        self.assertTrue(len(codec.encode(self.DATA, 'zlib')) <
+                        len(codec.encode(self.DATA, 'json')))
+        small = codec.encode({'ping': 'pong'}, 'zlib')
+        self.assertEqual(small[1], codec.CODECS['json'].tag)
+        self.assertRaises(ValueError, codec.decode, codec.HEADER + '?{}')
+
+    def test_recompress(self):
+        ''' test that plain JSON rows are read and recompressed '''
+        mgr = Manager('sqlite://')
+        table = AnsibleTask.__table__
+        mgr.engine.execute(table.insert().values(
+            hostname='localhost', data=sqlalchemy.literal_column(
+                "'%s'" % json.dumps(self.DATA))))
+        task = mgr.session.query(AnsibleTask).one()
+        self.assertEqual(task.data, self.DATA)
+        (count, before, after) = mgr.recompress('zlib', batch=1)
+        self.assertEqual(count, 1)
+        self.assertTrue(after < before)
+        self.assertEqual(mgr.recompress('zlib'), (0, 0, 0))
+        mgr.session.expire_all()
+        task = mgr.session.query(AnsibleTask).one()
+        self.assertEqual(task.data, self.DATA)
+
+    def test_json_library(self):
+        ''' test that only byte compatible JSON libraries encode '''
+        class Slashes(codec.JSONLibrary):
+            def dumps(self, value):
+                return codec.JSONLibrary.dumps(self, value).replace('/', '\\/')
+        self.assertEqual(codec._probe(codec.JSONLibrary()), (True, True))
+        self.assertEqual(codec._probe(Slashes()), (False, True))
+        (encoder, decoder) = codec.get_json('auto')
+        self.assertEqual(encoder.dumps(codec.PROBE), codec.JSONLibrary().dumps(codec.PROBE))
+        data = codec.serialize(self.DATA)
+        self.assertEqual(data.json, codec.dumps(self.DATA))
+        self.assertEqual(codec.encode(data, 'zlib'), codec.encode(self.DATA, 'zlib'))
+        self.assertEqual(payload_hash(data), payload_hash(self.DATA))
+        self.assertEqual(codec.resolve(data), self.DATA)
+
+    def test_deferred_data(self):
+        ''' test that task data is only loaded and decoded when asked for '''
+        mgr = Manager('sqlite://')
+        mgr.save(AnsibleTask('localhost', 'ping', 'OK', self.DATA))
+        mgr.session.expire_all()
+        sql = str(AnsibleTask.find_tasks(mgr.session, args={'module': 'ping'}))
+        self.assertFalse('task.data' in sql)
+        query = AnsibleTask.find_tasks(mgr.session, args={'module': 'ping'},
+                                       relations=['data'])
+        self.assertTrue('task.data' in str(query))
+        task = query.one()
+        lazy = task._data
+        self.assertTrue(isinstance(lazy, codec.Lazy))
+        self.assertFalse(lazy._decoded)
+        self.assertEqual(task.data, self.DATA)
+        self.assertTrue(task.data is task.data)
+        self.assertEqual(codec.encode(lazy), lazy.data)
+
+class TestPayload(unittest.TestCase):
+
+    def setUp(self):
+        self.dedup = C.DEFAULT_PAYLOAD_DEDUP
+        C.DEFAULT_PAYLOAD_DEDUP = True
+        self.mgr = Manager('sqlite://')
+
+    def tearDown(self):
+        C.DEFAULT_PAYLOAD_DEDUP = self.dedup
+
+    def _refcounts(self):
+        return sorted([payload.refcount for payload in
+                       self.mgr.session.query(AnsiblePayload)])
+
+    def test_payload_dedup(self):
+        ''' test that identical results are stored and decoded once '''
+        writer = BufferedWriter(self.mgr, size=100, interval=3600)
+        for n in range(3):
+            writer.log_task(AnsibleTask('localhost', 'ping', 'OK', {'ping': 'pong'}))
+        writer.close()
+        self.mgr.save(AnsibleTask('localhost', 'ping', 'OK', {'ping': 'pong'}))
+        self.mgr.save(AnsibleTask('localhost', 'command', 'OK', {'rc': 0}))
+        self.assertEqual(self._refcounts(), [1, 4])
+        self.mgr.session.expunge_all()
+        decode = codec.decode
+        decoded = []
+        def counting_decode(data):
+            if data is not None:
+                decoded.append(data)
+            return decode(data)
+        codec.decode = counting_decode
+        try:
+            tasks = self.mgr.session.query(AnsibleTask).all()
+            for task in tasks:
+                self.assertEqual(task._data, None)
+                self.assertNotEqual(task.data, None)
+                self.assertEqual(task.data, task.data)
+        finally:
+            codec.decode = decode
+        self.assertEqual(len(decoded), 2)
+
+    def test_payload_autoflush(self):
+        ''' test that a task flushed before save() still stores its payload '''
+        user = AnsibleUser('nobody', 'nobody')
+        self.mgr.save(user)
+        task = AnsibleTask('localhost', 'ping', 'OK', {'ping': 'pong'})
+        task.user = user
+        self.mgr.session.query(AnsibleUser).all()
+        self.assertNotEqual(task.id, None)
+        self.mgr.save(task)
+        self.assertEqual(self._refcounts(), [1])
+        self.mgr.session.expunge_all()
+        task = self.mgr.session.query(AnsibleTask).one()
+        self.assertEqual(task.data, {'ping': 'pong'})
+
+    def test_payload_release(self):
+        ''' test that pruning tasks drops unreferenced payloads '''
+        for n in range(2):
+            self.mgr.save(AnsibleTask('localhost', 'ping', 'OK', {'ping': 'pong'}))
+        self.mgr.save(AnsibleTask('localhost', 'command', 'OK', {'rc': 0}))
+        tasks = self.mgr.session.query(AnsibleTask).filter_by(module='command')
+        with self.mgr.session.begin():
+            self.assertEqual(self.mgr.release_payloads(tasks), 1)
+            tasks.delete()
+        self.assertEqual(self._refcounts(), [2])
+        tasks = self.mgr.session.query(AnsibleTask).limit(1)
+        self.assertEqual(self.mgr.release_payloads(tasks.from_self()), 0)
+        self.assertEqual(self._refcounts(), [1])
+
+class TestTrim(unittest.TestCase):
+
+    RES = {'changed': False, 'msg': 'ok', 'stdout': 'x' * 1000,
+           'ansible_facts': {'ansible_hostname': 'localhost'},
+           'invocation': {'module_name': 'setup', 'module_args': ''}}
+
+    def setUp(self):
+        self.settings = (C.DEFAULT_PAYLOAD_DROP, C.DEFAULT_PAYLOAD_KEEP,
+                         C.DEFAULT_PAYLOAD_MAX_STRING)
+
+    def tearDown(self):
+        (C.DEFAULT_PAYLOAD_DROP, C.DEFAULT_PAYLOAD_KEEP,
+         C.DEFAULT_PAYLOAD_MAX_STRING) = self.settings
+
+    def test_trim_rules(self):
+        ''' test dropping, keeping and truncating result keys '''
+        self.assertEqual(PayloadFilter().apply('setup', self.RES), self.RES)
+        C.DEFAULT_PAYLOAD_DROP = ['ansible_facts']
+        C.DEFAULT_PAYLOAD_MAX_STRING = 100
+        trim = PayloadFilter()
+        res = trim.apply('setup', self.RES)
+        self.assertTrue('ansible_facts' not in res)
+        self.assertTrue(res['stdout'].startswith('x' * 100 + '...'))
+        self.assertEqual(res['msg'], 'ok')
+        self.assertEqual(len(self.RES['stdout']), 1000)
+        C.DEFAULT_PAYLOAD_DROP = []
+        C.DEFAULT_PAYLOAD_MAX_STRING = 0
+        C.DEFAULT_PAYLOAD_KEEP = ['report']
+        res = PayloadFilter().apply('setup', self.RES)
+        self.assertEqual(sorted(res), ['changed', 'invocation', 'msg'])
+        self.assertEqual(trim.trimmed.value, 1)
+        self.assertTrue(trim.saved.value > 900)
+
+class TestSummary(unittest.TestCase):
+
+    def setUp(self):
+        self.mgr = Manager('sqlite://')
+
+    def _log_run(self, writer, results):
+        play = AnsiblePlaybook('summary')
+        writer.log_play(play)
+        for (host, result, changed) in results:
+            writer.log_task(AnsibleTask(host, 'ping', result, {'changed': changed}))
+        writer.log_play(play)
+        writer.summarize(play)
+        writer.close()
+        return play
+
+    def test_summary(self):
+        ''' test that finished playbooks are summarized per host '''
+        results = [('a', 'OK', True), ('a', 'OK', False), ('a', 'FAILED', False),
+                   ('b', 'SKIPPED', False), ('b', 'UNREACHABLE', False)]
+        writer = BufferedWriter(self.mgr, size=100, interval=3600)
+        play = self._log_run(writer, results)
+        zero = dict((key, 0) for key in AnsibleSummary.COUNTERS)
+        expected = {'a': dict(zero, ok=2, changed=1, failed=1),
+                    'b': dict(zero, skipped=1, unreachable=1)}
+        self.mgr.session.expire_all()
+        self.assertEqual(len(play.summaries), 2)
+        self.assertEqual(AnsiblePlaybook.get_playbook_stats(play), expected)
+        with self.mgr.session.begin():
+            self.mgr.session.query(AnsibleSummary).delete()
+        self.mgr.session.expire_all()
+        self.assertEqual(AnsiblePlaybook.get_playbook_stats(play), expected)
+        self.assertEqual(self.mgr.rebuild_summary(), 1)
+        self.mgr.session.expire_all()
+        self.assertEqual(len(play.summaries), 2)
+        self.assertEqual(AnsiblePlaybook.get_playbook_stats(play), expected)
+
+class TestRollup(unittest.TestCase):
+
+    def setUp(self):
+        self.mgr = Manager('sqlite://')
+        self.now = datetime.datetime(2013, 6, 15, 12, 30)
+
+    def _add_tasks(self, hours):
+        tasks = []
+        for n in range(hours):
+            for (host, result, changed) in (('a', 'OK', True), ('a', 'OK', False),
+                                            ('b', 'FAILED', False)):
+                task = AnsibleTask(host, 'ping', result, {'changed': changed})
+                task.timestamp = self.now - datetime.timedelta(hours=n, minutes=n)
+                tasks.append(task)
+        self.mgr.save_all(tasks)
+        return tasks
+
+    def _expected(self, tasks, age, verbose):
+        counts = {}
+        for task in tasks:
+            if age is not None and task.timestamp <= age:
+                continue
+            if not is_reportable_task(task, verbose):
+                continue
+            key = (task.hostname, task.result, bool(task.changed))
+            counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    def _stats(self, age, verbose):
+        rows = AnsibleRollup.find_stats(self.mgr.session, age=age, verbose=verbose)
+        return dict(((row.hostname, row.result, row.changed), row.count)
+                    for row in rows)
+
+    def test_rollup_stats(self):
+        ''' test that rollup stats match counting the tasks themselves '''
+        tasks = self._add_tasks(60)
+        ages = [None, self.now - datetime.timedelta(hours=40, minutes=17),
+                self.now - datetime.timedelta(minutes=10)]
+        for age in ages:
+            self.assertEqual(self._stats(age, True), self._expected(tasks, age, True))
+        self.assertEqual(self.mgr.update_rollups(batch=50), len(tasks))
+        self.assertEqual(self.mgr.update_rollups(), 0)
+        tasks += self._add_tasks(3)
+        for age in ages:
+            for verbose in (True, False):
+                self.assertEqual(self._stats(age, verbose),
+                                 self._expected(tasks, age, verbose))
+        stats = AnsibleRollup.get_rollup_stats(AnsibleRollup('a', 'OK', True, 3))
+        self.assertEqual(stats['a']['ok'], 3)
+        self.assertEqual(stats['a']['changed'], 3)
+
+    def test_rollup_stats_args(self):
+        ''' test that rollup stats only count tasks matching the criteria '''
+        self._add_tasks(5)
+        for n in range(2):
+            rows = AnsibleRollup.find_stats(self.mgr.session,
+                                            args={'hostname': ['b']})
+            self.assertEqual([(row.hostname, row.count) for row in rows], [('b', 5)])
+            self.mgr.update_rollups()
+
+class TestQueryPlan(unittest.TestCase):
+    '''
+    Check that the queries behind the CLI use an index on SQLite rather
+    than scanning a whole table.
+    '''
+
+    def setUp(self):
+        self.mgr = Manager('sqlite://')
+        self.age = datetime.datetime.now()
+
+    def _plan(self, query):
+        sql = query.statement.compile(dialect=self.mgr.engine.dialect)
+        params = [sql.params[key] for key in sql.positiontup]
+        return [row[-1] for row in self.mgr.engine.execute(
+            'EXPLAIN QUERY PLAN ' + str(sql), params)]
+
+    def _shapes(self):
+        session = self.mgr.session
+        yield ('task_hostname_timestamp_idx', AnsibleTask.find_tasks(
+            session, args={'hostname': ['a', 'b']}, limit=10))
+        yield ('task_hostname_timestamp_idx', AnsibleTask.find_tasks(
+            session, args={'hostname': ['a'], 'timestamp': self.age}, limit=10))
+        yield ('task_result_timestamp_idx', AnsibleTask.find_tasks(
+            session, args={'result': ['FAILED']}, limit=10))
+        yield ('task_module_timestamp_idx', AnsibleTask.find_tasks(
+            session, args={'module': ['copy']}, limit=0))
+        yield ('task_timestamp_idx', AnsibleTask.find_tasks(
+            session, args={'timestamp': self.age}, limit=10))
+        yield ('task_timestamp_idx', AnsibleTask.find_tasks(
+            session, args={'timestamp': self.age}, timeop=operator.le,
+            orderby=False))
+        yield ('task_timestamp_idx', keyset_query(
+            session.query(AnsibleTask), AnsibleTask, 'timestamp',
+            (self.age, 10)).limit(11))
+        yield ('playbook_starttime_idx', keyset_query(
+            session.query(AnsiblePlaybook), AnsiblePlaybook, 'starttime',
+            (self.age, 10)).limit(11))
+        yield ('task_playbook_seq_idx', session.query(AnsibleTask).filter(
+            AnsibleTask.playbook_id == 1))
+        yield ('task_user_idx', session.query(AnsibleTask).filter(
+            AnsibleTask.user_id == 1))
+        yield ('playbook_path_idx', AnsiblePlaybook.get_last_n_playbooks(
+            session, args={'path': ['/etc/ansible/site.yml']}))
+        yield ('playbook_starttime_idx', AnsiblePlaybook.get_last_n_playbooks(
+            session, args={'starttime': self.age}))
+        yield ('playbook_path_idx', AnsiblePlaybook.get_last_n_playbooks(
+            session, args={'path': ['/etc/ansible/site.yml']}, reportable=True))
+        yield ('summary_playbook_idx', session.query(AnsibleSummary).filter(
+            AnsibleSummary.playbook_id == 1))
+
+    def test_query_plans(self):
+        ''' test that report and prune queries search an index '''
+        for (index, query) in self._shapes():
+            plan = self._plan(query)
+            for line in plan:
+                self.assertFalse(line.startswith('SCAN'),
+                                 '%s: %s' % (index, '; '.join(plan)))
+            self.assertTrue(re.search(r'USING (COVERING )?INDEX %s\b' % index, plan[0]),
+                            '%s: %s' % (index, '; '.join(plan)))
+
+class TestFilter(unittest.TestCase):
+
+    def setUp(self):
+        self.mgr = Manager('sqlite://')
+        self.now = datetime.datetime.now()
+        tasks = []
+        for (host, result) in (('a', 'OK'), ('a', 'FAILED'), ('b', 'OK'),
+                               ('c', 'SKIPPED')):
+            task = AnsibleTask(host, 'ping', result, {'changed': False})
+            task.timestamp = self.now
+            tasks.append(task)
+        self.mgr.save_all(tasks)
+
+    def _sql(self, args, **kwargs):
+        return str(filter_clause(AnsibleTask, args, **kwargs).compile(
+            dialect=self.mgr.engine.dialect))
+
+    def _hosts(self, args, **kwargs):
+        return sorted((task.hostname, task.result) for task in AnsibleTask.find_tasks(
+            self.mgr.session, args=args, limit=0, **kwargs))
+
+    def test_filter_sql(self):
+        ''' test that equivalent criteria give identical SQL '''
+        self.assertEqual(self._sql({'hostname': ['b', 'a', 'b'], 'result': 'OK'}),
+                         self._sql({'result': 'OK', 'hostname': ['a', 'b']}))
+        self.assertTrue(' IN (' in self._sql({'hostname': ['a', 'b']}))
+        self.assertFalse(' IN (' in self._sql({'hostname': ['a']}))
+        self.assertEqual(filter_clause(AnsibleTask, {'nonesuch': 1}), None)
+
+    def test_filter_intersection(self):
+        ''' test that criteria are ORed or, with intersection, ANDed '''
+        args = {'hostname': ['a'], 'result': ['OK', 'SKIPPED']}
+        self.assertEqual(self._hosts(args, intersection=False),
+                         [('a', 'FAILED'), ('a', 'OK'), ('b', 'OK'), ('c', 'SKIPPED')])
+        self.assertEqual(self._hosts(args, intersection=True), [('a', 'OK')])
+        # time criteria always narrow the result
+        args['timestamp'] = self.now
+        self.assertEqual(self._hosts(args, intersection=False), [])
+        hour = datetime.timedelta(hours=1)
+        args['timestamp'] = (self.now - hour, self.now + hour)
+        self.assertEqual(self._hosts(args, intersection=True), [('a', 'OK')])
+
+class TestPaging(unittest.TestCase):
+
+    def setUp(self):
+        self.mgr = Manager('sqlite://')
+        writer = Writer(self.mgr)
+        now = datetime.datetime.now()
+        for n in range(7):
+            task = AnsibleTask('host%d' % n, 'ping', 'ok', {'changed': False})
+            # pairs of tasks share a timestamp
+            task.timestamp = now - datetime.timedelta(seconds=n / 2)
+            writer.log_task(task)
+        writer.close()
+
+    def test_page_tasks(self):
+        ''' test that walking the pages returns each task once, in order '''
+        seen = []
+        after = None
+        while True:
+            (tasks, after) = AnsibleTask.page_tasks(self.mgr.session,
+                                                    page_size=3, after=after)
+            seen.extend(tasks)
+            if after is None:
+                break
+            self.assertEqual(decode_cursor(after),
+                             (tasks[-1].timestamp, tasks[-1].id))
+        expected = self.mgr.session.query(AnsibleTask).order_by(
+            AnsibleTask.timestamp.desc(), AnsibleTask.id.desc()).all()
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(seen, expected)
+        self.assertRaises(ValueError, decode_cursor, 'not a cursor')
+
+class TestReportLoading(unittest.TestCase):
+
+    def setUp(self):
+        self.mgr = Manager('sqlite://')
+        outputs = OutputPlugins([os.path.join(
+            os.path.dirname(__file__), '..', 'plugins', 'output_plugins')])
+        self.screen = outputs.plugins['screen']
+        self.statements = 0
+
+    def _count(self, *args):
+        self.statements += 1
+
+    def _add_playbooks(self, count):
+        writer = Writer(self.mgr)
+        for n in range(count):
+            play = AnsiblePlaybook('loading-%d' % n)
+            play.path = '/tmp/site.yml'
+            writer.log_play(play)
+            for host in ('a', 'b'):
+                writer.log_task(AnsibleTask(host, 'ping', 'FAILED', {
+                    'changed': True, 'msg': 'failed',
+                    'invocation': {'module_name': 'ping', 'module_args': ''}}))
+                writer.log_task(AnsibleTask(host, 'ping', 'OK', {
+                    'changed': False, 'ping': 'pong',
+                    'invocation': {'module_name': 'ping', 'module_args': ''}}))
+            writer.summarize(play)
+        return play
+
+    def _report(self, events):
+        self.mgr.session.expire_all()
+        self.statements = 0
+        stdout = sys.stdout
+        sqlalchemy.event.listen(self.mgr.engine, 'before_cursor_execute', self._count)
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            self.screen.do_report(events(), verbose=False, stats=False)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+            sqlalchemy.event.remove(self.mgr.engine, 'before_cursor_execute', self._count)
+        return self.statements
+
+    def test_report_statements(self):
+        ''' test that reports run the same number of queries for any size '''
+        relations = AnsiblePlaybook.report_relations(self.screen.playbook_relations)
+        playbooks = lambda: AnsiblePlaybook.get_last_n_playbooks(
+            self.mgr.session, args={'path': ['/tmp/site.yml']}, limit=0,
+            relations=relations, reportable=True)
+        tasks = lambda: AnsibleTask.find_tasks(
+            self.mgr.session, args={'hostname': ['a', 'b']}, limit=0,
+            relations=self.screen.task_relations, reportable=True)
+        counts = []
+        for n in (2, 10):
+            self._add_playbooks(n)
+            counts.append((self._report(playbooks), self._report(tasks)))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_report_stream(self):
+        ''' test that fetching in batches does not change the report '''
+        self._add_playbooks(10)
+        reports = []
+        relations = AnsiblePlaybook.report_relations(self.screen.playbook_relations)
+        for batch in (None, 3):
+            self.mgr.session.expire_all()
+            events = AnsiblePlaybook.get_last_n_playbooks(
+                self.mgr.session, args={'path': ['/tmp/site.yml']}, limit=0,
+                relations=relations, batch=batch)
+            reports.append(''.join(self.screen.render(events, verbose=False,
+                                                      stats=False)))
+        self.assertTrue(reports[0])
+        self.assertEqual(reports[0], reports[1])
+
+    def test_reportable_tasks(self):
+        ''' test that reports only fetch the tasks they show '''
+        play = self._add_playbooks(1)
+        self.assertEqual(sorted(task.result for task in play.reportable_tasks),
+                         ['FAILED', 'FAILED'])
+        self.assertEqual(len(play.tasks), 4)
+        quiet = AnsiblePlaybook('quiet')
+        quiet.path = '/tmp/site.yml'
+        writer = Writer(self.mgr)
+        writer.log_play(quiet)
+        writer.log_task(AnsibleTask('a', 'ping', 'OK', {'changed': False}))
+        writer.close()
+        for (verbose, expected) in ((False, [play.id]), (True, [play.id, quiet.id])):
+            playbooks = AnsiblePlaybook.get_last_n_playbooks(
+                self.mgr.session, args={'path': ['/tmp/site.yml']}, limit=0,
+                reportable=not verbose)
+            self.assertEqual(sorted(p.id for p in playbooks), expected)
+        tasks = AnsibleTask.find_tasks(self.mgr.session, args={'hostname': ['a']},
+                                       limit=0, reportable=True)
+        self.assertEqual([task.result for task in tasks], ['FAILED'])
+        self.assertEqual(AnsiblePlaybook.report_relations(
+            ['user', 'tasks', 'tasks.payload'], verbose=False),
+            ['user', 'reportable_tasks', 'reportable_tasks.payload'])
+
+    def test_email_rollup_stats(self):
+        ''' test that the email report sums up rollup rows '''
+        outputs = OutputPlugins([os.path.join(
+            os.path.dirname(__file__), '..', 'plugins', 'output_plugins')])
+        rows = [AnsibleRollup('a', 'OK', True, 2), AnsibleRollup('a', 'FAILED', False, 1),
+                AnsibleRollup('b', 'OK', False, 3)]
+        reports = []
+        for name in ('screen', 'email'):
+            report = ''.join(outputs.plugins[name].render(rows, verbose=False,
+                                                          stats=True))
+            reports.append(sorted(line.strip() for line in report.splitlines()
+                                  if line.strip()))
+        self.assertEqual(reports[0], reports[1])
+        self.assertTrue([line for line in reports[1]
+                         if line.startswith('total') and 'ok=5' in line])
+
+    def test_playbook_stats(self):
+        ''' test that both reports sum up playbook stats from the summaries '''
+        outputs = OutputPlugins([os.path.join(
+            os.path.dirname(__file__), '..', 'plugins', 'output_plugins')])
+        tasks = []
+        def count_tasks(conn, cursor, statement, *args):
+            if 'task.id AS task_id' in statement:
+                tasks.append(statement)
+        sqlalchemy.event.listen(self.mgr.engine, 'before_cursor_execute', count_tasks)
+        for count in (1, 3):
+            self._add_playbooks(1 if count == 1 else 2)
+            for name in ('screen', 'email'):
+                for verbose in (False, True):
+                    self.mgr.session.expire_all()
+                    playbooks = AnsiblePlaybook.get_last_n_playbooks(
+                        self.mgr.session, args={'path': ['/tmp/site.yml']},
+                        limit=0, relations=['summaries'], reportable=not verbose)
+                    report = ''.join(outputs.plugins[name].render(
+                        playbooks, verbose=verbose, stats=True))
+                    totals = [line for line in report.splitlines()
+                              if line.strip().startswith('total')]
+                    self.assertEqual(len(totals), 1)
+                    self.assertTrue('failed=%d ' % (2 * count) in totals[0])
+                    self.assertTrue('ok=%d ' % (2 * count) in totals[0])
+        sqlalchemy.event.remove(self.mgr.engine, 'before_cursor_execute', count_tasks)
+        self.assertEqual(tasks, [])
+
+    def test_smtp_quote(self):
+        ''' test quoting of streamed email bodies '''
+        self.assertEqual(smtp_quote('.a\n..b\nc'), ('..a\r\n...b\r\nc', False))
+        self.assertEqual(smtp_quote('.d\n', False), ('.d\r\n', True))
+        self.assertEqual(smtp_quote('.e', False), ('.e', False))
+
+class TestReportCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache = ReportCache(os.path.join(self.dir, 'report.cache'), 4096)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.dir)
+
+    def test_store(self):
+        ''' test that reports are stored and least recently used evicted '''
+        chunks = list(self.cache.record('a', ['1'], None, [u'caf\xe9 ', 'au lait'],
+                                        cursor='next'))
+        self.assertEqual(chunks, [u'caf\xe9 ', 'au lait'])
+        entry = self.cache.get('a')
+        self.assertEqual(entry.body, 'caf\xc3\xa9 au lait')
+        self.assertEqual((entry.watermark, entry.cursor), (['1'], 'next'))
+        self.assertEqual(self.cache.get('b'), None)
+        big = os.urandom(1500)
+        self.cache.put('b', ['1'], None, None, big)
+        self.cache.get('a')
+        self.cache.put('c', ['1'], None, None, big)
+        self.cache.put('d', ['1'], None, None, big)
+        self.assertEqual(self.cache.get('b'), None)
+        self.assertNotEqual(self.cache.get('a'), None)
+        self.assertFalse(self.cache.put('e', ['1'], None, None, os.urandom(5000)))
+
+    def test_freshness(self):
+        ''' test that cached reports go stale when the database changes '''
+        mgr = Manager('sqlite://')
+        day = datetime.datetime(2013, 6, 15)
+        for hour in (1, 5):
+            task = AnsibleTask('a', 'ping', 'FAILED', {})
+            task.timestamp = day + datetime.timedelta(hours=hour)
+            mgr.save(task)
+        args = {'hostname': ['a']}
+        watermark = mgr.watermark()
+        entry = CachedReport(watermark, day, None, '')
+        fresh = lambda cutoff: entry.is_fresh(mgr.session, mgr.watermark(),
+                                              AnsibleTask, 'timestamp', args, cutoff)
+        self.assertTrue(fresh(day))
+        # moving the cutoff only matters once a task falls behind it
+        self.assertTrue(fresh(day + datetime.timedelta(minutes=30)))
+        self.assertFalse(fresh(day + datetime.timedelta(hours=2)))
+        self.assertTrue(entry.is_fresh(mgr.session, watermark, AnsibleTask,
+                                       'timestamp', {'hostname': ['b']},
+                                       day + datetime.timedelta(hours=2)))
+        mgr.bump_watermark('prune')
+        self.assertFalse(fresh(day))
+        entry.watermark = mgr.watermark()
+        mgr.save(AnsibleTask('b', 'ping', 'OK', {}))
+        self.assertFalse(fresh(day))
+
+class TestPrune(unittest.TestCase):
+
+    def setUp(self):
+        (fd, self.path) = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        os.unlink(self.path)
+        self.mgr = Manager('sqlite:///%s' % self.path)
+        self.old = datetime.datetime.now() - datetime.timedelta(days=30)
+        writer = Writer(self.mgr)
+        for n in range(4):
+            play = AnsiblePlaybook('prune-%d' % n)
+            writer.log_play(play)
+            for host in ('a', 'b', 'c'):
+                task = AnsibleTask(host, 'ping', 'OK', {'ping': 'x' * 4096})
+                writer.log_task(task)
+                if n < 2:
+                    task.timestamp = self.old
+            if n < 2:
+                play.starttime = self.old
+            writer.summarize(play)
+        writer.close()
+        self.mgr.save(AnsibleTask('d', 'ping', 'OK', {}))
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def test_prune(self):
+        ''' test that prune deletes in batches and cascades to tasks '''
+        age = self.old + datetime.timedelta(days=1)
+        reports = []
+        pruner = Pruner(self.mgr, batch=2,
+                        progress=lambda counts, rate: reports.append(dict(counts)))
+        counts = pruner.prune(
+            filter_clause(AnsiblePlaybook, {'starttime': age}, timeop=operator.le),
+            filter_clause(AnsibleTask, {'timestamp': age, 'hostname': ['b']},
+                          timeop=operator.le, intersection=True))
+        self.assertEqual((counts['playbook'], counts['task'], counts['summary']),
+                         (2, 6, 6))
+        # one playbook range and, within it, three task ranges
+        self.assertEqual([r['task'] for r in reports], [2, 4, 6, 6])
+        session = self.mgr.session
+        self.assertEqual(session.query(AnsiblePlaybook).count(), 2)
+        self.assertEqual(session.query(AnsibleTask).count(), 7)
+        self.assertEqual(session.query(AnsibleSummary).count(), 6)
+        self.assertEqual(AnsibleWatermark.get(session, 'prune'), 1)
+        self.assertTrue(self.mgr.incremental_vacuum(pages=1) > 0)
+        self.assertEqual(self.mgr.engine.execute('PRAGMA freelist_count').scalar(), 0)
+
+    def test_prune_summary(self):
+        ''' test that pruning tasks updates what is left of their playbooks '''
+        pruner = Pruner(self.mgr, batch=1)
+        pruner.prune(None, filter_clause(
+            AnsibleTask, {'timestamp': datetime.datetime.now(), 'hostname': ['a']},
+            timeop=operator.le, intersection=True))
+        session = self.mgr.session
+        for playbook in session.query(AnsiblePlaybook):
+            self.assertEqual(sorted(AnsiblePlaybook.get_playbook_stats(playbook)),
+                             ['b', 'c'])
+
+    def test_incremental_vacuum_stuck(self):
+        ''' test that vacuuming stops when a step frees nothing '''
+        with self.mgr.session.begin():
+            self.mgr.session.execute(AnsibleTask.__table__.delete())
+        def noop(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith('PRAGMA incremental_vacuum'):
+                statement = 'SELECT 1'
+            return (statement, parameters)
+        sqlalchemy.event.listen(self.mgr.engine, 'before_cursor_execute',
+                                noop, retval=True)
+        try:
+            self.assertEqual(self.mgr.incremental_vacuum(pages=1), 0)
+        finally:
+            sqlalchemy.event.remove(self.mgr.engine, 'before_cursor_execute', noop)
+        self.assertTrue(self.mgr.incremental_vacuum(pages=1) > 0)
+
+class TestWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.mgr = Manager('sqlite://')
+
+    def _count_tasks(self):
+        return self.mgr.session.query(AnsibleTask).count()
+
+    def test_buffered_writer(self):
+        ''' test that buffered tasks are written in batches '''
+        writer = BufferedWriter(self.mgr, size=3, interval=3600)
+        writer.log_play(AnsiblePlaybook('buffered'))
+        for n in range(2):
+            writer.log_task(AnsibleTask('localhost', 'ping', 'OK', {}))
+        self.assertEqual(self._count_tasks(), 0)
+        writer.log_task(AnsibleTask('localhost', 'ping', 'OK', {}))
+        self.assertEqual(self._count_tasks(), 3)
+        writer.log_task(AnsibleTask('localhost', 'ping', 'OK', {}))
+        writer.log_play(writer.playbook)
+        self.assertEqual(self._count_tasks(), 4)
+        tasks = self.mgr.session.query(AnsibleTask).all()
+        for task in tasks:
+            self.assertEqual(task.playbook_id, writer.playbook.id)
+            self.assertNotEqual(task.user_id, None)
+
+    def test_writer_user(self):
+        ''' test that the user is looked up once and stored once '''
+        writer = Writer(self.mgr)
+        for n in range(3):
+            writer.log_task(AnsibleTask('localhost', 'ping', 'OK', {}))
+        self.assertNotEqual(writer.user_id, None)
+        self.assertEqual(self.mgr.session.query(AnsibleUser).count(), 1)
+        (username, euid) = get_user()
+        user = AnsibleUser(username, euid)
+        self.assertRaises(sqlalchemy.exc.IntegrityError, self.mgr.save, user)
+
+    def test_buffered_writer_close(self):
+        ''' test that closing a writer flushes queued tasks '''
+        writer = BufferedWriter(self.mgr, size=100, interval=3600)
+        writer.log_task(AnsibleTask('localhost', 'ping', 'OK', {}))
+        self.assertEqual(self._count_tasks(), 0)
+        writer.close()
+        self.assertEqual(self._count_tasks(), 1)
+
+    def test_commit_policy(self):
+        ''' test that writes are committed as the commit policy says '''
+        (fd, path) = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        try:
+            uri = 'sqlite:///%s' % path
+            reader = Manager(uri)
+            count = lambda: reader.session.query(AnsibleTask).count()
+            writer = Writer(Manager(uri), policy='count', commit_interval=3)
+            writer.log_play(AnsiblePlaybook('count'))
+            writer.log_task(AnsibleTask('localhost', 'ping', 'OK', {}))
+            self.assertEqual(count(), 0)
+            writer.log_task(AnsibleTask('localhost', 'ping', 'OK', {}))
+            self.assertEqual(count(), 2)
+            writer.log_task(AnsibleTask('localhost', 'ping', 'OK', {}))
+            self.assertEqual(count(), 2)
+            writer.close()
+            self.assertEqual(count(), 3)
+            writer = Writer(Manager(uri), policy='run')
+            writer.log_play(AnsiblePlaybook('run'))
+            writer.log_task(AnsibleTask('localhost', 'ping', 'OK', {}))
+            writer.log_play(writer.playbook)
+            self.assertEqual(count(), 3)
+            writer.close()
+            self.assertEqual(count(), 4)
+        finally:
+            os.unlink(path)
+
+class TestAsyncWriter(unittest.TestCase):
+
+    def setUp(self):
+        (fd, self.path) = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        self.uri = 'sqlite:///%s' % self.path
+        self.mgr = Manager(self.uri)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def _log_run(self, writer, count):
+        writer.log_play(AnsiblePlaybook('async'))
+        for n in range(count):
+            writer.log_task(AnsibleTask('localhost', 'ping', 'OK', {}))
+        writer.log_play(writer.playbook)
+        writer.close()
+
+    def test_async_writer_spill(self):
+        ''' test that spilled events are written when the writer drains '''
+        writer = AsyncWriter(self.uri, size=1, overflow='spill')
+        self._log_run(writer, 50)
+        self.assertEqual(self.mgr.session.query(AnsibleTask).count(), 50)
+        playbook = self.mgr.session.query(AnsiblePlaybook).one()
+        for task in self.mgr.session.query(AnsibleTask):
+            self.assertEqual(task.playbook_id, playbook.id)
+
+    def test_async_writer_fork(self):
+        ''' test that tasks logged by forked workers keep their playbook '''
+        os.unlink(self.path)
+        writer = AsyncWriter(self.uri)
+        writer.log_play(AnsiblePlaybook('fork'))
+        def work(n):
+            for i in range(3):
+                writer.log_task(AnsibleTask('worker%d' % n, 'ping', 'OK', {}))
+        workers = [multiprocessing.Process(target=work, args=(n,))
+                   for n in range(3)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+            self.assertEqual(worker.exitcode, 0)
+        writer.summarize(writer.playbook)
+        writer.close()
+        self.assertEqual(writer.lost, 0)
+        mgr = Manager(self.uri)
+        playbook = mgr.session.query(AnsiblePlaybook).one()
+        tasks = mgr.session.query(AnsibleTask).all()
+        self.assertEqual(len(tasks), 9)
+        for task in tasks:
+            self.assertEqual(task.playbook_id, playbook.id)
+        self.assertEqual(sorted(s.hostname for s in playbook.summaries),
+                         ['worker0', 'worker1', 'worker2'])
+
+    def test_async_writer_spill_summary(self):
+        ''' test that spilled tasks are written before their summary '''
+        writer = AsyncWriter(self.uri, overflow='spill')
+        thread_writer = BufferedWriter(Manager(self.uri))
+        plays = {}
+        play = AnsiblePlaybook('spill-summary')
+        writer._handle(thread_writer, plays, ('play', play.uuid, play))
+        for n in range(5):
+            task = AnsibleTask('localhost', 'ping', 'OK', {})
+            writer._next_seq(task)
+            writer._spill(('task', play.uuid, task))
+        writer._handle(thread_writer, plays, ('summary', play.uuid, None))
+        thread_writer.close()
+        summary = self.mgr.session.query(AnsibleSummary).one()
+        self.assertEqual(summary.ok, 5)
+
+    def test_async_writer_drop(self):
+        ''' test that dropped OK results are accounted for '''
+        writer = AsyncWriter(self.uri, size=1, overflow='drop')
+        self._log_run(writer, 50)
+        count = self.mgr.session.query(AnsibleTask).count()
+        self.assertEqual(count + writer.dropped, 50)
+
+class TestSpool(unittest.TestCase):
+
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+        self.mgr = Manager('sqlite://')
+
+    def tearDown(self):
+        shutil.rmtree(self.spool_dir)
+
+    def test_spool_ingest(self):
+        ''' test that spooled events load into the database '''
+        writer = SpoolWriter(self.spool_dir, fsync=2)
+        playbook = AnsiblePlaybook('spool')
+        playbook.starttime = datetime.datetime.now()
+        writer.log_play(playbook)
+        for n in range(5):
+            writer.log_task(AnsibleTask('localhost', 'ping', 'OK',
+                                        {'changed': n % 2 == 0}))
+        playbook.path = '/tmp/spool.yml'
+        writer.log_play(playbook)
+        writer.close()
+        # simulate a crash in the middle of writing a record
+        f = open(writer.path, 'ab')
+        f.write('{"type":"task","hostn')
+        f.close()
+        loader = SpoolLoader(self.mgr, batch=2)
+        self.assertEqual(loader.load(writer.path), 5)
+        playbook = self.mgr.session.query(AnsiblePlaybook).one()
+        self.assertEqual(playbook.path, '/tmp/spool.yml')
+        tasks = self.mgr.session.query(AnsibleTask).all()
+        self.assertEqual(len(tasks), 5)
+        self.assertEqual(len([t for t in tasks if t.changed]), 3)
+        for task in tasks:
+            self.assertEqual(task.playbook_id, playbook.id)
+            self.assertEqual(task.user_id, playbook.user_id)
+        self.assertEqual(sorted([t.seq for t in tasks]), range(1, 6))
+        return writer.path
+
+    def test_spool_ingest_replay(self):
+        ''' test that loading a spool again does not duplicate tasks '''
+        path = self.test_spool_ingest()
+        loader = SpoolLoader(self.mgr)
+        self.assertEqual(loader.load(path), 0)
+        self.assertEqual(loader.skipped, 5)
+        # pretend the last batch of an earlier load never committed
+        with self.mgr.session.begin():
+            self.mgr.session.query(AnsibleTask).filter(
+                AnsibleTask.seq > 3).delete()
+        loader = SpoolLoader(self.mgr)
+        self.assertEqual(loader.load(path), 2)
+        self.assertEqual(self.mgr.session.query(AnsibleTask).count(), 5)
+        task = self.mgr.session.query(AnsibleTask).filter_by(seq=1).one()
+        row = {'hostname': task.hostname, 'playbook_id': task.playbook_id,
+               'seq': task.seq}
+        self.mgr.insert_many(AnsibleTask.__table__, [row], skip_existing=True)
+        self.assertEqual(self.mgr.session.query(AnsibleTask).count(), 5)
+
+    def test_spool_workers(self):
+        ''' test that forked workers append to the playbook's spool '''
+        writer = SpoolWriter(self.spool_dir)
+        writer.log_play(AnsiblePlaybook('spool-workers'))
+        def work(n):
+            for i in range(3):
+                writer.log_task(AnsibleTask('worker%d' % n, 'ping', 'OK', {}))
+        for batch in range(2):
+            workers = [multiprocessing.Process(target=work, args=(n,))
+                       for n in range(3)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        writer.close()
+        self.assertEqual(find_spools([self.spool_dir]), [writer.path])
+        loader = SpoolLoader(self.mgr)
+        self.assertEqual(loader.load(writer.path), 18)
+        playbook = self.mgr.session.query(AnsiblePlaybook).one()
+        tasks = self.mgr.session.query(AnsibleTask).all()
+        self.assertEqual(sorted(task.seq for task in tasks), range(1, 19))
+        for task in tasks:
+            self.assertEqual(task.playbook_id, playbook.id)
+
+    def test_spool_order(self):
+        ''' test that worker spools load no matter which spool comes first '''
+        parent = SpoolWriter(self.spool_dir)
+        playbook = AnsiblePlaybook('spool-order')
+        parent.log_play(playbook)
+        parent.log_task(AnsibleTask('parent', 'ping', 'OK', {}))
+        parent.close()
+        for n in range(2):
+            worker = SpoolWriter(self.spool_dir)
+            worker.playbook = playbook
+            worker.seq = parent.seq
+            worker.log_task(AnsibleTask('worker%d' % n, 'ping', 'OK', {}))
+            worker.close()
+        spools = find_spools([self.spool_dir])
+        # worst case: the play record comes last
+        spools.remove(parent.path)
+        spools.append(parent.path)
+        loader = SpoolLoader(self.mgr)
+        self.assertEqual(loader.load(spools[0]), 0)
+        self.assertEqual(loader.held, 1)
+        for path in spools:
+            loader.load_plays(path)
+        for path in spools + spools:
+            loader.load(path)
+        tasks = self.mgr.session.query(AnsibleTask).all()
+        self.assertEqual(len(tasks), 3)
+        playbook = self.mgr.session.query(AnsiblePlaybook).one()
+        for task in tasks:
+            self.assertEqual(task.playbook_id, playbook.id)
+
+class TestGitVersion(unittest.TestCase):
+
+    SHA1 = '0123456789abcdef0123456789abcdef01234567'
+    SHA2 = 'fedcba9876543210fedcba9876543210fedcba98'
+
+    def setUp(self):
+        self.repo = tempfile.mkdtemp()
+        self.git_dir = os.path.join(self.repo, '.git')
+        os.makedirs(os.path.join(self.git_dir, 'refs', 'heads'))
+        os.makedirs(os.path.join(self.repo, 'roles'))
+        self.playbook = os.path.join(self.repo, 'roles', 'site.yml')
+
+    def tearDown(self):
+        shutil.rmtree(self.repo)
+
+    def _write(self, path, data):
+        # write via rename, like git does
+        f = open(path + '.lock', 'w')
+        f.write(data)
+        f.close()
+        os.rename(path + '.lock', path)
+
+    def test_git_version_refs(self):
+        ''' test loose and packed refs and detached HEAD '''
+        self._write(os.path.join(self.git_dir, 'HEAD'),
+                    'ref: refs/heads/master\n')
+        self._write(os.path.join(self.git_dir, 'packed-refs'),
+                    '# pack-refs with: peeled\n%s refs/heads/master\n' % self.SHA1)
+        self.assertEqual(git_version(self.playbook), self.SHA1[:10])
+        self._write(os.path.join(self.git_dir, 'refs', 'heads', 'master'),
+                    self.SHA2 + '\n')
+        self.assertEqual(git_version(self.playbook), self.SHA2[:10])
+        self._write(os.path.join(self.git_dir, 'HEAD'), self.SHA1 + '\n')
+        self.assertEqual(git_version(self.playbook), self.SHA1[:10])
+
+    def test_git_version_worktree(self):
+        ''' test a worktree pointing back at the main repo '''
+        worktree = os.path.join(self.git_dir, 'worktrees', 'wt')
+        os.makedirs(worktree)
+        self._write(os.path.join(worktree, 'HEAD'), 'ref: refs/heads/wt\n')
+        self._write(os.path.join(worktree, 'commondir'), '../..\n')
+        self._write(os.path.join(self.git_dir, 'refs', 'heads', 'wt'),
+                    self.SHA2 + '\n')
+        checkout = os.path.join(self.repo, 'checkout')
+        os.makedirs(checkout)
+        self._write(os.path.join(checkout, '.git'), 'gitdir: %s\n' % worktree)
+        self.assertEqual(git_version(os.path.join(checkout, 'site.yml')),
+                         self.SHA2[:10])
+
+    def test_git_version_no_repo(self):
+        ''' test a playbook outside of any repo '''
+        shutil.rmtree(self.git_dir)
+        self.assertEqual(git_version('/site.yml'), 'NA')
+
 class TestPlugin(unittest.TestCase):
 
     def setUp(self):